@@ -0,0 +1,74 @@
+# adaptive_sampler.py — when the VM capture loop takes its next sample.
+#
+# A fixed interval is wrong both ways: right after an act (unmute, capture_now, a
+# detected change) the screen is mid-transition and a slow sample delays detection,
+# while an idle desktop sampled twice a second burns CPU for nothing. Here:
+#
+#   - kick() (unmute, capture_now) and a changed tick drop the interval to min_sec;
+#     kick() also wakes a loop that is already sleeping
+#   - every unchanged tick multiplies it by backoff, up to max_sec
+#   - cpu_budget caps the loop's share of one CPU: the CPU time the sender and its
+#     finished children (gnome-screenshot) spent while a tick did its work (EMA over
+#     ticks) stretches the sleep after it to work * (1 / cpu_budget - 1), even below
+#     the min rate (a slow capture backend can't take over the VM)
+
+import os
+import threading
+
+SAMPLE_MIN_SEC = 0.1
+SAMPLE_MAX_SEC = 2.0
+SAMPLE_BACKOFF = 1.5
+CPU_BUDGET = 0.25            # fraction of one CPU; 0 = no limit
+COST_EMA = 0.3               # weight of the newest tick in the per-tick CPU estimate
+
+
+class AdaptiveSampler:
+    def __init__(self, min_sec: float = SAMPLE_MIN_SEC, max_sec: float = SAMPLE_MAX_SEC,
+                 backoff: float = SAMPLE_BACKOFF, cpu_budget: float = CPU_BUDGET):
+        self.min_sec = min_sec
+        self.max_sec = max_sec
+        self.backoff = backoff
+        self.cpu_budget = cpu_budget
+        self.interval = min_sec
+        self.cost = 0.0              # CPU seconds per tick (EMA)
+        self._wake = threading.Event()
+        self._cpu_mark = _cpu_seconds()
+
+    def kick(self):
+        """Sample fast from now on and wake the loop if it is sleeping (any thread)."""
+        self.interval = self.min_sec
+        self._wake.set()
+
+    def update(self, changed: bool):
+        """Result of the tick just done: the screen changed (or is still settling) or not."""
+        if changed:
+            self.interval = self.min_sec
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_sec)
+
+    def delay(self) -> float:
+        """Seconds until the next sample: the interval, or longer if the CPU budget says so."""
+        if not self.cpu_budget:
+            return self.interval
+        return max(self.interval, self.cost * (1.0 / self.cpu_budget - 1.0))
+
+    def sleep(self):
+        """End of a sampling tick: account its CPU, then wait delay() (or until kicked)."""
+        cpu = _cpu_seconds() - self._cpu_mark
+        self.cost += COST_EMA * (cpu - self.cost)
+        self._wait(self.delay())
+
+    def pause(self, sec: float):
+        """Wait without sampling (muted, error backoff); a kick still ends it early."""
+        self._wait(sec)
+
+    def _wait(self, sec: float):
+        self._wake.wait(sec)
+        self._wake.clear()
+        self._cpu_mark = _cpu_seconds()
+
+
+def _cpu_seconds() -> float:
+    """CPU time of this process plus its reaped children (capture subprocesses)."""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
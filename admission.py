@@ -0,0 +1,91 @@
+# admission.py — byte budgets for frames between "length known" and "durable".
+#
+# Every frame the server is about to read reserves its size against two budgets
+# before a single payload byte is buffered:
+#   per connection  CONN_INFLIGHT_MAX_BYTES   a sender can't hog memory on its own
+#   global          GLOBAL_INFLIGHT_MAX_BYTES all senders together can't push the
+#                                             host into swap
+# and gives it back once the disk writer has made it durable (or it was dropped).
+# A connection over its own budget simply stops being read until its frames land
+# (TCP pushes back on the sender). When the global budget is exhausted the server
+# first drops the oldest frames still waiting in the per-VM queues, then waits up
+# to ADMIT_WAIT_SEC, and only then rejects the new frame. Both cases are reported
+# to the caller as "pressure" so the sender can be told to slow down.
+#
+# All bookkeeping runs on the event loop thread; release_threadsafe() is the
+# entry point for the writer thread.
+
+import asyncio
+
+GLOBAL_INFLIGHT_MAX_BYTES = 512 * 1024 * 1024
+CONN_INFLIGHT_MAX_BYTES = 128 * 1024 * 1024
+ADMIT_WAIT_SEC = 5.0
+
+
+class ConnBudget:
+    """Bytes reserved by one connection."""
+
+    def __init__(self):
+        self.inflight = 0
+
+
+class Admission:
+    def __init__(self, global_max: int = GLOBAL_INFLIGHT_MAX_BYTES,
+                 conn_max: int = CONN_INFLIGHT_MAX_BYTES, wait_sec: float = ADMIT_WAIT_SEC):
+        self.global_max = global_max
+        self.conn_max = conn_max
+        self.wait_sec = wait_sec
+        self.inflight = 0
+        self._cond = None        # created on the running loop
+        self._loop = None
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._loop = asyncio.get_running_loop()
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self, conn: ConnBudget, n: int, make_room=None) -> tuple[bool, bool]:
+        """
+        Reserve n bytes for conn. make_room(n) is an async callable that may drop
+        queued frames to free global budget. Returns (admitted, under_pressure).
+        """
+        cond = self._condition()
+        pressure = False
+        if self.inflight + n > self.global_max and make_room is not None:
+            pressure = True
+            await make_room(self.inflight + n - self.global_max)
+        async with cond:
+            # A connection may always have one frame in flight, however large
+            if conn.inflight and conn.inflight + n > self.conn_max:
+                pressure = True
+                if not await self._wait(cond, lambda: not conn.inflight or conn.inflight + n <= self.conn_max):
+                    return False, True
+            if self.inflight + n > self.global_max:
+                pressure = True
+                if not await self._wait(cond, lambda: self.inflight + n <= self.global_max):
+                    return False, True
+            conn.inflight += n
+            self.inflight += n
+            return True, pressure
+
+    async def _wait(self, cond: asyncio.Condition, pred) -> bool:
+        try:
+            await asyncio.wait_for(cond.wait_for(pred), self.wait_sec)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def release(self, conn: ConnBudget, n: int):
+        """Return n bytes of conn's reservation (event loop thread)."""
+        conn.inflight -= n
+        self.inflight -= n
+        if self._cond is not None:
+            asyncio.ensure_future(self._notify())
+
+    async def _notify(self):
+        async with self._cond:
+            self._cond.notify_all()
+
+    def release_threadsafe(self, conn: ConnBudget, n: int):
+        self._loop.call_soon_threadsafe(self.release, conn, n)
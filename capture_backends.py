@@ -0,0 +1,435 @@
+# capture_backends.py — screen capture for the VM senders, in process where possible.
+#
+# gnome-screenshot forks a process, encodes a PNG to disk, and the sender reads it back
+# and decodes it again to hash it: hundreds of ms and most of a vCPU per sample. The
+# X11 backends read the root window's pixels straight into memory instead:
+#
+#   xshm              MIT-SHM: the X server copies the frame into a shared memory
+#                     segment we keep mapped (one memcpy, no socket transfer)
+#   xgetimage         plain XGetImage over the X connection (remote or no-SHM displays)
+#   gnome-screenshot  the old path; also the only one that works under Wayland, where
+#                     the X root window is empty
+#
+# open_backend() returns the first of CAPTURE_BACKENDS that works on this display.
+# grab() returns a Capture holding the frame as it came: the X backends' raw 32-bit
+# pixels, or gnome-screenshot's PNG. Change detection works on those directly
+# (same_pixels(), gray() thumbnails read a fraction of the rows straight from the
+# raw buffer); the full RGB image and the PNG are only built for frames being sent.
+#
+#   python3 capture_backends.py list
+#   python3 capture_backends.py bench [-n 30]       capture latency per backend
+
+import argparse
+import ctypes
+import ctypes.util
+import io
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from PIL import Image
+
+import frame_trace
+
+CAPTURE_BACKENDS = ("xshm", "xgetimage", "gnome-screenshot")
+GNOME_SCREENSHOT_PATH = Path("/tmp/screen.png")
+PNG_LEVEL = 1                # PNGs made from raw pixels (deltas and keyframes re-use them)
+GRAY_OVERSAMPLE = 4          # gray(): read about this many source rows/columns per output pixel
+
+
+class CaptureError(Exception):
+    """A backend that cannot be used here, or a grab that failed."""
+
+
+class Capture:
+    """
+    One screen grab: raw pixels (32 bpp, `stride` bytes per row, Pillow rawmode BGRX
+    or RGBX), a PIL image or a PNG. image (RGB) and png are each produced on first use.
+    """
+
+    def __init__(self, image: Image.Image | None = None, png: bytes | None = None, trace: dict | None = None,
+                 raw: bytes | None = None, size: tuple[int, int] | None = None, stride: int = 0,
+                 rawmode: str = "BGRX"):
+        self._image = image
+        self._png = png
+        self.raw = raw
+        self.size = size or (image.size if image is not None else None)
+        self.stride = stride
+        self.rawmode = rawmode
+        self.trace = trace or {}     # frame_trace stamps: capture_start, capture_end
+
+    @property
+    def image(self) -> Image.Image:
+        if self._image is None:
+            if self.raw is not None:
+                self._image = Image.frombytes("RGB", self.size, self.raw, "raw", self.rawmode, self.stride)
+            else:
+                with Image.open(io.BytesIO(self._png)) as im:
+                    self._image = im.convert("RGB")
+            self.size = self._image.size
+        return self._image
+
+    def same_pixels(self, other: "Capture | None") -> bool:
+        """True if other is a raw grab with exactly these pixels (one memcmp, no decoding)."""
+        return (other is not None and self.raw is not None and other.size == self.size
+                and other.stride == self.stride and other.raw == self.raw)
+
+    def gray(self, size: tuple[int, int]) -> Image.Image:
+        """
+        Grayscale thumbnail of the frame at `size`. From raw pixels only every n-th row
+        is read (a zero-copy view) and box-reduced before the final LANCZOS resize, so
+        a 1080p frame costs about 1 ms instead of a full-size conversion.
+        """
+        if self.raw is None or self._image is not None:
+            im = self.image
+        else:
+            w, h = self.size
+            step = max(1, h // (size[1] * GRAY_OVERSAMPLE))
+            im = Image.frombuffer("RGBX", (w, h // step), self.raw, "raw", "RGBX", self.stride * step, 1)
+        w, h = im.size
+        factor = (max(1, w // (size[0] * GRAY_OVERSAMPLE)), max(1, h // (size[1] * GRAY_OVERSAMPLE)))
+        if factor != (1, 1):
+            im = im.reduce(factor)
+        if im.mode == "RGBX":
+            c0, g, c2, _ = im.split()
+            im = Image.merge("RGB", (c2, g, c0) if self.rawmode == "BGRX" else (c0, g, c2))
+        return im.resize(size, Image.Resampling.LANCZOS).convert("L")
+
+    @property
+    def png(self) -> bytes:
+        if self._png is None:
+            out = io.BytesIO()
+            self.image.save(out, "PNG", compress_level=PNG_LEVEL)
+            self._png = out.getvalue()
+        return self._png
+
+    def png_if_encoded(self) -> bytes | None:
+        """The PNG if the backend delivered one (free to reuse), else None."""
+        return self._png
+
+
+# ---- gnome-screenshot ----------------------------------------------------------
+class GnomeScreenshotBackend:
+    name = "gnome-screenshot"
+
+    def __init__(self, path: Path = GNOME_SCREENSHOT_PATH):
+        if shutil.which("gnome-screenshot") is None:
+            raise CaptureError("'gnome-screenshot' not found")
+        self.path = path
+
+    def grab(self) -> Capture:
+        trace = {"capture_start": frame_trace.stamp()}
+        try:
+            subprocess.run(["gnome-screenshot", "-f", str(self.path)], check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            raise CaptureError(f"screenshot failed: {e.stderr.decode(errors='replace')}") from e
+        png = self.path.read_bytes()
+        trace["capture_end"] = frame_trace.stamp()
+        return Capture(png=png, trace=trace)
+
+    def close(self):
+        pass
+
+
+# ---- X11 (ctypes) --------------------------------------------------------------
+ZPIXMAP = 2
+ALL_PLANES = 0xFFFFFFFF
+IPC_PRIVATE = 0
+IPC_CREAT = 0o1000
+IPC_RMID = 0
+
+
+class _XImage(ctypes.Structure):
+    # leading fields of Xlib's XImage; the rest (obdata, funcs) is never touched here
+    _fields_ = [("width", ctypes.c_int), ("height", ctypes.c_int), ("xoffset", ctypes.c_int),
+                ("format", ctypes.c_int), ("data", ctypes.c_void_p), ("byte_order", ctypes.c_int),
+                ("bitmap_unit", ctypes.c_int), ("bitmap_bit_order", ctypes.c_int),
+                ("bitmap_pad", ctypes.c_int), ("depth", ctypes.c_int), ("bytes_per_line", ctypes.c_int),
+                ("bits_per_pixel", ctypes.c_int), ("red_mask", ctypes.c_ulong),
+                ("green_mask", ctypes.c_ulong), ("blue_mask", ctypes.c_ulong)]
+
+
+class _XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [("shmseg", ctypes.c_ulong), ("shmid", ctypes.c_int),
+                ("shmaddr", ctypes.c_void_p), ("readOnly", ctypes.c_int)]
+
+
+_XErrorHandler = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
+_x_errors = []               # X errors since the last check; Xlib's default handler would exit()
+
+
+@_XErrorHandler
+def _on_x_error(_display, _event):
+    _x_errors.append(1)
+    return 0
+
+
+def _load(name: str):
+    path = ctypes.util.find_library(name)
+    if path is None:
+        raise CaptureError(f"lib{name} not found")
+    return ctypes.CDLL(path)
+
+
+_xlib = None
+
+
+def _x11():
+    """libX11 with the prototypes used here (loaded once)."""
+    global _xlib
+    if _xlib is None:
+        x = _load("X11")
+        x.XOpenDisplay.restype = ctypes.c_void_p
+        x.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        x.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        x.XDefaultScreen.argtypes = [ctypes.c_void_p]
+        x.XRootWindow.restype = ctypes.c_ulong
+        x.XRootWindow.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x.XDefaultVisual.restype = ctypes.c_void_p
+        x.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x.XGetGeometry.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(ctypes.c_ulong)] + \
+            [ctypes.POINTER(ctypes.c_int)] * 2 + [ctypes.POINTER(ctypes.c_uint)] * 4
+        x.XGetImage.restype = ctypes.POINTER(_XImage)
+        x.XGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.c_int,
+                                ctypes.c_uint, ctypes.c_uint, ctypes.c_ulong, ctypes.c_int]
+        x.XDestroyImage.argtypes = [ctypes.POINTER(_XImage)]
+        x.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+        x.XSetErrorHandler(_on_x_error)
+        _xlib = x
+    return _xlib
+
+
+def _rawmode(img: _XImage) -> str:
+    if img.bits_per_pixel != 32:
+        raise CaptureError(f"unsupported X pixel format ({img.bits_per_pixel} bpp)")
+    if img.red_mask == 0xFF0000 and sys.byteorder == "little":
+        return "BGRX"
+    if img.red_mask == 0xFF:
+        return "RGBX"
+    raise CaptureError(f"unsupported X pixel layout (red mask {img.red_mask:#x})")
+
+
+class XGetImageBackend:
+    name = "xgetimage"
+
+    def __init__(self):
+        self.x = _x11()
+        self.display = self.x.XOpenDisplay(None)
+        if not self.display:
+            raise CaptureError("cannot open X display (is DISPLAY set?)")
+        self.screen = self.x.XDefaultScreen(self.display)
+        self.root = self.x.XRootWindow(self.display, self.screen)
+
+    def size(self) -> tuple[int, int]:
+        """Current root window size (follows resolution changes)."""
+        root, x, y = ctypes.c_ulong(), ctypes.c_int(), ctypes.c_int()
+        w, h, border, depth = ctypes.c_uint(), ctypes.c_uint(), ctypes.c_uint(), ctypes.c_uint()
+        if not self.x.XGetGeometry(self.display, self.root, ctypes.byref(root), ctypes.byref(x), ctypes.byref(y),
+                                   ctypes.byref(w), ctypes.byref(h), ctypes.byref(border), ctypes.byref(depth)):
+            raise CaptureError("XGetGeometry failed")
+        return w.value, h.value
+
+    def grab(self) -> Capture:
+        trace = {"capture_start": frame_trace.stamp()}
+        w, h = self.size()
+        ptr = self.x.XGetImage(self.display, self.root, 0, 0, w, h, ALL_PLANES, ZPIXMAP)
+        if not ptr:
+            raise CaptureError("XGetImage failed")
+        try:
+            img = ptr.contents
+            raw = ctypes.string_at(img.data, img.bytes_per_line * h)
+            stride, rawmode = img.bytes_per_line, _rawmode(img)
+        finally:
+            self.x.XDestroyImage(ptr)
+        trace["capture_end"] = frame_trace.stamp()
+        return Capture(raw=raw, size=(w, h), stride=stride, rawmode=rawmode, trace=trace)
+
+    def close(self):
+        if self.display:
+            self.x.XCloseDisplay(self.display)
+            self.display = None
+
+
+class XShmBackend(XGetImageBackend):
+    name = "xshm"
+
+    def __init__(self):
+        super().__init__()
+        try:
+            self.xext = _load("Xext")
+            self.libc = _load("c")
+        except CaptureError:
+            self.close()
+            raise
+        self.xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        self.xext.XShmCreateImage.restype = ctypes.POINTER(_XImage)
+        self.xext.XShmCreateImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+                                              ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo),
+                                              ctypes.c_uint, ctypes.c_uint]
+        self.xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        self.xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        self.xext.XShmGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(_XImage),
+                                           ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+        self.libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        self.libc.shmat.restype = ctypes.c_void_p
+        self.libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        self.libc.shmdt.argtypes = [ctypes.c_void_p]
+        self.libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+        if not self.xext.XShmQueryExtension(self.display):
+            self.close()
+            raise CaptureError("X server has no MIT-SHM (remote display?)")
+        self.shm = None
+        self.ximage = None
+        self.dims = None
+        try:
+            self._attach(*self.size())
+        except CaptureError:
+            self.close()
+            raise
+
+    def _attach(self, w: int, h: int):
+        self._detach()
+        shm = _XShmSegmentInfo()
+        ptr = self.xext.XShmCreateImage(self.display, self.x.XDefaultVisual(self.display, self.screen),
+                                        self.x.XDefaultDepth(self.display, self.screen), ZPIXMAP, None,
+                                        ctypes.byref(shm), w, h)
+        if not ptr:
+            raise CaptureError("XShmCreateImage failed")
+        img = ptr.contents
+        shm.shmid = self.libc.shmget(IPC_PRIVATE, img.bytes_per_line * h, IPC_CREAT | 0o600)
+        if shm.shmid < 0:
+            self.x.XDestroyImage(ptr)
+            raise CaptureError("shmget failed")
+        addr = self.libc.shmat(shm.shmid, None, 0)
+        if addr in (None, ctypes.c_void_p(-1).value):
+            self.libc.shmctl(shm.shmid, IPC_RMID, None)
+            self.x.XDestroyImage(ptr)
+            raise CaptureError("shmat failed")
+        shm.shmaddr = img.data = addr
+        shm.readOnly = 0
+        del _x_errors[:]
+        self.xext.XShmAttach(self.display, ctypes.byref(shm))
+        self.x.XSync(self.display, 0)
+        self.libc.shmctl(shm.shmid, IPC_RMID, None)   # freed once both sides detach
+        self.shm, self.ximage, self.dims = shm, ptr, (w, h)
+        if _x_errors:
+            self._detach()
+            raise CaptureError("XShmAttach failed (X server on another host?)")
+
+    def _detach(self):
+        if self.shm is None:
+            return
+        self.xext.XShmDetach(self.display, ctypes.byref(self.shm))
+        self.x.XSync(self.display, 0)
+        self.ximage.contents.data = None     # the segment is not Xlib's to free
+        self.x.XDestroyImage(self.ximage)
+        self.libc.shmdt(self.shm.shmaddr)
+        self.shm = self.ximage = self.dims = None
+
+    def grab(self) -> Capture:
+        trace = {"capture_start": frame_trace.stamp()}
+        dims = self.size()
+        if dims != self.dims:
+            self._attach(*dims)
+        del _x_errors[:]
+        if not self.xext.XShmGetImage(self.display, self.root, self.ximage, 0, 0, ALL_PLANES) or _x_errors:
+            raise CaptureError("XShmGetImage failed")
+        img = self.ximage.contents
+        # copied out of the segment, which the next grab overwrites
+        raw = ctypes.string_at(img.data, img.bytes_per_line * dims[1])
+        trace["capture_end"] = frame_trace.stamp()
+        return Capture(raw=raw, size=dims, stride=img.bytes_per_line, rawmode=_rawmode(img), trace=trace)
+
+    def close(self):
+        if self.display:
+            self._detach()
+        super().close()
+
+
+BACKENDS = {
+    "xshm": XShmBackend,
+    "xgetimage": XGetImageBackend,
+    "gnome-screenshot": GnomeScreenshotBackend,
+}
+
+
+def open_backend(names=CAPTURE_BACKENDS):
+    """First backend in names that works here; CaptureError listing why each failed."""
+    reasons = []
+    for name in names:
+        try:
+            backend = BACKENDS[name]()
+        except (CaptureError, OSError) as e:
+            reasons.append(f"{name}: {e}")
+            continue
+        try:
+            backend.grab()           # e.g. an X display that refuses reads
+            return backend
+        except (CaptureError, OSError) as e:
+            backend.close()          # display connection, shared memory segment
+            reasons.append(f"{name}: {e}")
+    raise CaptureError("no capture backend works: " + "; ".join(reasons))
+
+
+# ---- CLI ---------------------------------------------------------------------
+def bench(names, n: int):
+    if n < 1:
+        raise ValueError("bench needs at least one grab")
+    print(f"{'backend':18s} {'grab p50':>9s} {'grab p90':>9s} {'+hash p50':>9s} {'+png p50':>9s} "
+          f"{'size':>11s}   (ms, {n} grabs)")
+    for name in names:
+        try:
+            backend = BACKENDS[name]()
+        except (CaptureError, OSError) as e:
+            print(f"{name:18s} unavailable: {e}")
+            continue
+        grabs, hashes, pngs = [], [], []
+        try:
+            for _ in range(n):
+                t0 = time.perf_counter()
+                cap = backend.grab()
+                t1 = time.perf_counter()
+                cap.gray((9, 8))         # what an idle tick costs on top of the grab
+                t2 = time.perf_counter()
+                im = cap.image
+                cap.png
+                t3 = time.perf_counter()
+                grabs.append((t1 - t0) * 1000)
+                hashes.append((t2 - t0) * 1000)
+                pngs.append((t3 - t0) * 1000)
+        except (CaptureError, OSError) as e:
+            print(f"{name:18s} failed: {e}")
+            continue
+        finally:
+            backend.close()
+        print(f"{name:18s} {frame_trace.percentile(grabs, 50):9.1f} {frame_trace.percentile(grabs, 90):9.1f} "
+              f"{frame_trace.percentile(hashes, 50):9.1f} {frame_trace.percentile(pngs, 50):9.1f} "
+              f"{im.width:5d}x{im.height:<5d}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Screen capture backends")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list", help="which backends work on this display")
+    b = sub.add_parser("bench", help="capture latency per backend")
+    b.add_argument("-n", type=int, default=30, help="grabs per backend (>= 1)")
+    b.add_argument("backends", nargs="*", default=list(CAPTURE_BACKENDS))
+    args = ap.parse_args()
+    if args.cmd == "list":
+        for name, cls in BACKENDS.items():
+            try:
+                cls().close()
+                print(f"{name:18s} ok")
+            except (CaptureError, OSError) as e:
+                print(f"{name:18s} unavailable: {e}")
+    else:
+        if args.n < 1:
+            ap.error("-n must be at least 1")
+        bench(args.backends, args.n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# disk_writer.py — write-behind stage between ingest and the run directories.
+#
+# Ingest only enqueues (store, frame, meta); one writer thread drains the queue in
+# batches: stage every frame in the batch, fsync once per run, then atomically
+# publish latest.json for the newest frame. A single writer keeps latest.json
+# monotonic, and since publication follows the fsync, latest.json never points
+# at an image that is not yet on disk.
+
+import queue
+import threading
+import time
+
+import metrics
+
+WRITER_QUEUE_MAX = 64          # frames waiting for the writer before submit() blocks
+WRITER_BATCH_MAX = 16          # frames per fsync batch
+WRITER_BATCH_WINDOW_SEC = 0.02 # how long to wait for more frames after the first
+
+STAGE_SECONDS = metrics.histogram("auroch_writer_stage_seconds", "Time to write one frame's blobs and record (no fsync)")
+SYNC_SECONDS = metrics.histogram("auroch_writer_sync_seconds", "Time to fsync one run and publish latest.json")
+BATCH_FRAMES = metrics.histogram("auroch_writer_batch_frames", "Frames per writer batch",
+                                 buckets=(1, 2, 4, 8, 16, 32, 64))
+
+
+class DiskWriter:
+    """
+    Bounded write-behind queue with batched fsync.
+
+    stage(store, frame, meta) -> record writes blobs/records (no fsync)
+    on_durable(store, record, meta, ctx) called after the record is synced and
+                                        latest.json points at (or past) it
+    on_failed(store, meta, ctx)         called instead for frames that could not be
+                                        staged or synced
+    """
+
+    def __init__(self, stage, on_durable=None, max_queue: int = WRITER_QUEUE_MAX,
+                 batch_max: int = WRITER_BATCH_MAX, batch_window_sec: float = WRITER_BATCH_WINDOW_SEC,
+                 on_failed=None):
+        self.stage = stage
+        self.on_durable = on_durable
+        self.on_failed = on_failed
+        self.batch_max = batch_max
+        self.batch_window_sec = batch_window_sec
+        self.q = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="disk-writer", daemon=True)
+        self._thread.start()
+
+    def qsize(self) -> int:
+        return self.q.qsize()
+
+    def try_submit(self, store, frame, meta, ctx=None) -> bool:
+        """Enqueue without blocking; False if the queue is full."""
+        try:
+            self.q.put_nowait((store, frame, meta, ctx))
+            return True
+        except queue.Full:
+            return False
+
+    def submit(self, store, frame, meta, ctx=None):
+        """Enqueue, blocking while the queue is full (call from a helper thread)."""
+        self.q.put((store, frame, meta, ctx))
+
+    def _next_batch(self) -> list:
+        batch = [self.q.get()]
+        deadline = time.monotonic() + self.batch_window_sec
+        while len(batch) < self.batch_max:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.q.get(timeout=remaining) if remaining > 0 else self.q.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            BATCH_FRAMES.observe(len(batch))
+            staged = []       # (store, record, meta, ctx)
+            for store, frame, meta, ctx in batch:
+                try:
+                    t0 = time.monotonic()
+                    staged.append((store, self.stage(store, frame, meta), meta, ctx))
+                    STAGE_SECONDS.observe(time.monotonic() - t0)
+                except Exception as e:
+                    print(f"[HOST] writer: failed to stage frame: {e}")
+                    self._failed(store, meta, ctx)
+
+            # One fsync pass per run touched by this batch, then publish its newest frame
+            newest = {}
+            for store, rec, _meta, _ctx in staged:
+                newest[id(store)] = (store, rec)
+            durable = set()
+            for key, (store, rec) in newest.items():
+                try:
+                    t0 = time.monotonic()
+                    store.sync()
+                    store.publish_latest(rec)
+                    SYNC_SECONDS.observe(time.monotonic() - t0)
+                    durable.add(key)
+                except Exception as e:
+                    print(f"[HOST] writer: sync/publish failed for {store.run_dir}: {e}")
+
+            for store, rec, meta, ctx in staged:
+                if id(store) not in durable:
+                    self._failed(store, meta, ctx)
+                elif self.on_durable:
+                    try:
+                        self.on_durable(store, rec, meta, ctx)
+                    except Exception as e:
+                        print(f"[HOST] writer: on_durable failed: {e}")
+
+    def _failed(self, store, meta, ctx):
+        if self.on_failed:
+            try:
+                self.on_failed(store, meta, ctx)
+            except Exception as e:
+                print(f"[HOST] writer: on_failed failed: {e}")
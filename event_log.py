@@ -0,0 +1,117 @@
+# event_log.py — buffered, structured (JSONL) host event log.
+#
+# One long-lived handle per log file. emit() only appends to an in-memory buffer;
+# the buffer is written when it passes FLUSH_BYTES or every FLUSH_INTERVAL_SEC (by a
+# background thread), so a frame costs no syscalls of its own. Files rotate at
+# ROTATE_BYTES: events.jsonl -> events.jsonl.1 -> ... -> events.jsonl.<ROTATE_KEEP>.
+#
+# Each line is one JSON object:
+#   {"ts": "2025-08-09T12:00:00.123456", "kind": "frame_saved", "frame": 12,
+#    "image": "<sha256>", "dedup": false, "vm_event": "change_send", "hash": "...",
+#    "latency_ms": 4.2, ...}
+# "ts" and "kind" are always present; the rest depend on kind.
+
+import atexit
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+
+EVENTS_FILE = "events.jsonl"
+FLUSH_INTERVAL_SEC = 1.0
+FLUSH_BYTES = 64 * 1024
+ROTATE_BYTES = 64 * 1024 * 1024
+ROTATE_KEEP = 5
+
+
+class EventLog:
+    def __init__(self, path: Path, flush_interval_sec: float = FLUSH_INTERVAL_SEC,
+                 flush_bytes: int = FLUSH_BYTES, rotate_bytes: int = ROTATE_BYTES,
+                 rotate_keep: int = ROTATE_KEEP):
+        self.path = Path(path)
+        self.flush_bytes = flush_bytes
+        self.rotate_bytes = rotate_bytes
+        self.rotate_keep = rotate_keep
+        self._lock = threading.Lock()
+        self._buf = []
+        self._buf_bytes = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = open(self.path, "a", encoding="utf-8")
+        self._size = self._f.tell()
+        self._closed = threading.Event()
+        self._flush_interval = flush_interval_sec
+        threading.Thread(target=self._flusher, daemon=True).start()
+
+    def emit(self, kind: str, **fields):
+        ev = {"ts": datetime.now().isoformat(), "kind": kind}
+        ev.update({k: v for k, v in fields.items() if v is not None})
+        line = json.dumps(ev, default=str) + "\n"
+        with self._lock:
+            self._buf.append(line)
+            self._buf_bytes += len(line)
+            if self._buf_bytes >= self.flush_bytes:
+                self._flush_locked()
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._buf or self._f.closed:
+            return
+        data = "".join(self._buf)
+        self._buf = []
+        self._buf_bytes = 0
+        self._f.write(data)
+        self._f.flush()
+        self._size += len(data)
+        if self._size >= self.rotate_bytes:
+            self._rotate_locked()
+
+    def _rotate_locked(self):
+        self._f.close()
+        for i in range(self.rotate_keep - 1, 0, -1):
+            src = self.path.with_name(f"{self.path.name}.{i}")
+            if src.exists():
+                os.replace(src, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        self._f = open(self.path, "a", encoding="utf-8")
+        self._size = 0
+
+    def _flusher(self):
+        while not self._closed.wait(self._flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[HOST] warn: could not write {self.path.name}: {e}")
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            self._flush_locked()
+            self._f.close()
+
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def event_log_for(run_dir: Path, name: str = EVENTS_FILE) -> EventLog:
+    """Shared EventLog for a file in a run directory (opened once, kept open)."""
+    key = str(Path(run_dir) / name)
+    with _logs_lock:
+        log = _logs.get(key)
+        if log is None:
+            log = _logs[key] = EventLog(Path(run_dir) / name)
+        return log
+
+
+@atexit.register
+def _close_all():
+    with _logs_lock:
+        for log in _logs.values():
+            try:
+                log.close()
+            except Exception:
+                pass
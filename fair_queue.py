@@ -0,0 +1,61 @@
+# fair_queue.py — per-key bounded queues drained round-robin (asyncio).
+#
+# The screenshot server keys frames by VM id. Each VM can have at most
+# per_key_max frames waiting; a chatty VM blocks on its own queue instead of
+# filling a shared one, and get() rotates across VMs so every VM with pending
+# work is served once per round.
+
+import asyncio
+from collections import deque
+
+
+class FairQueue:
+    def __init__(self, per_key_max: int):
+        self.per_key_max = per_key_max
+        self._queues = {}        # key -> deque of items
+        self._order = deque()    # keys with pending items, in service order
+        self._cond = asyncio.Condition()
+
+    async def put(self, key, item):
+        """Enqueue item for key, waiting while that key's queue is full."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: len(self._queues.get(key, ())) < self.per_key_max)
+            q = self._queues.get(key)
+            if q is None:
+                q = self._queues[key] = deque()
+                self._order.append(key)
+            q.append(item)
+            self._cond.notify_all()
+
+    async def get(self):
+        """Next (key, item), taking one item per key per round."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: bool(self._order))
+            key = self._order.popleft()
+            q = self._queues[key]
+            item = q.popleft()
+            if q:
+                self._order.append(key)   # back of the line
+            else:
+                del self._queues[key]
+            self._cond.notify_all()
+            return key, item
+
+    async def drop_oldest(self):
+        """Remove and return (key, item) for the oldest item of the longest queue, or None."""
+        async with self._cond:
+            if not self._queues:
+                return None
+            key = max(self._queues, key=lambda k: len(self._queues[k]))
+            q = self._queues[key]
+            item = q.popleft()
+            if not q:
+                del self._queues[key]
+                self._order.remove(key)
+            self._cond.notify_all()
+            return key, item
+
+    def depth(self, key=None) -> int:
+        if key is not None:
+            return len(self._queues.get(key, ()))
+        return sum(len(q) for q in self._queues.values())
@@ -0,0 +1,148 @@
+# fingerprint.py — perceptual hashes of frames, shared by the VM senders.
+#
+# Every hash comes from one 32x32 grayscale thumbnail (Capture.gray() builds it
+# straight from raw pixels; PIL images and encoded bytes work too), and the hashing
+# itself is NumPy matrix math, so a batch of frames costs about what one does:
+#
+#   dhash  8x9 area-resampled grid, bit = pixel brighter than its right neighbour by
+#          more than DHASH_MARGIN gray levels (flat desktop areas would otherwise
+#          flip bits on noise)
+#   phash  8x8 lowest frequencies of the 2-D DCT, bit = above their median
+#   ahash  8x8 area-resampled grid, bit = above the mean
+#
+# Hashes are 64-bit ints, most significant bit first (row-major). Two frames count as
+# changed when any hash differs in more bits than CHANGE_BITS allows: antialiasing,
+# cursor blink and compression noise flip a bit or two of one hash, while a real
+# change moves several, and phash/ahash catch layout shifts that leave dhash's
+# gradients alone.
+#
+#   python3 fingerprint.py a.png b.png ...      hashes, and distances to the first
+
+import io
+import sys
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image
+
+THUMB = 32
+DHASH_MARGIN = 1.0
+
+
+class Fingerprint(NamedTuple):
+    dhash: int
+    phash: int
+    ahash: int
+
+
+# more differing bits than this (per hash) = changed
+CHANGE_BITS = Fingerprint(dhash=3, phash=4, ahash=3)
+
+
+def _area(n_out: int, n_in: int) -> np.ndarray:
+    """(n_out, n_in) matrix averaging input cells into n_out equal spans (box resample)."""
+    edges = np.linspace(0, n_in, n_out + 1)
+    j = np.arange(n_in)
+    overlap = np.minimum(edges[1:, None], j + 1) - np.maximum(edges[:-1, None], j)
+    m = np.clip(overlap, 0, None)
+    return (m / m.sum(axis=1, keepdims=True)).astype(np.float32)
+
+
+def _dct(n: int) -> np.ndarray:
+    """Orthonormal DCT-II matrix."""
+    k, i = np.arange(n)[:, None], np.arange(n)[None, :]
+    d = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    d[0] /= np.sqrt(2.0)
+    return d.astype(np.float32)
+
+
+_ROWS8 = _area(8, THUMB)
+_COLS9 = _area(9, THUMB)
+_DCT = _dct(THUMB)
+
+
+def thumbnail(src) -> np.ndarray:
+    """THUMB x THUMB float32 grayscale of a Capture, PIL image, encoded image bytes or array."""
+    if isinstance(src, np.ndarray):
+        return src.astype(np.float32, copy=False)
+    if hasattr(src, "gray"):
+        im = src.gray((THUMB, THUMB))
+    else:
+        if isinstance(src, (bytes, bytearray, memoryview)):
+            with Image.open(io.BytesIO(src)) as f:
+                src = f.convert("RGB")
+        im = src.convert("L").resize((THUMB, THUMB), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    return np.asarray(im, dtype=np.float32)
+
+
+def _pack(bits: np.ndarray) -> np.ndarray:
+    """(N, 64) bools -> (N,) uint64, first bit most significant."""
+    return np.packbits(bits.reshape(len(bits), 64), axis=1).view(">u8").ravel().astype(np.uint64)
+
+
+def hash_thumbnails(thumbs: np.ndarray) -> np.ndarray:
+    """(N, THUMB, THUMB) grays -> (N, 3) uint64 columns dhash, phash, ahash."""
+    t = np.asarray(thumbs, dtype=np.float32)
+    d = _ROWS8 @ t @ _COLS9.T                       # (N, 8, 9)
+    dbits = d[:, :, :-1] > d[:, :, 1:] + DHASH_MARGIN
+    low = (_DCT @ t @ _DCT.T)[:, :8, :8].reshape(len(t), 64)
+    pbits = low > np.median(low, axis=1, keepdims=True)
+    a = (_ROWS8 @ t @ _ROWS8.T).reshape(len(t), 64)
+    abits = a > a.mean(axis=1, keepdims=True)
+    return np.stack([_pack(dbits), _pack(pbits), _pack(abits)], axis=1)
+
+
+def fingerprints(sources) -> np.ndarray:
+    """(N, 3) uint64 hashes (dhash, phash, ahash) of many frames in one pass."""
+    sources = list(sources)
+    if not sources:
+        return np.zeros((0, 3), dtype=np.uint64)
+    return hash_thumbnails(np.stack([thumbnail(s) for s in sources]))
+
+
+def fingerprint(src) -> Fingerprint:
+    return Fingerprint(*(int(h) for h in fingerprints([src])[0]))
+
+
+def dhash(src) -> int:
+    return fingerprint(src).dhash
+
+
+def hamming(a, b):
+    """Differing bits; ints give an int, arrays of uint64 give an array (broadcast)."""
+    if isinstance(a, (int, np.integer)) and isinstance(b, (int, np.integer)):
+        return (int(a) ^ int(b)).bit_count()
+    return np.bitwise_count(np.bitwise_xor(np.asarray(a, dtype=np.uint64), np.asarray(b, dtype=np.uint64)))
+
+
+def distance(a: Fingerprint, b: Fingerprint) -> Fingerprint:
+    return Fingerprint(*(hamming(x, y) for x, y in zip(a, b)))
+
+
+def changed(a: Fingerprint | None, b: Fingerprint | None, thresholds: Fingerprint = CHANGE_BITS) -> bool:
+    """True if a and b look like different screens (None = nothing to compare against)."""
+    if a is None or b is None:
+        return True
+    return any(d > t for d, t in zip(distance(a, b), thresholds))
+
+
+def changed_many(fps: np.ndarray, ref, thresholds: Fingerprint = CHANGE_BITS) -> np.ndarray:
+    """(N,) bools: which rows of fingerprints() differ from ref beyond thresholds."""
+    dist = hamming(fps, np.asarray(ref, dtype=np.uint64)[None, :])
+    return (dist > np.asarray(thresholds)[None, :]).any(axis=1)
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit("usage: fingerprint.py image [image ...]")
+    fps = fingerprints(Image.open(p) for p in sys.argv[1:])
+    ref = fps[0]
+    for path, fp in zip(sys.argv[1:], fps):
+        dist = hamming(fp, ref)
+        flag = "changed" if (dist > np.asarray(CHANGE_BITS)).any() else "same"
+        print(f"{path}: dhash {fp[0]:016x} phash {fp[1]:016x} ahash {fp[2]:016x}   "
+              f"distance {'/'.join(str(int(x)) for x in dist)} ({flag})")
+
+
+if __name__ == "__main__":
+    main()
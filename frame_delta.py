@@ -0,0 +1,146 @@
+# frame_delta.py — keyframes and tile deltas between consecutive frames of a session.
+#
+# Most sends differ from the previous one by a caret, a spinner or one dialog, yet a
+# full-screen PNG is shipped every time. With deltas, the sender numbers its frames
+# (Screenshot.seq) and, when little has changed since the frame it sent last, sends
+# only the TILE_SIZE x TILE_SIZE tiles that differ (Screenshot.kind = DELTA, each
+# tile a small PNG) instead of the whole image:
+#
+#   sender  DeltaEncoder.encode(png)  -> keyframe (full PNG) or delta (changed tiles)
+#   host    DeltaDecoder.apply(msg)   -> full PNG again, so storage and every reader
+#                                        keep seeing complete frames
+#
+# A delta's base lives only in the host's session state, so a keyframe goes out:
+#   - as the first frame of every session (frame_stream.py swaps it in on reconnect)
+#   - when the host asks for one (KIND_KEYFRAME_REQUEST, e.g. its base frame was
+#     rejected over budget)
+#   - at least every KEYFRAME_INTERVAL frames, and whenever more than
+#     DELTA_MAX_CHANGED of the tiles changed (a delta would not be smaller)
+# Keyframes may use any codec (image_codecs.py); tiles are always PNG.
+
+import io
+
+from PIL import Image, ImageChops
+
+import image_codecs
+from screenshot_pb2 import Screenshot, Tile
+
+TILE_SIZE = 64
+KEYFRAME_INTERVAL = 30
+DELTA_MAX_CHANGED = 0.5
+TILE_PNG_LEVEL = 1           # tiles are tiny; fast zlib is as small as it gets
+FRAME_PNG_LEVEL = 1          # host re-encode of reconstructed frames
+
+
+class DeltaError(Exception):
+    """A delta frame that cannot be applied (missing or different base frame)."""
+
+
+def _png(im: Image.Image, level: int) -> bytes:
+    out = io.BytesIO()
+    im.save(out, "PNG", compress_level=level)
+    return out.getvalue()
+
+
+class DeltaEncoder:
+    """
+    Sender side. encode() returns (fields, image): Screenshot fields for the frame
+    (kind, seq, base_seq, tiles) and the image bytes to send with it (the full PNG for
+    a keyframe, b"" for a delta). keyframe() returns the same pair for the frame just
+    encoded, sent as a keyframe instead. Keyframes are encoded with `codec`; a PNG
+    passed to encode() is reused as-is when that is png.
+    """
+
+    def __init__(self, tile: int = TILE_SIZE, keyframe_interval: int = KEYFRAME_INTERVAL,
+                 max_changed: float = DELTA_MAX_CHANGED, codec: str = image_codecs.PNG):
+        self.codec = codec
+        self.tile = tile
+        self.keyframe_interval = keyframe_interval
+        self.max_changed = max_changed
+        self.seq = 0
+        self._base = None        # decoded last frame (what the host will hold after it)
+        self._png = None
+        self._key_seq = 0
+
+    def reset(self):
+        """Make the next frame a keyframe."""
+        self._base = None
+
+    def keyframe(self):
+        self._key_seq = self.seq
+        if self.codec == image_codecs.PNG and self._png is not None:
+            return {"kind": Screenshot.KEYFRAME, "seq": self.seq}, self._png
+        image = image_codecs.encode(self.codec, self._base)
+        return {"kind": Screenshot.KEYFRAME, "seq": self.seq, "codec": self.codec}, image
+
+    def encode(self, png: bytes | None, im: Image.Image | None = None):
+        """png and/or its decoded image; at least one is needed."""
+        if im is None:
+            with Image.open(io.BytesIO(png)) as f:
+                im = f.convert("RGB")
+        else:
+            im = im.convert("RGB")
+        base, self._base, self._png = self._base, im, png
+        self.seq += 1
+        if base is None or base.size != im.size or self.seq - self._key_seq >= self.keyframe_interval:
+            return self.keyframe()
+
+        diff = ImageChops.difference(base, im)
+        bbox = diff.getbbox()
+        tiles = []
+        if bbox is not None:
+            t = self.tile
+            w, h = im.size
+            total = ((w + t - 1) // t) * ((h + t - 1) // t)
+            for y in range(bbox[1] // t * t, bbox[3], t):
+                for x in range(bbox[0] // t * t, bbox[2], t):
+                    box = (x, y, min(x + t, w), min(y + t, h))
+                    if diff.crop(box).getbbox() is None:
+                        continue
+                    tiles.append(Tile(x=x, y=y, data=_png(im.crop(box), TILE_PNG_LEVEL)))
+                    if len(tiles) > self.max_changed * total:
+                        return self.keyframe()
+        return {"kind": Screenshot.DELTA, "seq": self.seq, "base_seq": self.seq - 1, "tiles": tiles}, b""
+
+
+class DeltaDecoder:
+    """Host side, one per session: holds the last frame and turns deltas back into full PNGs."""
+
+    def __init__(self):
+        self.seq = None
+        self._image = None       # encoded base (bytes or a view into the receive buffer)
+        self._codec = image_codecs.PNG
+        self._im = None          # decoded base, only once a delta needs it
+        self.want_keyframe = False   # the sender should be asked for one
+
+    def keyframe(self, seq: int, image, codec: str = image_codecs.PNG):
+        self.seq = seq
+        self._image = image
+        self._codec = codec
+        self._im = None
+
+    def lost(self):
+        """A frame of the sender's chain was never read (e.g. over budget); its successors can't apply."""
+        if self.seq is not None:
+            self.seq, self._image, self._im = None, None, None
+            self.want_keyframe = True
+
+    def apply(self, msg) -> bytes:
+        """Full PNG of delta frame msg; raises DeltaError if its base frame is not held."""
+        if self.seq is None or msg.base_seq != self.seq:
+            self.want_keyframe = True
+            raise DeltaError(f"delta {msg.seq} needs base {msg.base_seq}, have {self.seq}")
+        try:
+            if self._im is None:
+                self._im = image_codecs.decode(self._codec, self._image).convert("RGB")
+                self._image = None
+            for t in msg.tiles:
+                with Image.open(io.BytesIO(t.data)) as tile:
+                    self._im.paste(tile.convert("RGB"), (t.x, t.y))
+            out = _png(self._im, FRAME_PNG_LEVEL)
+        except Exception as e:
+            self.seq, self._image, self._im = None, None, None   # half-patched base is useless
+            self.want_keyframe = True
+            raise DeltaError(f"delta {msg.seq}: {e}") from e
+        self.seq = msg.seq
+        return out
@@ -0,0 +1,269 @@
+# frame_index.py — SQLite index of every saved frame (and bridge commands) across runs.
+#
+# runs/screens/index.sqlite (WAL mode, so the GUI and tools read while the server
+# writes). The server queues rows from its writer thread; one index thread inserts
+# them in batches, so a frame costs no SQLite work on the ingest path.
+#
+#   frames(run_id, idx, vm_id, ts_ms, received_ms, image, image_bytes, dedup,
+#          ui_json, has_graph, vm_event, dhash)
+#   events(run_id, vm_id, received_ms, kind, cmd, detail)   e.g. vm_ctl_forward / mute
+#
+# ts_ms is the sender's clock; received_ms is the host's, which is what frames are
+# ordered by against host events ("frames in run X after the first mute").
+#
+#   python3 frame_index.py runs
+#   python3 frame_index.py query --run <run_id> [--vm-event change_send] [--after-cmd mute]
+#                                [--dhash <hex>] [--has-graph] [--limit 50]
+#   python3 frame_index.py reindex [<run_dir> ...]      rebuild rows from frames.jsonl
+
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+INDEX_FILE = "index.sqlite"
+INDEX_BATCH_MAX = 256
+INDEX_FLUSH_SEC = 0.5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS frames (
+    run_id      TEXT NOT NULL,
+    idx         INTEGER NOT NULL,
+    vm_id       TEXT,
+    ts_ms       INTEGER,
+    received_ms INTEGER,
+    image       TEXT,
+    image_bytes INTEGER,
+    dedup       INTEGER,
+    ui_json     TEXT,
+    has_graph   INTEGER,
+    vm_event    TEXT,
+    dhash       TEXT,
+    PRIMARY KEY (run_id, idx)
+);
+CREATE INDEX IF NOT EXISTS frames_received ON frames(run_id, received_ms);
+CREATE INDEX IF NOT EXISTS frames_event ON frames(vm_event, received_ms);
+CREATE INDEX IF NOT EXISTS frames_dhash ON frames(dhash);
+CREATE INDEX IF NOT EXISTS frames_image ON frames(image);
+CREATE TABLE IF NOT EXISTS events (
+    run_id      TEXT NOT NULL,
+    vm_id       TEXT,
+    received_ms INTEGER NOT NULL,
+    kind        TEXT NOT NULL,
+    cmd         TEXT,
+    detail      TEXT
+);
+CREATE INDEX IF NOT EXISTS events_run ON events(run_id, kind, cmd, received_ms);
+"""
+
+FRAME_COLUMNS = ("run_id", "idx", "vm_id", "ts_ms", "received_ms", "image", "image_bytes",
+                 "dedup", "ui_json", "has_graph", "vm_event", "dhash")
+
+
+def connect(path: Path, readonly: bool = False) -> sqlite3.Connection:
+    if readonly:
+        db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        db = sqlite3.connect(str(path), check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")   # derived data: a crash loses at most the last batch
+        db.executescript(SCHEMA)
+    db.row_factory = sqlite3.Row
+    return db
+
+
+class FrameIndexWriter:
+    """Queue-fed batch writer (one thread owns the connection)."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.q = queue.Queue()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        connect(self.path).close()   # create the schema now; the thread opens its own connection
+        threading.Thread(target=self._run, name="frame-index", daemon=True).start()
+
+    def add_frame(self, **row):
+        self.q.put(("frame", row))
+
+    def add_event(self, run_id: str, vm_id: str | None, kind: str, cmd: str | None = None,
+                  detail: dict | None = None):
+        self.q.put(("event", {"run_id": run_id, "vm_id": vm_id, "received_ms": int(time.time() * 1000),
+                              "kind": kind, "cmd": cmd, "detail": json.dumps(detail) if detail else None}))
+
+    def update_frame(self, run_id: str, idx: int, **fields):
+        self.q.put(("update", {"run_id": run_id, "idx": idx, **fields}))
+
+    def drop_run(self, run_id: str):
+        """Forget a deleted run's frames and events."""
+        self.q.put(("drop", {"run_id": run_id}))
+
+    def _run(self):
+        db = connect(self.path)
+        while True:
+            batch = [self.q.get()]
+            deadline = time.monotonic() + INDEX_FLUSH_SEC
+            while len(batch) < INDEX_BATCH_MAX:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            waiters = [row for kind, row in batch if kind == "flush"]
+            try:
+                with db:
+                    for kind, row in batch:
+                        if kind != "flush":
+                            self._apply(db, kind, row)
+            except Exception as e:
+                print(f"[HOST] warn: frame index write failed: {e}")
+            for done in waiters:
+                done.set()
+
+    @staticmethod
+    def _apply(db: sqlite3.Connection, kind: str, row: dict):
+        if kind == "frame":
+            db.execute(f"INSERT OR REPLACE INTO frames ({','.join(FRAME_COLUMNS)}) "
+                       f"VALUES ({','.join('?' * len(FRAME_COLUMNS))})",
+                       [row.get(c) for c in FRAME_COLUMNS])
+        elif kind == "event":
+            db.execute("INSERT INTO events (run_id, vm_id, received_ms, kind, cmd, detail) VALUES (?,?,?,?,?,?)",
+                       (row["run_id"], row["vm_id"], row["received_ms"], row["kind"], row["cmd"], row["detail"]))
+        elif kind == "drop":
+            db.execute("DELETE FROM frames WHERE run_id = ?", (row["run_id"],))
+            db.execute("DELETE FROM events WHERE run_id = ?", (row["run_id"],))
+        else:
+            fields = {k: v for k, v in row.items() if k in FRAME_COLUMNS and k not in ("run_id", "idx")}
+            if fields:
+                db.execute(f"UPDATE frames SET {', '.join(f'{k} = ?' for k in fields)} WHERE run_id = ? AND idx = ?",
+                           [*fields.values(), row["run_id"], row["idx"]])
+
+    def flush(self, timeout: float | None = 5.0) -> bool:
+        """Wait until everything queued so far is committed (for tools and tests)."""
+        done = threading.Event()
+        self.q.put(("flush", done))
+        return done.wait(timeout)
+
+
+# ---- queries -----------------------------------------------------------------
+class FrameIndex:
+    """Read side: fast lookups without touching the run directories."""
+
+    def __init__(self, path: Path):
+        self.db = connect(Path(path), readonly=True)
+
+    def runs(self) -> list[dict]:
+        rows = self.db.execute(
+            "SELECT run_id, vm_id, COUNT(*) AS frames, MIN(received_ms) AS first_ms, MAX(received_ms) AS last_ms, "
+            "SUM(has_graph) AS with_graph FROM frames GROUP BY run_id ORDER BY last_ms")
+        return [dict(r) for r in rows]
+
+    def event_time(self, run_id: str, cmd: str, nth: int = 1) -> int | None:
+        """Host time of the nth bridge command `cmd` in run_id."""
+        row = self.db.execute("SELECT received_ms FROM events WHERE run_id = ? AND cmd = ? "
+                              "ORDER BY received_ms LIMIT 1 OFFSET ?", (run_id, cmd, nth - 1)).fetchone()
+        return row["received_ms"] if row else None
+
+    def frames(self, run_id: str | None = None, vm_id: str | None = None, vm_event: str | None = None,
+               dhash: str | None = None, has_graph: bool | None = None, since_ms: int | None = None,
+               until_ms: int | None = None, after_cmd: str | None = None, limit: int = 100) -> list[dict]:
+        """Frames matching every given filter, oldest first. after_cmd needs run_id."""
+        where, args = [], []
+        if after_cmd:
+            t = self.event_time(run_id, after_cmd)
+            if t is None:
+                return []
+            since_ms = max(since_ms or 0, t)
+        for col, op, val in (("run_id", "=", run_id), ("vm_id", "=", vm_id), ("vm_event", "=", vm_event),
+                             ("dhash", "=", dhash), ("received_ms", ">=", since_ms),
+                             ("received_ms", "<", until_ms)):
+            if val is not None:
+                where.append(f"{col} {op} ?")
+                args.append(val)
+        if has_graph is not None:
+            where.append("has_graph = ?")
+            args.append(int(has_graph))
+        sql = "SELECT * FROM frames" + (" WHERE " + " AND ".join(where) if where else "")
+        sql += " ORDER BY received_ms, idx LIMIT ?"
+        return [dict(r) for r in self.db.execute(sql, [*args, limit])]
+
+    def close(self):
+        self.db.close()
+
+
+# ---- backfill ----------------------------------------------------------------
+def reindex_run(writer: FrameIndexWriter, run_dir: Path, vm_id: str | None = None) -> int:
+    """Queue rows for every recorded frame of a run (any layout open_run() reads)."""
+    from frame_store import open_run
+    run = open_run(run_dir)
+    n = 0
+    for rec in run.records():
+        ui = run.ui_json_bytes(rec["index"]) if rec.get("ui_json") or rec.get("ui_json_path") else None
+        has_graph = None
+        if ui:
+            try:
+                payload = json.loads(ui)
+                if "meta" in payload or "graph" in payload:
+                    has_graph = bool(payload.get("graph"))
+                else:
+                    has_graph = bool(payload) and "vm_event" not in payload
+            except ValueError:
+                has_graph = False
+        if not has_graph and run.graph(rec["index"]):
+            has_graph = True     # built on the host (host_perception.py)
+        # Receive times were not recorded before the index existed; the sender's is closest
+        writer.add_frame(run_id=Path(run_dir).name, idx=rec["index"], vm_id=vm_id, ts_ms=rec.get("ts_ms"),
+                         received_ms=rec.get("ts_ms"), image=rec.get("image"), image_bytes=rec.get("image_bytes"),
+                         dedup=rec.get("dedup"), ui_json=rec.get("ui_json"), has_graph=has_graph,
+                         vm_event=rec.get("vm_event"), dhash=rec.get("hash"))
+        n += 1
+    return n
+
+
+def main():
+    default_root = Path(os.environ.get("SKADVAZ_ROOT", str(Path.home() / "skadvaz"))) / "runs" / "screens"
+    ap = argparse.ArgumentParser(description="Query the frame index")
+    ap.add_argument("--root", type=Path, default=default_root)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("runs", help="runs with frame counts and time ranges")
+    q = sub.add_parser("query", help="frames matching filters")
+    q.add_argument("--run")
+    q.add_argument("--vm")
+    q.add_argument("--vm-event")
+    q.add_argument("--dhash")
+    q.add_argument("--has-graph", action="store_true", default=None)
+    q.add_argument("--after-cmd", help="only frames received after the run's first bridge command CMD")
+    q.add_argument("--limit", type=int, default=50)
+    r = sub.add_parser("reindex", help="rebuild rows from run directories (default: every run)")
+    r.add_argument("run_dirs", nargs="*", type=Path)
+    args = ap.parse_args()
+    path = args.root / INDEX_FILE
+
+    if args.cmd == "reindex":
+        writer = FrameIndexWriter(path)
+        dirs = args.run_dirs or [d for d in sorted(args.root.iterdir())
+                                 if (d / "frames.jsonl").exists() or (d / "segments").is_dir()]
+        for d in dirs:
+            print(f"[INDEX] {d.name}: {reindex_run(writer, d)} frames")
+        writer.flush(timeout=None)
+        return
+
+    idx = FrameIndex(path)
+    if args.cmd == "runs":
+        for r in idx.runs():
+            print(f"{r['run_id']:40s} {r['vm_id'] or '-':12s} {r['frames']:7d} frames  {r['with_graph'] or 0:7d} with graph")
+    else:
+        if args.after_cmd and not args.run:
+            ap.error("--after-cmd needs --run")
+        for f in idx.frames(run_id=args.run, vm_id=args.vm, vm_event=args.vm_event, dhash=args.dhash,
+                            has_graph=args.has_graph, after_cmd=args.after_cmd, limit=args.limit):
+            print(json.dumps(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# frame_notify.py — push new-frame events from the screenshot server to local viewers.
+#
+# The server binds a unix stream socket at runs/screens/frames.sock and writes one JSON
+# line per durable frame to every connected subscriber, as soon as it is durable:
+#   {"kind": "frame", "vm_id": "default", "run_id": "20250809_120000", "index": 12,
+#    "image": "<sha256>", "ui_json": "<sha256>|null", "ts_ms": 1754740800123}
+# Frames are read back with frame_store.open_run(<screens root>/<run_id>). Work done
+# later gets its own line: once the frame's preview pyramid is stored (previews.py)
+#   {"kind": "previews", "vm_id": ..., "run_id": ..., "index": 12, "image": ...,
+#    "previews": {"half": "<sha256>", "quarter": "<sha256>", "thumb": "<sha256>"}}
+# and when the host builds a UI graph for a frame that arrived without one
+# (host_perception.py)
+#   {"kind": "graph", "vm_id": ..., "run_id": ..., "index": 12, "image": ..., "graph": "<sha256>"}
+# reader.preview(index, level) / reader.graph(index) return them. A newly connected subscriber first
+# gets the latest event of each kind for every VM, so it never has to look at the disk
+# to catch up. Publishing never blocks the writer: a subscriber
+# whose socket buffer is full is disconnected (it reconnects and catches up).
+
+import json
+import os
+import socket
+import threading
+from pathlib import Path
+
+NOTIFY_SOCKET = "frames.sock"
+SUBSCRIBER_SNDBUF = 256 * 1024
+
+
+class FramePublisher:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._subs = []
+        self._latest = {}        # (vm_id, kind) -> encoded last event, replayed to new subscribers
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.exists():
+            self.path.unlink()   # stale socket from a previous server
+        self._srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._srv.bind(str(self.path))
+        self._srv.listen(16)
+        threading.Thread(target=self._accept_loop, name="frame-notify", daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self._srv.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SUBSCRIBER_SNDBUF)
+            conn.setblocking(False)
+            with self._lock:
+                if self._send(conn, b"".join(self._latest.values())):
+                    self._subs.append(conn)
+
+    @staticmethod
+    def _send(conn: socket.socket, data: bytes) -> bool:
+        """Non-blocking all-or-nothing send; closes conn and returns False otherwise."""
+        try:
+            if not data or conn.send(data) == len(data):
+                return True
+        except OSError:
+            pass
+        conn.close()   # slow or gone; a partial line would corrupt the stream anyway
+        return False
+
+    def publish(self, vm_id: str, kind: str = "frame", **fields):
+        ev = {"kind": kind, "vm_id": vm_id}
+        ev.update(fields)
+        line = (json.dumps(ev) + "\n").encode("utf-8")
+        with self._lock:
+            self._latest[(vm_id, kind)] = line
+            self._subs = [c for c in self._subs if self._send(c, line)]
+
+    def subscribers(self) -> int:
+        with self._lock:
+            return len(self._subs)
+
+    def close(self):
+        with self._lock:
+            for c in self._subs:
+                c.close()
+            self._subs = []
+        self._srv.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+# ---- subscriber side ---------------------------------------------------------
+def connect(path: Path) -> socket.socket | None:
+    """Connected non-blocking subscriber socket, or None if no server is publishing."""
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(str(path))
+    except OSError:
+        s.close()
+        return None
+    s.setblocking(False)
+    return s
+
+
+class LineReader:
+    """Splits what a subscriber socket delivers into events."""
+
+    def __init__(self):
+        self.buf = b""
+
+    def feed(self, data: bytes) -> list[dict]:
+        self.buf += data
+        *lines, self.buf = self.buf.split(b"\n")
+        out = []
+        for line in lines:
+            try:
+                out.append(json.loads(line))
+            except ValueError:
+                pass
+        return out
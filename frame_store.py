@@ -0,0 +1,536 @@
+# frame_store.py — per-run, content-addressed frame storage.
+#
+# Layout of runs/screens/<run_id>/:
+#   segments/                   append-only segment files + compact offset indexes
+#                               (see segment_store.py); image / ui_json bytes live here,
+#                               addressed by SHA-256 digest
+#   frames.jsonl                one metadata record per received frame (append-only)
+#   latest.json                 pointer to the newest durable frame (atomic rename)
+#   previews.jsonl              {"index", "image", "half", "quarter", "thumb"} per frame:
+#                               digests of its preview blobs (see previews.py)
+#   graphs.jsonl                {"index", "image", "graph"} per frame the host built a UI
+#                               graph for (see host_perception.py); the graph is a blob
+#   events.jsonl                structured host event log (see event_log.py)
+#
+# A frame record points at blobs by digest, so a screen that comes back (idle desktop,
+# capture_now right after a change-send, unmute on an unchanged page) costs one more
+# index entry instead of another multi-megabyte PNG.
+#
+# Older runs are still readable through open_run():
+#   blobs/<aa>/<sha256>.<ext>   one file per unique blob, records carry image_path
+#   shot_<ts>.png/.json         one file pair per frame, no frames.jsonl
+# and `python3 frame_store.py convert <run_dir>` packs them into segments.
+#
+# Cold runs are moved by retention.py into runs/screens/archive/<run_id>.zip (the same
+# files, one member each); open_run() reads those in place as well.
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import zipfile
+from pathlib import Path
+
+from segment_store import (BLOB_ENTRY, BLOBS_IDX, FRAME_ENTRY, FRAMES_IDX, NO_BLOB, SEGMENT_DIR,
+                           BlobRef, SegmentReader, SegmentWriter, parse_entries, seg_name)
+
+BLOB_DIR = "blobs"
+FRAMES_FILE = "frames.jsonl"
+LATEST_FILE = "latest.json"
+PREVIEWS_FILE = "previews.jsonl"
+GRAPHS_FILE = "graphs.jsonl"
+ARCHIVE_DIR = "archive"
+ACCESS_MARKER = ".accessed"       # touched by open_run(); retention evicts least recently used first
+
+
+def digest_of(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def fsync_path(path: Path):
+    """fsync a file or directory by path (directories make renames durable)."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path: Path, data: bytes):
+    """Write via temp file + fsync + rename, so readers see the old or new content, never half."""
+    tmp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    fsync_path(path.parent)
+
+
+def latest_pointer(rec: dict) -> dict:
+    """latest.json body for a frame record."""
+    return {
+        "latest_index": rec["index"],
+        "image": rec["image"],
+        "ui_json": rec.get("ui_json"),
+        # Only set for legacy blob-file runs; segment runs are read via open_run()
+        "image_path": rec.get("image_path"),
+        "ui_json_path": rec.get("ui_json_path"),
+    }
+
+
+def parse_records(lines) -> list[dict]:
+    out = []
+    for line in lines:
+        line = line.strip()
+        if line:
+            try:
+                out.append(json.loads(line))
+            except ValueError:
+                break   # torn final line from a crash
+    return out
+
+
+def read_records(run_dir: Path, name: str = FRAMES_FILE) -> list[dict]:
+    f = Path(run_dir) / name
+    if not f.exists():
+        return []
+    with open(f, "r", encoding="utf-8") as fh:
+        return parse_records(fh)
+
+
+class RunStore:
+    """Writer for one run: segment-packed blobs, frame index and frames.jsonl."""
+
+    def __init__(self, run_dir: Path):
+        self.run_dir = Path(run_dir)
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self._published = -1    # index latest.json points at
+        if not (self.run_dir / SEGMENT_DIR).exists() and FileRun(self.run_dir).records():
+            convert_legacy_run(self.run_dir)   # resuming a pre-segment run
+        self.segments = SegmentWriter(self.run_dir / SEGMENT_DIR)
+        self._recover_logs()
+        self._records = open(self.run_dir / FRAMES_FILE, "a", encoding="utf-8")
+        self._previews = {}      # image digest -> {level: preview digest}
+        for p in read_records(self.run_dir, PREVIEWS_FILE):
+            self._previews[p["image"]] = {k: v for k, v in p.items() if k not in ("index", "image")}
+        self._preview_log = open(self.run_dir / PREVIEWS_FILE, "a", encoding="utf-8")
+        self._graphs = {p["image"]: p["graph"] for p in read_records(self.run_dir, GRAPHS_FILE)}
+        self._graph_log = open(self.run_dir / GRAPHS_FILE, "a", encoding="utf-8")
+
+    def _recover_logs(self):
+        """
+        Bring frames.jsonl, previews.jsonl and graphs.jsonl in line with what the segment
+        writer recovered after a crash: records past the last kept frame, or naming
+        blobs that were dropped, are cut; frames the index kept but frames.jsonl lost
+        are rebuilt from frames.idx (without the sender's meta).
+        """
+        count = self.segments.frame_count()
+        stored = {d.hex() for d in self.segments.refs}
+        old = read_records(self.run_dir)
+        recs = []
+        for rec in old:
+            if rec.get("index") != len(recs) or len(recs) >= count or rec.get("image") not in stored:
+                break
+            recs.append(rec)
+        if len(recs) < count:
+            by_ref = {ref: d.hex() for d, ref in self.segments.refs.items()}
+            seg = SegmentReader(self.run_dir / SEGMENT_DIR)
+            for n in range(len(recs), count):
+                ts_ms, img, ui = seg.frame_entry(n)
+                recs.append({"index": n, "ts_ms": ts_ms, "image": by_ref[img], "image_bytes": img.length,
+                             "dedup": None, "codec": "png", "ui_json": by_ref[ui] if ui else None,
+                             "vm_event": None, "hash": None, "dirty": None})
+            seg.close()
+        self._rewrite_log(FRAMES_FILE, recs)
+
+        for name in (PREVIEWS_FILE, GRAPHS_FILE):
+            self._rewrite_log(name, [p for p in read_records(self.run_dir, name) if p.get("index", count) < count
+                                     and all(v in stored for k, v in p.items() if k not in ("index", "image"))])
+
+    def _rewrite_log(self, name: str, lines: list[dict]):
+        """Replace a JSONL log with lines unless it already holds exactly that (torn tail included)."""
+        path = self.run_dir / name
+        data = "".join(json.dumps(p) + "\n" for p in lines).encode("utf-8")
+        if path.exists() and path.read_bytes() != data:
+            write_atomic(path, data)
+
+    def put_blob(self, data: bytes):
+        """Store data once per digest. Returns (hex digest, BlobRef, is_new)."""
+        digest, ref, is_new = self.segments.put(data)
+        return digest.hex(), ref, is_new
+
+    # ---- frames ----
+    def add_frame(self, image_data: bytes, ui_json: bytes | None, ts_ms: int,
+                  meta: dict | None = None) -> dict:
+        """Store a frame's blobs and append its index entry + record; returns the record."""
+        img_digest, img_ref, img_new = self.put_blob(image_data)
+        ui_digest, ui_ref = None, NO_BLOB
+        if ui_json:
+            ui_digest, ui_ref, _ = self.put_blob(ui_json)
+
+        meta = meta or {}
+        with self._lock:
+            index = self.segments.append_frame(ts_ms, img_ref, ui_ref)
+            record = {
+                "index": index,
+                "ts_ms": ts_ms,
+                "image": img_digest,
+                "image_bytes": len(image_data),
+                "dedup": not img_new,
+                "codec": meta.get("codec") or "png",
+                "ui_json": ui_digest,
+                "vm_event": meta.get("vm_event"),
+                "hash": meta.get("hash"),
+                "dirty": meta.get("dirty"),     # [[x, y, w, h], ...] changed since the sender's last frame
+            }
+            self._records.write(json.dumps(record) + "\n")
+        return record
+
+    # ---- previews ----
+    def previews_for_image(self, image_digest: str) -> dict | None:
+        with self._lock:
+            return self._previews.get(image_digest)
+
+    def add_previews(self, rec: dict, previews: dict[str, bytes]) -> dict:
+        """Store preview images for frame rec; returns {level: digest}."""
+        digests = {level: self.put_blob(data)[0] for level, data in previews.items()}
+        self.segments.flush()    # readers may look the blobs up as soon as they are listed
+        return self.link_previews(rec, digests)
+
+    def link_previews(self, rec: dict, digests: dict) -> dict:
+        """List already-stored preview blobs for frame rec (e.g. a dedup frame)."""
+        line = {"index": rec["index"], "image": rec["image"]}
+        line.update(digests)
+        with self._lock:
+            self._preview_log.write(json.dumps(line) + "\n")
+            self._preview_log.flush()
+            self._previews[rec["image"]] = dict(digests)
+        return digests
+
+    # ---- host-built UI graphs ----
+    def graph_for_image(self, image_digest: str) -> str | None:
+        with self._lock:
+            return self._graphs.get(image_digest)
+
+    def add_graph(self, rec: dict, graph_json: bytes) -> str:
+        """Store a UI graph built on the host for frame rec; returns its digest."""
+        digest = self.put_blob(graph_json)[0]
+        self.segments.flush()
+        return self.link_graph(rec, digest)
+
+    def link_graph(self, rec: dict, digest: str) -> str:
+        """List an already-stored graph blob for frame rec (e.g. a dedup frame)."""
+        line = {"index": rec["index"], "image": rec["image"], "graph": digest}
+        with self._lock:
+            self._graph_log.write(json.dumps(line) + "\n")
+            self._graph_log.flush()
+            self._graphs[rec["image"]] = digest
+        return digest
+
+    # ---- durability ----
+    def sync(self):
+        """fsync everything written since the last call (one pass per writer batch)."""
+        self.segments.sync()
+        with self._lock:
+            self._records.flush()
+            os.fsync(self._records.fileno())
+
+    def publish_latest(self, rec: dict):
+        """
+        Point latest.json at rec unless it already points at a newer frame, so however
+        many threads publish, it only ever moves forward. Call only after sync()
+        covered rec's blobs.
+        """
+        with self._publish_lock:
+            if rec["index"] <= self._published:
+                return
+            write_atomic(self.run_dir / LATEST_FILE, json.dumps(latest_pointer(rec)).encode("utf-8"))
+            self._published = rec["index"]
+
+    def close(self):
+        self.segments.close()
+        self._records.close()
+        self._preview_log.close()
+        self._graph_log.close()
+
+
+# ---- readers -----------------------------------------------------------------
+class SegmentRun:
+    """Reader for a segment-packed run (frame N fetched via mmap)."""
+
+    def __init__(self, run_dir: Path):
+        self.run_dir = Path(run_dir)
+        self.seg = SegmentReader(self.run_dir / SEGMENT_DIR)
+        self._sidecars = {}      # previews.jsonl / graphs.jsonl -> (frame index -> line, bytes read)
+
+    def frame_count(self) -> int:
+        return self.seg.frame_count()
+
+    def records(self) -> list[dict]:
+        return read_records(self.run_dir)
+
+    def image_bytes(self, index: int) -> bytes:
+        return self.seg.image(index)
+
+    def ui_json_bytes(self, index: int) -> bytes | None:
+        return self.seg.ui_json(index)
+
+    def blob(self, digest: str) -> bytes | None:
+        ref = self.seg.ref_for(digest)
+        return self.seg.read(ref) if ref else None
+
+    def _sidecar(self, name: str, index: int) -> dict:
+        """Line for frame index in an append-only sidecar log, reading only what is new."""
+        lines, pos = self._sidecars.get(name, ({}, 0))
+        f = self.run_dir / name
+        if index not in lines and f.exists():
+            with open(f, "rb") as fh:
+                fh.seek(pos)
+                for line in fh:
+                    if not line.endswith(b"\n"):
+                        break    # still being written
+                    pos += len(line)
+                    try:
+                        p = json.loads(line)
+                    except ValueError:
+                        continue
+                    lines[p["index"]] = p
+            self._sidecars[name] = (lines, pos)
+        return lines.get(index, {})
+
+    def preview(self, index: int, level: str) -> bytes | None:
+        """Preview image ("half", "quarter" or "thumb") of frame index, if one was built."""
+        digest = self._sidecar(PREVIEWS_FILE, index).get(level)
+        return self.blob(digest) if digest else None
+
+    def graph(self, index: int) -> bytes | None:
+        """UI graph JSON the host built for frame index, if any (sender graphs are in ui_json)."""
+        digest = self._sidecar(GRAPHS_FILE, index).get("graph")
+        return self.blob(digest) if digest else None
+
+
+class FileRun:
+    """Reader for legacy runs: blobs/<aa>/<sha>.<ext> (with frames.jsonl) or shot_*.png pairs."""
+
+    def __init__(self, run_dir: Path):
+        self.run_dir = Path(run_dir)
+        self._records = None
+
+    def records(self) -> list[dict]:
+        recs = read_records(self.run_dir)
+        if recs:
+            return recs
+        # Pre-frames.jsonl layout: shot_<ts>.png with optional shot_<ts>.json beside it
+        out = []
+        for i, png in enumerate(sorted(self.run_dir.glob("shot_*.png"))):
+            ui = png.with_suffix(".json")
+            out.append({
+                "index": i,
+                "ts_ms": int(png.stat().st_mtime * 1000),
+                "image_path": png.name,
+                "ui_json_path": ui.name if ui.exists() else None,
+            })
+        return out
+
+    def _record(self, index: int) -> dict:
+        if self._records is None or index >= len(self._records):
+            self._records = self.records()
+        return self._records[index]
+
+    def frame_count(self) -> int:
+        self._records = self.records()
+        return len(self._records)
+
+    def image_bytes(self, index: int) -> bytes:
+        return (self.run_dir / self._record(index)["image_path"]).read_bytes()
+
+    def ui_json_bytes(self, index: int) -> bytes | None:
+        rel = self._record(index).get("ui_json_path")
+        return (self.run_dir / rel).read_bytes() if rel else None
+
+    def blob(self, digest: str) -> bytes | None:
+        hits = list((self.run_dir / BLOB_DIR / digest[:2]).glob(f"{digest}.*"))
+        return hits[0].read_bytes() if hits else None
+
+    def preview(self, index: int, level: str) -> bytes | None:
+        return None              # legacy runs predate previews
+
+    def graph(self, index: int) -> bytes | None:
+        return None
+
+
+class ArchiveRun:
+    """Reader for a segment run packed into archive/<run_id>.zip (segments stored, seekable)."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.zf = zipfile.ZipFile(self.path)
+        self._frames = parse_entries(self._member(f"{SEGMENT_DIR}/{FRAMES_IDX}") or b"", FRAME_ENTRY)
+        self._refs = None
+        self._segs = {}          # segment -> open member (seekable)
+        self._sidecars = {}      # previews.jsonl / graphs.jsonl -> {frame index: line}
+
+    def _member(self, name: str) -> bytes | None:
+        try:
+            return self.zf.read(name)
+        except KeyError:
+            return None
+
+    def _read(self, ref: BlobRef) -> bytes:
+        f = self._segs.get(ref.segment)
+        if f is None:
+            f = self._segs[ref.segment] = self.zf.open(f"{SEGMENT_DIR}/{seg_name(ref.segment)}")
+        f.seek(ref.offset)
+        return f.read(ref.length)
+
+    def frame_count(self) -> int:
+        return len(self._frames)
+
+    def records(self) -> list[dict]:
+        return parse_records((self._member(FRAMES_FILE) or b"").decode("utf-8").splitlines())
+
+    def image_bytes(self, index: int) -> bytes:
+        e = self._frames[index]
+        return self._read(BlobRef(*e[1:4]))
+
+    def ui_json_bytes(self, index: int) -> bytes | None:
+        e = self._frames[index]
+        return self._read(BlobRef(*e[4:7])) if e[6] else None
+
+    def blob(self, digest: str) -> bytes | None:
+        if self._refs is None:
+            self._refs = {d.hex(): BlobRef(s, o, l) for d, s, o, l in
+                          parse_entries(self._member(f"{SEGMENT_DIR}/{BLOBS_IDX}") or b"", BLOB_ENTRY)}
+        ref = self._refs.get(digest)
+        return self._read(ref) if ref else None
+
+    def _sidecar(self, name: str, index: int) -> dict:
+        if name not in self._sidecars:
+            lines = (self._member(name) or b"").decode("utf-8").splitlines()
+            self._sidecars[name] = {p["index"]: p for p in parse_records(lines)}
+        return self._sidecars[name].get(index, {})
+
+    def preview(self, index: int, level: str) -> bytes | None:
+        digest = self._sidecar(PREVIEWS_FILE, index).get(level)
+        return self.blob(digest) if digest else None
+
+    def graph(self, index: int) -> bytes | None:
+        digest = self._sidecar(GRAPHS_FILE, index).get("graph")
+        return self.blob(digest) if digest else None
+
+    def close(self):
+        for f in self._segs.values():
+            f.close()
+        self.zf.close()
+
+
+def archive_path(run_dir: Path) -> Path:
+    run_dir = Path(run_dir)
+    return run_dir.parent / ARCHIVE_DIR / f"{run_dir.name}.zip"
+
+
+def touch_access(path: Path):
+    """Record that a run was just read (best effort)."""
+    try:
+        if path.is_dir():
+            (path / ACCESS_MARKER).touch()
+        elif path.exists():
+            os.utime(path)
+    except OSError:
+        pass
+
+
+def open_run(run_dir: Path):
+    """Reader for any run layout (segments, blob files, shot_* files or an archive)."""
+    run_dir = Path(run_dir)
+    if not run_dir.exists() and archive_path(run_dir).exists():
+        touch_access(archive_path(run_dir))
+        return ArchiveRun(archive_path(run_dir))
+    touch_access(run_dir)
+    if (run_dir / SEGMENT_DIR).is_dir():
+        return SegmentRun(run_dir)
+    return FileRun(run_dir)
+
+
+# ---- legacy conversion -------------------------------------------------------
+def convert_legacy_run(run_dir: Path, delete: bool = False) -> int:
+    """
+    Pack a blob-file or shot_* run into segments. frames.jsonl is rewritten to the
+    segment record shape; legacy files are removed only with delete=True and only
+    after every frame has been read back and compared. Returns frames converted.
+    """
+    run_dir = Path(run_dir)
+    if (run_dir / SEGMENT_DIR).exists():
+        raise RuntimeError(f"{run_dir} already has {SEGMENT_DIR}/")
+    legacy = FileRun(run_dir)
+    old_records = legacy.records()
+
+    # Build into a side directory, then swap in, so a failed conversion leaves no trace
+    tmp_dir = run_dir / ".convert"
+    if tmp_dir.exists():
+        shutil.rmtree(tmp_dir)   # leftovers from an interrupted conversion
+    tmp_dir.mkdir()
+    store = RunStore(tmp_dir)
+    for rec in old_records:
+        img = legacy.image_bytes(rec["index"])
+        ui = legacy.ui_json_bytes(rec["index"])
+        meta = {"vm_event": rec.get("vm_event"), "hash": rec.get("hash")}
+        store.add_frame(img, ui, int(rec.get("ts_ms") or 0), meta)
+    store.sync()
+    store.close()
+
+    new_run = SegmentRun(tmp_dir)
+    for rec in old_records:
+        if new_run.image_bytes(rec["index"]) != legacy.image_bytes(rec["index"]):
+            raise RuntimeError(f"verification failed at frame {rec['index']}")
+
+    os.replace(tmp_dir / SEGMENT_DIR, run_dir / SEGMENT_DIR)
+    os.replace(tmp_dir / FRAMES_FILE, run_dir / FRAMES_FILE)
+    (tmp_dir / PREVIEWS_FILE).unlink(missing_ok=True)
+    (tmp_dir / GRAPHS_FILE).unlink(missing_ok=True)
+    tmp_dir.rmdir()
+    if old_records:
+        write_atomic(run_dir / LATEST_FILE, json.dumps(latest_pointer(read_records(run_dir)[-1])).encode("utf-8"))
+
+    if delete:
+        for rec in old_records:
+            for key in ("image_path", "ui_json_path"):
+                if rec.get(key):
+                    (run_dir / rec[key]).unlink(missing_ok=True)
+        blob_dir = run_dir / BLOB_DIR
+        if blob_dir.is_dir():
+            for sub in blob_dir.iterdir():
+                for f in sub.iterdir():
+                    f.unlink()
+                sub.rmdir()
+            blob_dir.rmdir()
+    return len(old_records)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run frame storage tools")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("convert", help="pack legacy run directories into segment files")
+    c.add_argument("run_dirs", nargs="+", type=Path)
+    c.add_argument("--delete", action="store_true", help="remove legacy files after verifying")
+    args = ap.parse_args()
+
+    rc = 0
+    for d in args.run_dirs:
+        try:
+            n = convert_legacy_run(d, delete=args.delete)
+            print(f"[STORE] {d}: converted {n} frames")
+        except Exception as e:
+            print(f"[STORE] {d}: {e}")
+            rc = 1
+    sys.exit(rc)
+
+
+if __name__ == "__main__":
+    main()
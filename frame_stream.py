@@ -0,0 +1,274 @@
+# frame_stream.py — persistent multi-frame session between a VM sender and the host.
+#
+# A session replaces "one TCP connection per Screenshot". Wire format (big-endian):
+#
+#   client hello : MAGIC (4 bytes) + u32 len + JSON {"v": 1, "vm_id": "...", ...}  (vm_id optional)
+#   server hello : u32 len + JSON {"v": 1, "ok": true, "heartbeat_sec": ...,
+#                                  "codecs": [image codecs the host decodes]}
+#   records      : u8 kind + u32 len + payload
+#                    KIND_FRAME      payload = serialized Screenshot
+#                    KIND_HEARTBEAT  payload = empty (keeps idle sessions alive)
+#                    KIND_BYE        payload = empty (clean close)
+#                    KIND_FRAME_SPLIT payload = u32 header len + Screenshot without
+#                                     image_data + raw image bytes; lets the host
+#                                     write the image straight from its receive buffer
+#                    KIND_SLOW_DOWN  host -> sender, payload = JSON {"delay_ms": N}; the
+#                                     host is over its memory budget, so the sender
+#                                     holds its next frame back for N ms
+#                    KIND_KEYFRAME_REQUEST host -> sender, payload = empty; the host
+#                                     could not apply a delta frame (frame_delta.py),
+#                                     so the sender's next frame must be a keyframe
+#
+# Legacy senders start with a plain u32 length; MAGIC as a length would be ~1.1 GB,
+# so the server can tell the two apart from the first 4 bytes.
+
+import json
+import select
+import socket
+import struct
+import threading
+import time
+
+MAGIC = b"AURS"
+PROTOCOL_VERSION = 1
+
+KIND_FRAME = 1
+KIND_HEARTBEAT = 2
+KIND_BYE = 3
+KIND_FRAME_SPLIT = 4
+KIND_SLOW_DOWN = 5
+KIND_KEYFRAME_REQUEST = 6
+
+RECORD_HEADER = struct.Struct(">BI")   # kind, payload length
+SPLIT_HEADER = struct.Struct(">I")     # length of the Screenshot header in a split frame
+HELLO_MAX = 64 * 1024                  # handshake JSON is tiny; cap it anyway
+
+HEARTBEAT_SEC = 5.0                    # sender heartbeat when idle
+IDLE_TIMEOUT_SEC = HEARTBEAT_SEC * 3   # server drops sessions silent for this long
+RECONNECT_MIN_SEC = 0.5
+RECONNECT_MAX_SEC = 10.0
+SLOW_DOWN_MS = 500                     # what the host asks for when over budget
+SLOW_DOWN_MAX_SEC = 5.0                # senders never hold a frame back longer than this
+
+
+def encode_hello(obj: dict) -> bytes:
+    body = json.dumps(obj).encode("utf-8")
+    return len(body).to_bytes(4, "big") + body
+
+
+def encode_record(kind: int, payload: bytes = b"") -> bytes:
+    return RECORD_HEADER.pack(kind, len(payload)) + payload
+
+
+def split_frame(payload):
+    """(header view, image view) of a KIND_FRAME_SPLIT payload, without copying."""
+    view = memoryview(payload)
+    (hlen,) = SPLIT_HEADER.unpack_from(view, 0)
+    start = SPLIT_HEADER.size
+    if start + hlen > len(view):
+        raise ValueError(f"split header length {hlen} exceeds payload")
+    return view[start:start + hlen], view[start + hlen:]
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        k = sock.recv_into(view[got:])
+        if k == 0:
+            raise ConnectionError("peer closed during handshake")
+        got += k
+    return bytes(buf)
+
+
+class FrameStreamSender:
+    """
+    Long-lived sender side of a session. send_frame() reuses one socket for many
+    frames; a background thread sends heartbeats while idle and re-establishes
+    the session (with exponential backoff) whenever it drops. When the host has
+    asked it to slow down, send_frame() waits out the requested delay first.
+    """
+
+    def __init__(self, host: str, port: int, vm_id: str | None = None,
+                 heartbeat_sec: float = HEARTBEAT_SEC, connect_timeout: float = 5.0):
+        self.host = host
+        self.port = port
+        self.vm_id = vm_id          # None: the host keys the session on our address
+        self.heartbeat_sec = heartbeat_sec
+        self.connect_timeout = connect_timeout
+
+        self._sock = None
+        self._lock = threading.Lock()
+        self._last_send = 0.0
+        self._backoff = RECONNECT_MIN_SEC
+        self._next_attempt = 0.0
+        self._rx = b""              # partial records from the host
+        self._slow_until = 0.0
+        self.slowdowns = 0
+        self._keyframe_requested = False
+        self.host_codecs = ["png"]  # from the server hello (image_codecs.py)
+        self._stop = threading.Event()
+        self._hb_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self._hb_thread.start()
+
+    # ---- connection management ----
+    def _connect(self):
+        now = time.monotonic()
+        if now < self._next_attempt:
+            raise ConnectionError(f"reconnect backoff ({self._next_attempt - now:.1f}s left)")
+        s = None
+        try:
+            s = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            hello = {"v": PROTOCOL_VERSION}
+            if self.vm_id:
+                hello["vm_id"] = self.vm_id
+            s.sendall(MAGIC + encode_hello(hello))
+            n = int.from_bytes(_recv_exact(s, 4), "big")
+            if n > HELLO_MAX:
+                raise ConnectionError(f"oversized server hello ({n} bytes)")
+            reply = json.loads(_recv_exact(s, n).decode("utf-8"))
+            if not reply.get("ok"):
+                raise ConnectionError(f"server refused session: {reply}")
+            self.host_codecs = reply.get("codecs", ["png"])
+        except Exception:
+            if s is not None:
+                s.close()
+            self._next_attempt = time.monotonic() + self._backoff
+            self._backoff = min(self._backoff * 2, RECONNECT_MAX_SEC)
+            raise
+        self._sock = s
+        self._backoff = RECONNECT_MIN_SEC
+        self._next_attempt = 0.0
+        self._last_send = time.monotonic()
+
+    def _drop(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._rx = b""
+
+    def _poll_host(self):
+        """Apply SLOW_DOWN / KEYFRAME_REQUEST records the host sent since the last frame (never blocks)."""
+        while self._sock is not None and select.select([self._sock], [], [], 0)[0]:
+            try:
+                chunk = self._sock.recv(4096)
+            except OSError:
+                chunk = b""
+            if not chunk:
+                self._drop()     # host closed the session; the next send reconnects
+                return
+            self._rx += chunk
+            while len(self._rx) >= RECORD_HEADER.size:
+                kind, n = RECORD_HEADER.unpack_from(self._rx)
+                if len(self._rx) < RECORD_HEADER.size + n:
+                    break
+                payload = self._rx[RECORD_HEADER.size:RECORD_HEADER.size + n]
+                self._rx = self._rx[RECORD_HEADER.size + n:]
+                if kind == KIND_SLOW_DOWN:
+                    delay = json.loads(payload or b"{}").get("delay_ms", SLOW_DOWN_MS) / 1000.0
+                    self._slow_until = time.monotonic() + min(delay, SLOW_DOWN_MAX_SEC)
+                    self.slowdowns += 1
+                elif kind == KIND_KEYFRAME_REQUEST:
+                    self._keyframe_requested = True
+
+    def _pace(self):
+        self._poll_host()
+        wait = self._slow_until - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def _send_record(self, kind: int, payload: bytes = b""):
+        if self._sock is None:
+            self._connect()
+        try:
+            self._sock.sendall(encode_record(kind, payload))
+        except OSError:
+            self._drop()
+            raise
+        self._last_send = time.monotonic()
+
+    # ---- public API ----
+    def send_frame(self, data: bytes):
+        """Send one serialized Screenshot; reconnects and retries once on a stale socket."""
+        with self._lock:
+            self._pace()
+            had_session = self._sock is not None
+            try:
+                self._send_record(KIND_FRAME, data)
+            except OSError:
+                if not had_session:
+                    raise
+                # The session died since the last frame; one fresh attempt.
+                self._send_record(KIND_FRAME, data)
+
+    def send_frame_split(self, header: bytes, image: bytes, keyframe=None):
+        """
+        Send a Screenshot header (image_data left empty) followed by the raw image
+        bytes. The image is handed to the socket as-is instead of being copied into
+        a serialized message first.
+        For a delta frame, keyframe() returns (header, image) of the same frame as a
+        keyframe; that is sent instead whenever the frame would open a new session
+        (the host keeps delta bases per session) or the host asked for a keyframe.
+        """
+        with self._lock:
+            self._pace()
+            had_session = self._sock is not None
+            if keyframe is not None and (self._keyframe_requested or not had_session):
+                header, image = keyframe()
+                keyframe = None
+            self._keyframe_requested = False
+            try:
+                self._send_split(header, image)
+            except OSError:
+                if not had_session:
+                    raise
+                if keyframe is not None:
+                    header, image = keyframe()
+                self._send_split(header, image)
+
+    def _send_split(self, header: bytes, image: bytes):
+        if self._sock is None:
+            self._connect()
+        total = SPLIT_HEADER.size + len(header) + len(image)
+        try:
+            self._sock.sendall(RECORD_HEADER.pack(KIND_FRAME_SPLIT, total)
+                               + SPLIT_HEADER.pack(len(header)) + header)
+            self._sock.sendall(image)
+        except OSError:
+            self._drop()
+            raise
+        self._last_send = time.monotonic()
+
+    def close(self, linger_sec: float = 5.0):
+        """
+        Send BYE and wait (up to linger_sec) for the host to finish reading and close
+        its side. Closing with unread host records pending would reset the connection
+        and could discard frames the host has not read yet.
+        """
+        self._stop.set()
+        with self._lock:
+            if self._sock is not None:
+                try:
+                    self._sock.sendall(encode_record(KIND_BYE))
+                    self._sock.shutdown(socket.SHUT_WR)
+                    self._sock.settimeout(linger_sec)
+                    while self._sock.recv(4096):
+                        pass
+                except OSError:
+                    pass
+            self._drop()
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_sec / 2):
+            with self._lock:
+                if time.monotonic() - self._last_send < self.heartbeat_sec:
+                    continue
+                try:
+                    self._send_record(KIND_HEARTBEAT)
+                except Exception:
+                    pass   # retried on the next tick (subject to backoff)
@@ -0,0 +1,144 @@
+# frame_trace.py — per-frame latency tracing from capture on the VM to display on the host.
+#
+# Every stage stamps wall-clock milliseconds (stamp()) into the frame's trace:
+#   VM    capture_start, capture_end, perception, hash, encode, send
+#         (sent in the frame's ui_json meta as {"trace": {...}}, VM clock)
+#   host  recv, saved, notify      screenshot_server.py
+#         graph                    host_perception.py built the UI graph
+#         display                  host UI showed the frame's thumbnail
+# The server writes one line per frame to runs/screens/<run_id>/trace.jsonl:
+#   {"ts": ..., "kind": "trace", "index": 12, "vm_id": "default",
+#    "clock_offset_ms": 3.1, "vm": {...}, "host": {...}}
+# followed by {"index": 12, "host": {"graph": ...}} lines for stages that finish later.
+# The host UI is another process, so its {"index": 12, "host": {"display": ...}} lines
+# go to trace-ui.jsonl beside it rather than into the server's buffered log; readers
+# merge both files by index.
+#
+# VM clocks drift from the host's, so the server asks each VM for its time over the
+# control channel every CLOCK_SYNC_INTERVAL_SEC ({"cmd": "clock"} -> {"t_ms": ...}) and
+# keeps the sample with the smallest round trip: offset = vm_time - host midpoint.
+#
+#   python3 frame_trace.py <run_dir>       per-stage latency percentiles for a run
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from pathlib import Path
+
+TRACE_FILE = "trace.jsonl"
+UI_TRACE_FILE = "trace-ui.jsonl"
+CLOCK_SYNC_INTERVAL_SEC = 30.0
+CLOCK_SAMPLES = 5
+
+VM_STAGES = ("capture_start", "capture_end", "perception", "hash", "encode", "send")
+HOST_STAGES = ("recv", "saved", "notify", "graph", "display")
+
+
+def stamp() -> float:
+    """Wall-clock milliseconds, 0.1 ms resolution."""
+    return round(time.time() * 1000.0, 1)
+
+
+# ---- clock offset ------------------------------------------------------------
+def estimate_offset(request, samples: int = CLOCK_SAMPLES) -> tuple[float, float] | None:
+    """
+    (offset_ms, rtt_ms) of a peer clock, NTP style: request() sends {"cmd": "clock"}
+    and returns the reply line; the sample with the smallest round trip wins.
+    None if the peer does not answer with a time.
+    """
+    best = None
+    for _ in range(samples):
+        t0 = stamp()
+        reply = request()
+        t1 = stamp()
+        try:
+            peer = float(json.loads(reply)["t_ms"])
+        except (ValueError, KeyError, TypeError):
+            return None
+        rtt = t1 - t0
+        if best is None or rtt < best[1]:
+            best = (round(peer - (t0 + t1) / 2.0, 1), round(rtt, 1))
+    return best
+
+
+# ---- writing (host UI side) ----------------------------------------------------
+def append(run_dir: Path, index: int, **host_stamps):
+    """One trace line from the host UI into UI_TRACE_FILE (single O_APPEND write)."""
+    line = json.dumps({"kind": "trace", "index": index, "host": host_stamps}) + "\n"
+    fd = os.open(Path(run_dir) / UI_TRACE_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode("utf-8"))
+    finally:
+        os.close(fd)
+
+
+# ---- report ------------------------------------------------------------------
+def load(run_dir: Path) -> dict[int, dict]:
+    """index -> merged trace {"clock_offset_ms", "vm": {...}, "host": {...}}."""
+    out = {}
+    for name in (TRACE_FILE, UI_TRACE_FILE):
+        f = Path(run_dir) / name
+        if not f.exists():
+            continue
+        with open(f, "r", encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    ev = json.loads(line)
+                except ValueError:
+                    continue
+                t = out.setdefault(ev["index"], {"vm": {}, "host": {}})
+                t["vm"].update(ev.get("vm") or {})
+                t["host"].update(ev.get("host") or {})
+                if ev.get("clock_offset_ms") is not None:
+                    t["clock_offset_ms"] = ev["clock_offset_ms"]
+    return out
+
+
+def timeline(trace: dict) -> list[tuple[str, float]]:
+    """[(stage, host-clock ms)] in pipeline order, for the stages this frame has."""
+    offset = trace.get("clock_offset_ms") or 0.0
+    out = [(s, trace["vm"][s] - offset) for s in VM_STAGES if s in trace["vm"]]
+    out += [(s, trace["host"][s]) for s in HOST_STAGES if s in trace["host"]]
+    return out
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile."""
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100.0 * len(values)) - 1)]
+
+
+def report(run_dir: Path) -> list[tuple[str, list[float]]]:
+    """[(stage label, durations ms)]; each stage is measured from the previous one the frame has."""
+    pos = {s: i for i, s in enumerate(VM_STAGES + HOST_STAGES)}
+    steps, totals = {}, {}
+    for trace in load(run_dir).values():
+        tl = timeline(trace)
+        for (a, ta), (b, tb) in zip(tl, tl[1:]):
+            steps.setdefault((a, b), []).append(tb - ta)
+        if len(tl) > 1:
+            totals.setdefault((tl[0][0], tl[-1][0]), []).append(tl[-1][1] - tl[0][1])
+    rows = [(f"{a} -> {b}", v) for (a, b), v in sorted(steps.items(), key=lambda kv: (pos[kv[0][0]], pos[kv[0][1]]))]
+    rows += [(f"total {a} -> {b}", v) for (a, b), v in sorted(totals.items(), key=lambda kv: (pos[kv[0][0]], pos[kv[0][1]]))]
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Per-stage frame latency for a run")
+    ap.add_argument("run_dir", type=Path)
+    args = ap.parse_args()
+    rows = report(args.run_dir)
+    if not rows:
+        print(f"no {TRACE_FILE} / {UI_TRACE_FILE} entries in {args.run_dir}")
+        sys.exit(1)
+    print(f"{'stage':40s} {'n':>6s} {'p50':>9s} {'p90':>9s} {'p99':>9s} {'max':>9s}   (ms)")
+    for label, vals in rows:
+        print(f"{label:40s} {len(vals):6d} " + " ".join(
+            f"{v:9.1f}" for v in (percentile(vals, 50), percentile(vals, 90), percentile(vals, 99), max(vals))))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,17 +2,27 @@
 from datetime import datetime
 import gi
 gi.require_version('Gtk', '3.0')
+import os
 import sys
 import random
 import json
 import time
 import subprocess
 import socket
+import threading
 from gi.repository import Gtk, GLib, Gdk, GdkPixbuf
 from pathlib import Path
 from widgets.screenshot_viewer import ScreenshotViewer
 
+# Repo root holds the shared host modules (frame_store, handuz, ...)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from frame_store import open_run
+from vm_registry import current_run_file, safe_vm_id
+import frame_notify
+import frame_trace
+
 PI_PORT = 5555
+PREVIEW_WAIT_MS = 1000     # how long a new frame waits for the server's thumbnail before decoding it here
 
 class HostUI:
     def __init__(self):
@@ -366,15 +376,24 @@ class HostUI:
 
         # --- Screenshot run tracking (Phase-2) ---
         self.screens_root = Path("runs/screens")
+        # Which VM's run to follow when one server serves several (see vm_registry.py)
+        self.watch_vm_id = safe_vm_id(os.environ.get("AUROCH_VM_ID"))
         self.current_run_id = None
-        self.current_shot_index = 0
+        self.current_shot_index = -1   # frame indices start at 0; -1 = none accepted yet
+        self.current_shot_run_id = None  # run of current_shot_index; indices restart per run
+        self._shown_graph = False      # the accepted frame has UI overlays
         self._latest_meta_mtime = 0.0
+        self._notify_sock = None        # subscription to the server's new-frame events
+        self._next_thumb_key = None     # (run_id, idx) whose thumbnail the next panel shows
+        self._notify_reader = frame_notify.LineReader()
 
 
         self.main_grid.attach(self.main_vbox, 0, 0, 1, 1)
         self._update_add_button_sensitivity()
         
-        # Start polling for new stable shots (once/second)
+        # New stable shots are pushed by the server (frames.sock); the once/second
+        # timer only (re)subscribes, and falls back to polling while the server is down
+        self._subscribe_frames()
         GLib.timeout_add_seconds(1, self._poll_for_new_shot)
 
     # Debug hook
@@ -926,7 +945,7 @@ class HostUI:
         }
         return move_action
     def _read_current_run_id(self):
-        f = self.screens_root / "current_run.txt"
+        f = current_run_file(self.screens_root, self.watch_vm_id)
         if not f.exists():
             return None
         try:
@@ -934,9 +953,12 @@ class HostUI:
         except Exception:
             return None
 
-    def _load_grayscale_thumb(self, path: Path, scale=0.5) -> GdkPixbuf.Pixbuf:
-        # Load original
-        pb = GdkPixbuf.Pixbuf.new_from_file(str(path))
+    def _load_grayscale_thumb(self, image_bytes: bytes, scale=0.5) -> GdkPixbuf.Pixbuf:
+        # Decode original
+        loader = GdkPixbuf.PixbufLoader()
+        loader.write(image_bytes)
+        loader.close()
+        pb = loader.get_pixbuf()
         # Convert to grayscale via saturate_and_pixelate (sat=0)
         gray = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB, pb.get_has_alpha(), pb.get_bits_per_sample(),
                                     pb.get_width(), pb.get_height())
@@ -949,7 +971,147 @@ class HostUI:
         scaled = gray.scale_simple(w, h, GdkPixbuf.InterpType.BILINEAR)
         return scaled
 
+    def _run_reader(self, run_id: str):
+        """Cached frame_store reader for the run (segment files or legacy layouts)."""
+        if getattr(self, "_reader_run_id", None) != run_id:
+            self._reader = open_run(self.screens_root / run_id)
+            self._reader_run_id = run_id
+        return self._reader
+
+    def _subscribe_frames(self) -> bool:
+        if self._notify_sock is not None:
+            return True
+        sock = frame_notify.connect(self.screens_root / frame_notify.NOTIFY_SOCKET)
+        if sock is None:
+            return False
+        self._notify_sock = sock
+        self._notify_reader = frame_notify.LineReader()
+        GLib.io_add_watch(sock.fileno(), GLib.PRIORITY_DEFAULT,
+                          GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self._on_frame_events)
+        print("[INFO] Subscribed to new-frame events")
+        return True
+
+    def _on_frame_events(self, _fd, cond):
+        try:
+            data = self._notify_sock.recv(65536) if cond & GLib.IO_IN else b""
+        except BlockingIOError:
+            return True
+        except OSError:
+            data = b""
+        if not data:
+            # Server went away; the poll timer resubscribes (or polls) from here on
+            self._notify_sock.close()
+            self._notify_sock = None
+            return False
+        for ev in self._notify_reader.feed(data):
+            if ev.get("vm_id") != self.watch_vm_id:
+                continue
+            if ev.get("kind") == "frame":
+                self.current_run_id = ev["run_id"]
+                self._show_next_shot(ev["run_id"], int(ev["index"]))
+            elif ev.get("kind") == "graph":
+                self._on_host_graph(ev["run_id"], int(ev["index"]))
+            elif ev.get("kind") == "previews":
+                self._on_previews(ev["run_id"], int(ev["index"]))
+        return True
+
+    def _on_host_graph(self, run_id: str, idx: int):
+        """The server built a UI graph for frame idx; show it if that frame is on screen without one."""
+        if (run_id, idx) != (self.current_shot_run_id, self.current_shot_index) or self._shown_graph:
+            return
+        graph = self._host_graph(run_id, idx)
+        if graph:
+            self._apply_ui_graph(graph)
+
+    def _host_graph(self, run_id: str, idx: int) -> dict:
+        """Graph the server built for a frame that arrived without one ({} if none yet)."""
+        try:
+            data = self._run_reader(run_id).graph(idx)
+            return json.loads(data.decode("utf-8")) if data else {}
+        except Exception as e:
+            print(f"[WARN] Failed to read host UI graph: {e}")
+            return {}
+
+    def _show_next_shot(self, run_id: str, latest_idx: int):
+        """Offer frame latest_idx of run_id in the next panel if it is newer than the current one."""
+        # A new run (or a restarted server) counts from 0 again: anything in it is newer
+        if run_id == self.current_shot_run_id and latest_idx <= self.current_shot_index:
+            return
+        try:
+            reader = self._run_reader(run_id)
+            image_bytes = reader.image_bytes(latest_idx)
+            self._next_image_bytes = image_bytes
+            self._next_ui_bytes = reader.ui_json_bytes(latest_idx)
+            self._next_index_value = latest_idx
+            self._next_run_id = run_id
+            self._next_thumb_key = None
+            # The server's preview pyramid has a ready-made gray 1/4 thumbnail; until its
+            # "previews" event is out the panel shows a placeholder, and only frames that
+            # never get one (older runs, a backed-up preview queue) are decoded, off the
+            # main thread
+            if not self._set_preview_thumb(run_id, latest_idx):
+                self.next_thumb.set_from_icon_name("image-loading", Gtk.IconSize.DIALOG)
+                wait_ms = PREVIEW_WAIT_MS if self._notify_sock else 0
+                GLib.timeout_add(wait_ms, self._decode_thumb_fallback, run_id, latest_idx, image_bytes)
+            self.next_panel.set_visible(True)
+        except Exception as e:
+            print(f"[WARN] Failed to load next thumbnail: {e}")
+            return
+        try:
+            frame_trace.append(self.screens_root / run_id, latest_idx, display=frame_trace.stamp())
+        except OSError:
+            pass
+
+    def _on_previews(self, run_id: str, idx: int):
+        """The server stored previews for frame idx; use its thumbnail if that frame is offered."""
+        if (run_id, idx) != (getattr(self, "_next_run_id", None), getattr(self, "_next_index_value", None)):
+            return
+        if self._next_thumb_key != (run_id, idx):
+            self._set_preview_thumb(run_id, idx)
+
+    def _set_preview_thumb(self, run_id: str, idx: int) -> bool:
+        """Show the server-made thumbnail of frame idx in the next panel; False if it has none yet."""
+        try:
+            small = self._run_reader(run_id).preview(idx, "thumb")
+        except Exception as e:
+            print(f"[WARN] Failed to read thumbnail preview: {e}")
+            return False
+        if not small:
+            return False
+        loader = GdkPixbuf.PixbufLoader()
+        loader.write(small)
+        loader.close()
+        self._set_next_thumb(run_id, idx, loader.get_pixbuf())
+        return True
+
+    def _set_next_thumb(self, run_id: str, idx: int, thumb):
+        if (run_id, idx) == (getattr(self, "_next_run_id", None), getattr(self, "_next_index_value", None)):
+            self.next_thumb.set_from_pixbuf(thumb)
+            self._next_thumb_key = (run_id, idx)
+        return False   # also used as a one-shot GLib.idle_add callback
+
+    def _decode_thumb_fallback(self, run_id: str, idx: int, image_bytes: bytes):
+        """No preview arrived in time: decode the full frame in a worker thread."""
+        if (run_id, idx) != (getattr(self, "_next_run_id", None), getattr(self, "_next_index_value", None)) \
+                or self._next_thumb_key == (run_id, idx):
+            return False
+
+        def work():
+            try:
+                thumb = self._load_grayscale_thumb(image_bytes, scale=0.25)
+            except Exception as e:
+                print(f"[WARN] Failed to decode next thumbnail: {e}")
+                return
+            GLib.idle_add(self._set_next_thumb, run_id, idx, thumb)
+
+        threading.Thread(target=work, name="thumb-decode", daemon=True).start()
+        return False
+
     def _poll_for_new_shot(self):
+        # 0) pushed events make disk polling unnecessary
+        if self._subscribe_frames():
+            return True
+
         # 1) check run id
         run_id = self._read_current_run_id()
         if not run_id:
@@ -972,42 +1134,25 @@ class HostUI:
         if st.st_mtime <= self._latest_meta_mtime:
             return True  # nothing new
 
-                # something changed; parse it
+        # something changed; parse it (latest.json is replaced atomically)
         try:
             obj = json.loads(latest_meta.read_text())
             latest_idx = int(obj.get("latest_index", 0))
-            latest_img = obj.get("image_path") or obj.get("path", "")  # accept old "path" for bwd-compat
-            latest_ui  = obj.get("ui_path", "")
-            latest_image = Path(latest_img) if latest_img else None
-            latest_ui_path = Path(latest_ui) if latest_ui else None
         except Exception:
             return True
 
-
         self._latest_meta_mtime = st.st_mtime
         self.current_run_id = run_id
-
-        if latest_idx > self.current_shot_index and latest_image and latest_image.exists():
-            try:
-                thumb = self._load_grayscale_thumb(latest_image, scale=0.25)
-                self.next_thumb.set_from_pixbuf(thumb)
-                self.next_panel.set_visible(True)
-                self._next_image_path = latest_image
-                self._next_ui_path = latest_ui_path if (latest_ui_path and latest_ui_path.exists()) else None
-                self._next_index_value = latest_idx
-            except Exception as e:
-                print(f"[WARN] Failed to load next thumbnail: {e}")
-
-
+        self._show_next_shot(run_id, latest_idx)
 
         return True  # keep polling
 
     def _on_next_panel_clicked(self, *a):
         """Accept the pending screenshot and its UI graph, then hide the panel."""
         try:
-            img_path = getattr(self, "_next_image_path", None)
-            ui_path  = getattr(self, "_next_ui_path", None)
-            if not img_path:
+            img_bytes = getattr(self, "_next_image_bytes", None)
+            ui_bytes  = getattr(self, "_next_ui_bytes", None)
+            if not img_bytes:
                 self.next_panel.set_visible(False)
                 return
 
@@ -1015,35 +1160,48 @@ class HostUI:
             self.reset_for_new_act()
 
             # Load screenshot
-            self.screenshot_viewer.load_image(str(img_path))
+            self.screenshot_viewer.load_image_bytes(img_bytes)
 
             # Load overlays if provided
             graph = {}
-            if ui_path and ui_path.exists():
+            if ui_bytes:
                 try:
-                    graph = json.loads(ui_path.read_text())
+                    graph = json.loads(ui_bytes.decode("utf-8"))
+                    # Sender envelope is {"meta": {...}, "graph": {...}}
+                    if isinstance(graph, dict) and "graph" in graph:
+                        graph = graph.get("graph") or {}
                 except Exception as e:
                     print(f"[WARN] Failed to parse UI graph JSON: {e}")
                     graph = {}
 
-            self.screenshot_viewer.set_ui_graph(graph)
-            self._set_layer_counts(graph)
-
-            # Apply current toggle states
-            self.screenshot_viewer.set_layer_visibility("viewport",   self.cb_viewport.get_active())
-            self.screenshot_viewer.set_layer_visibility("containers", self.cb_containers.get_active())
-            self.screenshot_viewer.set_layer_visibility("inputs",     self.cb_inputs.get_active())
-            self.screenshot_viewer.set_layer_visibility("buttons",    self.cb_buttons.get_active())
-            self.screenshot_viewer.set_layer_visibility("links",      self.cb_links.get_active())
-            self.screenshot_viewer.set_layer_visibility("ocr",        self.cb_ocr.get_active())
+            # Sent without one: the server may have built it by now (or announces it later)
+            next_idx = getattr(self, "_next_index_value", self.current_shot_index)
+            next_run = getattr(self, "_next_run_id", self.current_shot_run_id)
+            if not graph and next_run:
+                graph = self._host_graph(next_run, next_idx)
+            self._apply_ui_graph(graph)
 
             # Advance index and hide panel
-            self.current_shot_index = getattr(self, "_next_index_value", self.current_shot_index)
+            self.current_shot_run_id = next_run
+            self.current_shot_index = next_idx
         except Exception as e:
             print(f"[WARN] Failed to load next screenshot: {e}")
         finally:
             self.next_panel.set_visible(False)
 
+    def _apply_ui_graph(self, graph: dict):
+        self.screenshot_viewer.set_ui_graph(graph)
+        self._set_layer_counts(graph)
+        self._shown_graph = bool(graph)
+
+        # Apply current toggle states
+        self.screenshot_viewer.set_layer_visibility("viewport",   self.cb_viewport.get_active())
+        self.screenshot_viewer.set_layer_visibility("containers", self.cb_containers.get_active())
+        self.screenshot_viewer.set_layer_visibility("inputs",     self.cb_inputs.get_active())
+        self.screenshot_viewer.set_layer_visibility("buttons",    self.cb_buttons.get_active())
+        self.screenshot_viewer.set_layer_visibility("links",      self.cb_links.get_active())
+        self.screenshot_viewer.set_layer_visibility("ocr",        self.cb_ocr.get_active())
+
 
     def _vm_send_ctl(self, vm_ip: str, port: int, payload: dict, timeout=2.0):
         try:
@@ -75,6 +75,20 @@ class ScreenshotViewer(Gtk.DrawingArea):
             print(f"Error loading image: {e}")
             return False
 
+    def load_image_bytes(self, data: bytes):
+        """Like load_image, for frames read straight out of a run's segment files."""
+        try:
+            loader = GdkPixbuf.PixbufLoader()
+            loader.write(data)
+            loader.close()
+            self.pixbuf = loader.get_pixbuf()
+            self.set_size_request(self.pixbuf.get_width(), self.pixbuf.get_height())
+            self.queue_draw()
+            return True
+        except GLib.Error as e:
+            print(f"Error loading image: {e}")
+            return False
+
     def on_draw(self, widget, cr):
         allocation = self.get_allocation()
 
@@ -0,0 +1,112 @@
+# host_perception.py — UI graph extraction for received frames, on the host.
+#
+# Senders can run vm_ui_perception inside the VM (ENABLE_PERCEPTION in pngsend.py), but
+# there it competes with the app under test for 2 vCPUs and delays every send. With
+# it off, frames arrive without a graph and the server builds one here instead:
+# process_screenshot_bytes() runs in a process pool (OCR and OpenCV are CPU-bound),
+# the graph JSON is stored as a blob in the frame's run and listed in graphs.jsonl
+# (see frame_store.py), and on_ready tells the server so it can notify listeners.
+#
+# A graph is built once per unique image; dedup frames link the existing one. If the
+# pool falls more than PERCEPTION_QUEUE_MAX frames behind, new frames are skipped
+# (they keep no graph) rather than letting the backlog grow without bound.
+#
+# OpenCV and pytesseract are optional: without them no graphs are built.
+
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+
+try:
+    from vm_ui_perception import process_screenshot_bytes
+except ImportError:
+    process_screenshot_bytes = None
+
+PERCEPTION_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+PERCEPTION_QUEUE_MAX = 64
+
+PERCEPTION_SECONDS = metrics.histogram("auroch_perception_seconds", "Time from submit until a frame's UI graph is stored")
+PERCEPTION_SKIPPED = metrics.counter("auroch_perception_skipped_total", "Frames left without a host-built graph, by reason")
+
+
+def build_graph(image: bytes) -> bytes:
+    """UI graph of an encoded image as JSON bytes (runs in a worker process)."""
+    return json.dumps(process_screenshot_bytes(image)).encode("utf-8")
+
+
+class PerceptionPool:
+    """
+    submit(store, rec, image, ctx) for a durable frame that arrived without a graph;
+    on_ready(store, rec, digest, ctx) follows once its graph is stored (digest of the
+    graph blob). Frames of an image already being processed wait for that result.
+    """
+
+    def __init__(self, on_ready, workers: int = PERCEPTION_WORKERS, max_queue: int = PERCEPTION_QUEUE_MAX):
+        self.on_ready = on_ready
+        self.max_queue = max_queue
+        self.pool = None
+        if process_screenshot_bytes is not None:
+            # spawn: the server is threaded, and forking a threaded process is unsafe
+            self.pool = ProcessPoolExecutor(max_workers=workers,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        self._lock = threading.Lock()
+        self._inflight = {}      # (run_dir, image digest) -> [(store, rec, ctx, t_submit)]
+        self._queued = 0
+
+    def enabled(self) -> bool:
+        return self.pool is not None
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._queued
+
+    def submit(self, store, rec: dict, image, ctx=None) -> bool:
+        """Queue rec for a graph; False if it was skipped (pool off or too far behind)."""
+        if self.pool is None:
+            return False
+        known = store.graph_for_image(rec["image"])
+        if known is not None:
+            self._finish(store, rec, ctx, store.link_graph(rec, known))
+            return True
+        key = (store.run_dir, rec["image"])
+        waiter = (store, rec, ctx, time.monotonic())
+        with self._lock:
+            if key in self._inflight:
+                self._inflight[key].append(waiter)
+                return True
+            if self._queued >= self.max_queue:
+                PERCEPTION_SKIPPED.inc(reason="backlog")
+                return False
+            self._inflight[key] = [waiter]
+            self._queued += 1
+        fut = self.pool.submit(build_graph, bytes(image))
+        fut.add_done_callback(lambda f: self._done(key, f))
+        return True
+
+    def _done(self, key, fut):
+        with self._lock:
+            waiters = self._inflight.pop(key)
+            self._queued -= 1
+        store, rec, _ctx, _t = waiters[0]
+        try:
+            digest = store.add_graph(rec, fut.result())
+        except Exception as e:
+            print(f"[HOST] perception: frame {rec['index']} failed: {e}")
+            PERCEPTION_SKIPPED.inc(len(waiters), reason="error")
+            return
+        for i, (store, rec, ctx, t_submit) in enumerate(waiters):
+            if i:
+                store.link_graph(rec, digest)
+            PERCEPTION_SECONDS.observe(time.monotonic() - t_submit)
+            self._finish(store, rec, ctx, digest)
+
+    def _finish(self, store, rec: dict, ctx, digest: str):
+        try:
+            self.on_ready(store, rec, digest, ctx)
+        except Exception as e:
+            print(f"[HOST] perception: on_ready failed: {e}")
@@ -0,0 +1,125 @@
+# image_codecs.py — image encodings for frames on the wire and on disk.
+#
+#   png       PNG; what gnome-screenshot writes, passed through untouched when possible
+#             (encoded here with the fast PNG_LEVEL)
+#   webp      lossless WebP (Pillow built with libwebp)
+#   qoi       QOI (Pillow >= 11.3); near-PNG size at a fraction of the CPU
+#   zstd_rgb  "ZRGB" + u32 width + u32 height, then zstd-compressed RGB rows
+#             (compression.zstd on Python >= 3.14, else the zstandard package)
+#
+# Screenshot.codec names the encoding of image_data ("" = png, which is what every
+# older sender sends). Each side only offers codecs whose library is installed:
+# available() lists them, the server announces its list in the session hello, and
+# pick() lets a sender choose per frame among the ones both ends can handle.
+
+import io
+import struct
+
+from PIL import Image
+
+PNG = "png"
+WEBP = "webp"
+QOI = "qoi"
+ZSTD_RGB = "zstd_rgb"
+
+PNG_LEVEL = 1
+ZSTD_LEVEL = 3
+ZRGB_HEADER = struct.Struct(">4sII")
+ZRGB_MAGIC = b"ZRGB"
+
+try:
+    from compression import zstd as _zstd
+    _zstd_compress = lambda data: _zstd.compress(data, level=ZSTD_LEVEL)
+    _zstd_decompress = _zstd.decompress
+except ImportError:
+    try:
+        import zstandard as _zstd
+        _zstd_compress = _zstd.ZstdCompressor(level=ZSTD_LEVEL).compress
+        _zstd_decompress = lambda data: _zstd.ZstdDecompressor().decompress(data)
+    except ImportError:
+        _zstd = None
+
+
+def _pil_encode(fmt: str, **params):
+    def encode(im: Image.Image) -> bytes:
+        out = io.BytesIO()
+        im.save(out, fmt, **params)
+        return out.getvalue()
+    return encode
+
+
+def _pil_decode(data) -> Image.Image:
+    im = Image.open(io.BytesIO(data))
+    im.load()
+    return im
+
+
+def _zrgb_encode(im: Image.Image) -> bytes:
+    im = im.convert("RGB")
+    w, h = im.size
+    return ZRGB_HEADER.pack(ZRGB_MAGIC, w, h) + _zstd_compress(im.tobytes())
+
+
+def _zrgb_decode(data) -> Image.Image:
+    magic, w, h = ZRGB_HEADER.unpack_from(data)
+    if magic != ZRGB_MAGIC:
+        raise ValueError("not a zstd_rgb image")
+    return Image.frombytes("RGB", (w, h), _zstd_decompress(bytes(data[ZRGB_HEADER.size:])))
+
+
+def _pil_can(fmt: str) -> bool:
+    Image.init()
+    return fmt in Image.SAVE and fmt in Image.OPEN
+
+
+_codecs = {}                 # name -> (encode, decode)
+
+
+def register(name: str, encode, decode):
+    """Add a codec: encode(PIL image) -> bytes, decode(bytes) -> PIL image."""
+    _codecs[name] = (encode, decode)
+
+
+register(PNG, _pil_encode("PNG", compress_level=PNG_LEVEL), _pil_decode)
+if _pil_can("WEBP"):
+    register(WEBP, _pil_encode("WEBP", lossless=True, quality=0, method=0), _pil_decode)
+if _pil_can("QOI"):
+    register(QOI, _pil_encode("QOI"), _pil_decode)
+if _zstd is not None:
+    register(ZSTD_RGB, _zrgb_encode, _zrgb_decode)
+
+
+def available() -> list[str]:
+    return list(_codecs)
+
+
+def normalize(name: str | None) -> str:
+    return name or PNG
+
+
+def pick(preferred, accepted=None) -> str:
+    """First of preferred this side can encode and the peer (accepted) can decode; png otherwise."""
+    for name in preferred:
+        if name in _codecs and (accepted is None or name in accepted):
+            return name
+    return PNG
+
+
+def encode(name: str, im: Image.Image) -> bytes:
+    return _codecs[normalize(name)][0](im)
+
+
+def decode(name: str, data) -> Image.Image:
+    try:
+        dec = _codecs[normalize(name)][1]
+    except KeyError:
+        raise ValueError(f"unsupported image codec {name!r}") from None
+    return dec(data)
+
+
+def transcode(name: str, data, to: str) -> bytes:
+    """data (encoded with name) re-encoded as `to`; returned as-is if they match."""
+    name, to = normalize(name), normalize(to)
+    if name == to:
+        return data
+    return encode(to, decode(name, data))
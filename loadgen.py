@@ -0,0 +1,426 @@
+# loadgen.py — load generator and ingest benchmark for screenshot_server.py.
+#
+# Simulates N pngsend.py senders on one machine: each opens its own session
+# (vm_id load-<i>) and sends screenshot-sized frames at --fps, open loop. With
+# probability --change-rate a frame shows a different screen than the one before
+# it; otherwise the same image is sent again (the server's dedup path). Frames carry
+# pngsend's ui_json meta and, with --graph-nodes, a sender-built UI graph of that size.
+# With --deltas, changed frames go out as tile deltas like pngsend's SEND_DELTAS.
+#
+# Screens are rendered and PNG-encoded once up front (--variants per run), so the
+# generator spends its CPU on sockets, not on encoding, and the deltas between
+# screens are computed once per pair.
+#
+# Latency is measured from send until this process reads the frame's "frame" event
+# from the server's notify socket (frame_notify.py): the frame is durable, indexed and
+# announced, which is what a viewer waits for. Screenshot.timestamp carries the send
+# time, so the server must run on this machine. Server CPU and RSS are sampled from /proc (the server process
+# plus its direct children, e.g. the preview and perception pools).
+#
+#   python3 loadgen.py --senders 8 --fps 2 --duration 30 --pid <server pid>
+#   python3 loadgen.py --senders 8 --spawn            start a server on a scratch root
+#   python3 loadgen.py ... --json out.json            also write the results as JSON
+
+import argparse
+import io
+import json
+import os
+import random
+import select
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+import frame_notify
+from frame_delta import DeltaEncoder
+from frame_stream import FrameStreamSender
+from frame_trace import percentile
+from screenshot_pb2 import Screenshot
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5001
+DEFAULT_SIZE = "1920x1080"
+DEFAULT_VARIANTS = 6
+PNG_LEVEL = 6                # gnome-screenshot's zlib default; sets realistic frame sizes
+SAMPLE_SEC = 0.5             # /proc sampling interval
+DRAIN_SEC = 10.0             # wait this long after the last send for outstanding frames
+SPAWN_WAIT_SEC = 3.0
+
+
+# ---- synthetic screens -------------------------------------------------------
+def render_screens(size: tuple[int, int], n: int, seed: int = 1) -> list[Image.Image]:
+    """n desktop-like screens: same wallpaper and panels, different windows and text."""
+    rnd = random.Random(seed)
+    w, h = size
+    base = Image.new("RGB", size, (48, 10, 36))
+    d = ImageDraw.Draw(base)
+    for y in range(0, h, 4):     # wallpaper gradient
+        d.rectangle((0, y, w, y + 3), fill=(48 + y * 60 // h, 10 + y * 40 // h, 36 + y * 80 // h))
+    d.rectangle((0, 0, w, 28), fill=(30, 30, 30))       # top bar
+    d.rectangle((0, 28, 64, h), fill=(40, 40, 40))      # dock
+    for i in range(8):
+        d.rounded_rectangle((8, 40 + i * 64, 56, 88 + i * 64), 8, fill=tuple(rnd.randrange(60, 220) for _ in range(3)))
+    screens = []
+    for _ in range(n):
+        im = base.copy()
+        d = ImageDraw.Draw(im)
+        for _ in range(rnd.randint(1, 3)):               # windows with text-like rows
+            x0, y0 = rnd.randrange(80, w // 2), rnd.randrange(40, h // 2)
+            x1, y1 = x0 + rnd.randrange(w // 4, w // 2), y0 + rnd.randrange(h // 4, h // 2)
+            d.rectangle((x0, y0, x1, y1), fill=(245, 245, 245), outline=(90, 90, 90))
+            d.rectangle((x0, y0, x1, y0 + 30), fill=(220, 220, 220))
+            for ty in range(y0 + 44, y1 - 12, 18):
+                tx = x0 + 12
+                while tx < x1 - 40:
+                    word = rnd.randrange(12, 60)
+                    d.text((tx, ty), "".join(rnd.choice("abcdefghijklmnop") for _ in range(word // 7)),
+                           fill=(20, 20, 20))
+                    tx += word + 8
+        photo = Image.effect_noise((w // 6, h // 6), 40).convert("RGB")   # an image that doesn't compress
+        im.paste(photo, (w - w // 6 - 20, h - h // 6 - 20))
+        screens.append(im)
+    return screens
+
+
+def encode_png(im: Image.Image) -> bytes:
+    out = io.BytesIO()
+    im.save(out, "PNG", compress_level=PNG_LEVEL)
+    return out.getvalue()
+
+
+class ScreenSet:
+    """Pre-encoded screens, plus the delta tiles between any two of them (computed on first use)."""
+
+    def __init__(self, screens: list[Image.Image]):
+        self.images = screens
+        self.pngs = [encode_png(im) for im in screens]
+        self._tiles = {}
+        self._lock = threading.Lock()
+
+    def tiles(self, a: int, b: int) -> list | None:
+        """Tiles turning screen a into screen b; None if a keyframe would be sent instead."""
+        key = (a, b)
+        with self._lock:
+            if key not in self._tiles:
+                enc = DeltaEncoder(keyframe_interval=1 << 30)
+                enc.encode(self.pngs[a], self.images[a])
+                fields, _ = enc.encode(self.pngs[b], self.images[b])
+                self._tiles[key] = fields["tiles"] if fields["kind"] == Screenshot.DELTA else None
+            return self._tiles[key]
+
+
+def ui_json(event: str, graph_nodes: int, rnd: random.Random) -> bytes:
+    graph = {}
+    if graph_nodes:
+        graph = {"nodes": [{"id": i, "type": "text", "text": f"label {i}",
+                            "bbox": [rnd.randrange(1920), rnd.randrange(1080), 80, 18]}
+                           for i in range(graph_nodes)], "edges": []}
+    meta = {"vm_event": event, "hash": f"{rnd.getrandbits(64):016x}", "ts_ms": int(time.time() * 1000)}
+    return json.dumps({"meta": meta, "graph": graph}).encode("utf-8")
+
+
+# ---- senders -----------------------------------------------------------------
+class SenderStats:
+    def __init__(self):
+        self.sent = 0
+        self.bytes = 0
+        self.late = 0            # frames sent more than one interval behind schedule
+        self.errors = 0
+        self.slowdowns = 0       # SLOW_DOWN records the server sent this sender
+
+
+def run_sender(i: int, args, screens: ScreenSet, stats: SenderStats, deadline: float):
+    rnd = random.Random(args.seed + i)
+    stream = FrameStreamSender(args.host, args.port, vm_id=f"load-{i}")
+    interval = 1.0 / args.fps
+    cur = rnd.randrange(len(screens.pngs))
+    seq = key_seq = 0
+    next_t = time.monotonic() + rnd.random() * interval   # spread senders over the first interval
+    while True:
+        now = time.monotonic()
+        if next_t > now:
+            time.sleep(next_t - now)
+        if time.monotonic() >= deadline:
+            break
+        if time.monotonic() - next_t > interval:
+            stats.late += 1
+        next_t += interval
+
+        prev = cur
+        if rnd.random() < args.change_rate:
+            cur = rnd.choice([k for k in range(len(screens.pngs)) if k != prev] or [prev])
+        meta = ui_json("change_send" if cur != prev else "manual_capture", args.graph_nodes, rnd)
+        ts = int(time.time() * 1000)
+        seq += 1
+
+        def keyframe(seq=seq, cur=cur, meta=meta, ts=ts):
+            nonlocal key_seq
+            key_seq = seq
+            return (Screenshot(timestamp=ts, ui_json=meta, kind=Screenshot.KEYFRAME, seq=seq).SerializeToString(),
+                    screens.pngs[cur])
+
+        try:
+            if not args.deltas:
+                header = Screenshot(timestamp=ts, ui_json=meta).SerializeToString()
+                image = screens.pngs[cur]
+                stream.send_frame_split(header, image)
+            else:
+                tiles = [] if cur == prev else screens.tiles(prev, cur)
+                if seq == 1 or tiles is None or seq - key_seq >= args.keyframe_interval:
+                    header, image = keyframe()
+                    stream.send_frame_split(header, image)
+                else:
+                    header, image = Screenshot(timestamp=ts, ui_json=meta, kind=Screenshot.DELTA, seq=seq,
+                                               base_seq=seq - 1, tiles=tiles).SerializeToString(), b""
+                    stream.send_frame_split(header, image, keyframe=keyframe)
+        except Exception:
+            stats.errors += 1
+            continue
+        stats.sent += 1
+        stats.bytes += len(header) + len(image)
+    stats.slowdowns = stream.slowdowns
+    stream.close()
+
+
+# ---- measurements ------------------------------------------------------------
+class LatencyListener:
+    """Frame events of load-* VMs from the server's notify socket: send -> frame event latency."""
+
+    def __init__(self, sock_path: Path):
+        self.sock_path = sock_path
+        self.latencies = []      # ms
+        self.received = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        sock = None
+        reader = frame_notify.LineReader()
+        started = time.time() * 1000
+        while not self._stop.is_set():
+            if sock is None:
+                sock = frame_notify.connect(self.sock_path)
+                if sock is None:
+                    time.sleep(0.2)
+                    continue
+            if not select.select([sock], [], [], 0.2)[0]:
+                continue
+            try:
+                data = sock.recv(65536)
+            except OSError:
+                data = b""
+            if not data:
+                sock.close()
+                sock, reader = None, frame_notify.LineReader()
+                continue
+            now = time.time() * 1000
+            for ev in reader.feed(data):
+                # the replayed latest event of an earlier run predates this one
+                if ev.get("kind") != "frame" or not str(ev.get("vm_id", "")).startswith("load-") \
+                        or (ev.get("ts_ms") or 0) < started:
+                    continue
+                self.received += 1
+                self.latencies.append(now - ev["ts_ms"])
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def _proc_pids(pid: int) -> list[int]:
+    """pid and its direct children."""
+    pids = [pid]
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                pids += [int(c) for c in f.read().split()]
+    except OSError:
+        pass
+    return pids
+
+
+def _cpu_ticks(pid: int) -> int:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return int(fields[11]) + int(fields[12])    # utime + stime
+
+
+def _rss_bytes(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+class ProcSampler:
+    """CPU % (100 = one core) and RSS of a process tree, sampled every SAMPLE_SEC."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.cpu = []
+        self.rss = []
+        self._hz = os.sysconf("SC_CLK_TCK")
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _sample(self) -> tuple[int, int]:
+        ticks = rss = 0
+        for p in _proc_pids(self.pid):
+            try:
+                ticks += _cpu_ticks(p)
+                rss += _rss_bytes(p)
+            except OSError:
+                pass     # child exited between listing and reading
+        return ticks, rss
+
+    def _run(self):
+        last_ticks, _ = self._sample()
+        last_t = time.monotonic()
+        while not self._stop.wait(SAMPLE_SEC):
+            ticks, rss = self._sample()
+            t = time.monotonic()
+            # children that exited take their ticks with them; never report negative CPU
+            self.cpu.append(max(0.0, (ticks - last_ticks) / self._hz / (t - last_t) * 100.0))
+            self.rss.append(rss)
+            last_ticks, last_t = ticks, t
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+# ---- benchmark ---------------------------------------------------------------
+def _pcts(values: list[float]) -> dict:
+    if not values:
+        return {}
+    return {"p50": percentile(values, 50), "p90": percentile(values, 90), "p99": percentile(values, 99),
+            "max": max(values), "mean": sum(values) / len(values)}
+
+
+def run(args) -> dict:
+    size = tuple(int(v) for v in args.size.lower().split("x"))
+    print(f"[LOAD] rendering {args.variants} {args.size} screens")
+    screens = ScreenSet(render_screens(size, args.variants, args.seed))
+    print(f"[LOAD] PNG sizes: {', '.join(f'{len(p) // 1024} KB' for p in screens.pngs)}")
+    if args.deltas:
+        for a in range(len(screens.pngs)):       # keep pair diffs out of the measured window
+            for b in range(len(screens.pngs)):
+                if a != b:
+                    screens.tiles(a, b)
+
+    listener = LatencyListener(args.root / frame_notify.NOTIFY_SOCKET)
+    sampler = ProcSampler(args.pid) if args.pid else None
+    stats = [SenderStats() for _ in range(args.senders)]
+    t0 = time.monotonic()
+    deadline = t0 + args.duration
+    threads = [threading.Thread(target=run_sender, args=(i, args, screens, stats[i], deadline), daemon=True)
+               for i in range(args.senders)]
+    print(f"[LOAD] {args.senders} senders x {args.fps} fps for {args.duration}s "
+          f"(change rate {args.change_rate}, deltas {'on' if args.deltas else 'off'})")
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    send_sec = time.monotonic() - t0
+    sent = sum(s.sent for s in stats)
+    drain_until = time.monotonic() + DRAIN_SEC
+    while listener.received < sent and time.monotonic() < drain_until:
+        time.sleep(0.1)
+    total_sec = time.monotonic() - t0
+    listener.stop()
+    if sampler:
+        sampler.stop()
+
+    result = {
+        "senders": args.senders, "fps_per_sender": args.fps, "duration_sec": args.duration,
+        "size": args.size, "change_rate": args.change_rate, "deltas": args.deltas, "graph_nodes": args.graph_nodes,
+        "sent": sent, "saved": listener.received, "errors": sum(s.errors for s in stats),
+        "late": sum(s.late for s in stats), "slowdowns": sum(s.slowdowns for s in stats),
+        "send_fps": sent / send_sec, "saved_fps": listener.received / total_sec,
+        "send_mb_per_sec": sum(s.bytes for s in stats) / send_sec / 1e6,
+        "latency_ms": _pcts(listener.latencies),
+    }
+    if sampler:
+        result["server_cpu_pct"] = _pcts(sampler.cpu)
+        result["server_rss_mb"] = {"max": max(sampler.rss, default=0) / 1e6,
+                                   "last": (sampler.rss[-1] if sampler.rss else 0) / 1e6}
+    return result
+
+
+def print_report(r: dict):
+    print(f"[LOAD] sent {r['sent']} frames ({r['send_fps']:.1f}/s, {r['send_mb_per_sec']:.1f} MB/s), "
+          f"saved {r['saved']} ({r['saved_fps']:.1f}/s); errors {r['errors']}, "
+          f"behind schedule {r['late']}, SLOW_DOWNs {r['slowdowns']}")
+    lat = r["latency_ms"]
+    if lat:
+        print(f"[LOAD] send -> frame event ms: p50 {lat['p50']:.1f}  p90 {lat['p90']:.1f}  "
+              f"p99 {lat['p99']:.1f}  max {lat['max']:.1f}")
+    else:
+        print("[LOAD] no frame events seen (is --root the server's runs/screens?)")
+    if "server_cpu_pct" in r:
+        cpu = r["server_cpu_pct"]
+        if cpu:
+            print(f"[LOAD] server CPU %: mean {cpu['mean']:.0f}  p90 {cpu['p90']:.0f}  max {cpu['max']:.0f}")
+        print(f"[LOAD] server RSS MB: max {r['server_rss_mb']['max']:.0f}  last {r['server_rss_mb']['last']:.0f}")
+
+
+def spawn_server(root: Path) -> subprocess.Popen:
+    """screenshot_server.py on its default ports with a scratch SKADVAZ_ROOT."""
+    env = dict(os.environ, SKADVAZ_ROOT=str(root))
+    proc = subprocess.Popen([sys.executable, str(Path(__file__).with_name("screenshot_server.py"))],
+                            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(SPAWN_WAIT_SEC)
+    if proc.poll() is not None:
+        sys.exit(f"[LOAD] server exited with {proc.returncode} (ports in use?)")
+    return proc
+
+
+def main():
+    default_root = Path(os.environ.get("SKADVAZ_ROOT", str(Path.home() / "skadvaz"))) / "runs" / "screens"
+    ap = argparse.ArgumentParser(description="Benchmark screenshot_server.py with simulated senders")
+    ap.add_argument("--host", default=DEFAULT_HOST)
+    ap.add_argument("--port", type=int, default=DEFAULT_PORT)
+    ap.add_argument("--root", type=Path, default=default_root, help="the server's runs/screens (for its notify socket)")
+    ap.add_argument("--senders", type=int, default=4)
+    ap.add_argument("--fps", type=float, default=2.0, help="frames per second per sender")
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds of sending")
+    ap.add_argument("--size", default=DEFAULT_SIZE, help="screen size WxH")
+    ap.add_argument("--change-rate", type=float, default=0.5, help="fraction of frames showing a new screen")
+    ap.add_argument("--variants", type=int, default=DEFAULT_VARIANTS, help="distinct screens to cycle through")
+    ap.add_argument("--graph-nodes", type=int, default=0, help="UI graph nodes per frame (0: host builds graphs)")
+    ap.add_argument("--deltas", action="store_true", help="send tile deltas between keyframes")
+    ap.add_argument("--keyframe-interval", type=int, default=30)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--pid", type=int, help="server process to sample CPU/RSS from")
+    ap.add_argument("--spawn", action="store_true", help="start a server on a scratch root and benchmark it")
+    ap.add_argument("--json", type=Path, help="also write the results here")
+    args = ap.parse_args()
+
+    proc = scratch = None
+    if args.spawn:
+        scratch = tempfile.TemporaryDirectory(prefix="loadgen-")
+        args.root = Path(scratch.name) / "runs" / "screens"
+        proc = spawn_server(Path(scratch.name))
+        args.pid = proc.pid
+    try:
+        result = run(args)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+            scratch.cleanup()
+    print_report(result)
+    if args.json:
+        args.json.write_text(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# metrics.py — in-process counters, gauges and latency histograms for the host.
+#
+# Modules declare their metrics at import time (like the event log, one shared
+# registry per process) and update them inline; serve() exposes the registry in
+# Prometheus text format on a local HTTP port:
+#
+#   curl -s localhost:5007/metrics
+#
+# Updates cost one lock and a dict lookup, so they are safe on the ingest and
+# writer paths.
+
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# seconds; roughly x2.5 steps from 0.5 ms to 10 s
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _fmt_labels(key: tuple, extra: tuple = ()) -> str:
+    items = key + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help):
+        super().__init__(name, help)
+        self._values = {}
+
+    def inc(self, n: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def _samples(self):
+        with self._lock:
+            return [f"{self.name}{_fmt_labels(k)} {v}" for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Set directly, or give fn() to sample the value at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name, help, fn=None):
+        super().__init__(name, help)
+        self._values = {}
+        self.fn = fn
+
+    def set(self, v: float, **labels):
+        with self._lock:
+            self._values[_labels(labels)] = v
+
+    def _samples(self):
+        if self.fn is not None:
+            try:
+                return [f"{self.name} {self.fn()}"]
+            except Exception:
+                return []
+        with self._lock:
+            return [f"{self.name}{_fmt_labels(k)} {v}" for k, v in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+        self._series = {}        # labels -> [bucket counts..., sum, count]
+
+    def observe(self, v: float, **labels):
+        key = _labels(labels)
+        i = bisect.bisect_left(self.buckets, v)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                s[i] += 1
+            s[-2] += v
+            s[-1] += 1
+
+    def _samples(self):
+        out = []
+        with self._lock:
+            series = [(k, list(s)) for k, s in self._series.items()]
+        for key, s in series:
+            acc = 0
+            for le, n in zip(self.buckets, s):
+                acc += n
+                out.append(f"{self.name}_bucket{_fmt_labels(key, (('le', le),))} {acc}")
+            out.append(f'{self.name}_bucket{_fmt_labels(key, (("le", "+Inf"),))} {s[-1]}')
+            out.append(f"{self.name}_sum{_fmt_labels(key)} {s[-2]}")
+            out.append(f"{self.name}_count{_fmt_labels(key)} {s[-1]}")
+        return out
+
+
+# ---- process-wide registry ---------------------------------------------------
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def _register(cls, name, help, **kw):
+    with _metrics_lock:
+        m = _metrics.get(name)
+        if m is None:
+            m = _metrics[name] = cls(name, help, **kw)
+        return m
+
+
+def counter(name: str, help: str) -> Counter:
+    return _register(Counter, name, help)
+
+
+def gauge(name: str, help: str, fn=None) -> Gauge:
+    g = _register(Gauge, name, help)
+    if fn is not None:
+        g.fn = fn
+    return g
+
+
+def histogram(name: str, help: str, buckets=LATENCY_BUCKETS) -> Histogram:
+    return _register(Histogram, name, help, buckets=buckets)
+
+
+def render() -> str:
+    with _metrics_lock:
+        ms = list(_metrics.values())
+    return "\n".join(line for m in ms for line in m.render()) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass                     # scrapes are not worth a console line each
+
+
+def serve(host: str, port: int) -> ThreadingHTTPServer:
+    """Serve /metrics from a daemon thread."""
+    srv = ThreadingHTTPServer((host, port), _Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, name="metrics", daemon=True).start()
+    print(f"[HOST] metrics on http://{host}:{port}/metrics")
+    return srv
@@ -1,15 +1,22 @@
 # pngsend.py — Change-detect sender with stability-before-send + proper unmute behavior
 
-import os, io, json, time, socket, threading, subprocess
+import os, json, time, socket, threading
 from pathlib import Path
 from datetime import datetime
 
 # --- DEPENDENCIES ---
 try:
-    from PIL import Image
     from screenshot_pb2 import Screenshot
+    from frame_stream import FrameStreamSender
+    from frame_delta import DeltaEncoder
+    from capture_backends import CAPTURE_BACKENDS, Capture, CaptureError, open_backend
+    import fingerprint
+    import frame_trace
+    import image_codecs
+    from tile_grid import TILE_GRID, TileGrid
+    from adaptive_sampler import AdaptiveSampler, CPU_BUDGET, SAMPLE_BACKOFF, SAMPLE_MAX_SEC, SAMPLE_MIN_SEC
 except ImportError as e:
-    print(f"FATAL: Missing dependency. pip install pillow protobuf. Error: {e}")
+    print(f"FATAL: Missing dependency. pip install pillow protobuf numpy. Error: {e}")
     exit(1)
 
 try:
@@ -23,43 +30,61 @@ HOST_PORT = 5001
 CONTROL_BIND_IP = "0.0.0.0"
 CONTROL_BIND_PORT = 5002
 CAPTURE_PATH = Path("/tmp/screen.png")
-
-SAMPLE_INTERVAL_SEC = 0.5
-ENABLE_PERCEPTION = False
+# First one that works on this display is used (capture_backends.py); the X11 ones
+# grab in process, gnome-screenshot is the fallback (and the only one under Wayland)
+CAPTURE_BACKEND_ORDER = CAPTURE_BACKENDS
+VM_ID = os.environ.get("AUROCH_VM_ID")  # unset: the host keys this clone on its address (vm_registry.py)
+
+# Sampling (adaptive_sampler.py): back to SAMPLE_MIN_SEC after unmute, capture_now or a
+# change, then x SAMPLE_BACKOFF per unchanged sample up to SAMPLE_MAX_SEC; capture and
+# change detection may use at most CPU_BUDGET of one CPU (0 = no limit). Defaults come
+# from adaptive_sampler.py (imported above; assign here to override).
+MUTED_POLL_SEC = 0.2
+ENABLE_PERCEPTION = False    # off: the host builds the UI graph (host_perception.py)
+SEND_DELTAS = True           # send only changed tiles against the previous frame (frame_delta.py)
+# Codecs for full frames, most preferred first; the first one this VM can encode and
+# the host decodes is used (image_codecs.py). gnome-screenshot already hands us a PNG,
+# so anything else costs a re-encode here.
+SEND_CODECS = ("png",)       # e.g. ("qoi", "png")
+
+# Change detection (tile_grid.py): the screen is compared per tile; regions listed
+# here, as fractions (x0, y0, x1, y1) of the screen, never count as a change
+TILE_GRID_SIZE = TILE_GRID   # cols, rows
+IGNORE_REGIONS = (
+    (0.45, 0.0, 0.55, 0.03),   # GNOME top-bar clock
+)
 
 # Stability/quarantine tuning
 STABLE_CONSEC = 3            # frames required for stability
 STABLE_MIN_MS = 800          # minimum time new state must persist before send
 QUARANTINE_MAX_MS = 6000     # post-send quiet window to re-baseline
+QUARANTINE_STABLE_MS = 800   # minimum time a post-send state must hold to become the baseline
 
 # ---- SHARED STATE ----
+host_stream = None           # FrameStreamSender; one persistent session to the host
+capture_backend = None       # opened in main()
+tile_grid = TileGrid(*TILE_GRID_SIZE, ignore=IGNORE_REGIONS)
+last_capture = None          # previous grab and its tile signature, so an unchanged screen isn't redone
+last_capture_sig = None
+delta_encoder = DeltaEncoder()
 muted_until_ms = 0
 capture_now_event = threading.Event()
+sampler = None               # AdaptiveSampler, made in main()
 
-# Baseline / quarantine
-baseline_hash = None
+# Baseline / quarantine (screen states are tile signatures)
+baseline_sig = None
 quarantine_until_ms = 0
-stable_hash = None
+stable_sig = None
 stable_count = 0
+stable_start_ms = 0
 
 # NEW: pre-send candidate tracking (stability-before-send)
-candidate_hash = None
+candidate_sig = None
 candidate_count = 0
 candidate_start_ms = 0
 
 # -----------------------------------------------------------------------------
 
-def _recv_line(conn):
-    buf = b""
-    while True:
-        chunk = conn.recv(1024)
-        if not chunk:
-            break
-        buf += chunk
-        if b"\n" in chunk:
-            break
-    return buf.decode("utf-8", errors="replace").strip()
-
 def now_ms():
     return int(time.time() * 1000)
 
@@ -67,62 +92,160 @@ def log(_msg):
     # Intentionally silent to avoid perturbing the VM display
     pass
 
-def capture_screen(out_path: Path):
-    try:
-        subprocess.run(["gnome-screenshot", "-f", str(out_path)], check=True, capture_output=True)
-    except FileNotFoundError:
-        # Last message we print; fatal
-        print("FATAL: 'gnome-screenshot' not found. Install it or change the capture command.")
-        exit(1)
-    except subprocess.CalledProcessError as e:
-        # Silent error; just raise
-        raise RuntimeError(f"screenshot failed: {e.stderr.decode(errors='replace')}")
-
-def dhash(image_bytes: bytes) -> int:
-    with Image.open(io.BytesIO(image_bytes)) as im:
-        im = im.convert("L").resize((9, 8), Image.Resampling.LANCZOS)
-        pixels = list(im.getdata())
-    hb = 0
-    for row in range(8):
-        for col in range(8):
-            idx = row * 9 + col
-            hb = (hb << 1) | (1 if pixels[idx] > pixels[idx + 1] else 0)
-    return hb
-
-def send_to_host(image_bytes: bytes, event: str):
+def capture_screen() -> Capture:
+    """One grab; pixels in memory, with the frame's trace stamps so far (frame_trace.py)."""
+    return capture_backend.grab()
+
+def frame_state(cap: Capture):
+    """
+    Tile signature of a grab (tile_grid.py), from a small gray thumbnail of its raw
+    pixels instead of a PNG encode + decode + full-size resize. A grab identical to the
+    previous one (an idle screen) costs one memcmp. Call once per sampled grab.
+    """
+    global last_capture, last_capture_sig
+    if cap is not last_capture and not cap.same_pixels(last_capture):
+        last_capture_sig = tile_grid.signature(cap)
+    last_capture = cap
+    tile_grid.observe(last_capture_sig)
+    return last_capture_sig
+
+def dirty_regions(cap: Capture, sig, ref) -> list | None:
+    """Pixel rectangles of the tiles that changed from ref (None without a ref: all of it)."""
+    if ref is None:
+        return None
+    return tile_grid.regions(tile_grid.dirty(sig, ref), cap.size)
+
+def send_to_host(cap: Capture, event: str, dirty: list | None = None):
+    """dirty: changed regions [[x, y, w, h], ...] since the previous send (None = whole screen)."""
+    trace = dict(cap.trace)
     ui_graph = {}
     if ENABLE_PERCEPTION and process_screenshot:
         try:
-            CAPTURE_PATH.write_bytes(image_bytes)
+            CAPTURE_PATH.write_bytes(cap.png)
             ui_graph = process_screenshot(str(CAPTURE_PATH))
         except Exception:
             pass
-
+        trace["perception"] = frame_trace.stamp()
 
     try:
-        h_hex = f"{dhash(image_bytes):016x}"
+        fp = fingerprint.fingerprint(cap)
+        h_hex = f"{fp.dhash:016x}"
+        hashes = {"phash": f"{fp.phash:016x}", "ahash": f"{fp.ahash:016x}"}
     except Exception:
-        h_hex = None
-
-    payload = {
-        "meta": {"vm_event": event, "hash": h_hex, "ts_ms": now_ms()},
-        "graph": ui_graph,
-    }
-
-    msg = Screenshot(
-        image_data=image_bytes,
-        timestamp=now_ms(),
-        ui_json=json.dumps(payload).encode("utf-8"),
-    )
-    data = msg.SerializeToString()
-    with socket.create_connection((HOST_IP, HOST_PORT), timeout=5) as s:
-        s.sendall(len(data).to_bytes(4, "big"))
-        s.sendall(data)
-
-# ---- CONTROL LISTENER (mute/unmute/capture_now) ----
+        h_hex, hashes = None, {}
+    trace["hash"] = frame_trace.stamp()
+
+    # Screenshot.timestamp is when the screen was captured, not when it is sent
+    ts = int(trace.get("capture_end") or now_ms())
+    codec = image_codecs.pick(SEND_CODECS, _host_stream().host_codecs)
+
+    def meta_json() -> bytes:
+        trace["send"] = frame_trace.stamp()
+        payload = {
+            "meta": {"vm_event": event, "hash": h_hex, **hashes, "dirty": dirty, "ts_ms": now_ms(),
+                     "trace": trace},
+            "graph": ui_graph,
+        }
+        return json.dumps(payload).encode("utf-8")
+
+    if not SEND_DELTAS:
+        image_bytes = cap.png if codec == image_codecs.PNG else image_codecs.encode(codec, cap.image)
+        trace["encode"] = frame_trace.stamp()
+        # Header only; the image follows as raw bytes so neither side copies it into a message
+        header = Screenshot(timestamp=ts, ui_json=meta_json(), codec=codec).SerializeToString()
+        _host_stream().send_frame_split(header, image_bytes)
+        return
+
+    # A keyframe carries the image as above; a delta carries its changed tiles in the header
+    delta_encoder.codec = codec
+    fields, image = delta_encoder.encode(cap.png_if_encoded(), cap.image)
+    trace["encode"] = frame_trace.stamp()
+    ui_json = meta_json()
+
+    def as_keyframe():
+        key_fields, png = delta_encoder.keyframe()
+        return Screenshot(timestamp=ts, ui_json=ui_json, **key_fields).SerializeToString(), png
+
+    header = Screenshot(timestamp=ts, ui_json=ui_json, **fields).SerializeToString()
+    _host_stream().send_frame_split(header, image, keyframe=as_keyframe)
+
+def _host_stream() -> FrameStreamSender:
+    global host_stream
+    if host_stream is None:
+        host_stream = FrameStreamSender(HOST_IP, HOST_PORT, vm_id=VM_ID)
+    return host_stream
+
+# ---- CONTROL LISTENER (mute/unmute/capture_now/clock/ping) ----
+def handle_control_command(line: str) -> bytes:
+    global muted_until_ms, quarantine_until_ms, stable_sig, stable_count
+    global candidate_sig, candidate_count, candidate_start_ms
+    if not line:
+        return b"ok\n"
+    obj = json.loads(line)
+    cmd = str(obj.get("cmd", "")).lower()
+
+    if cmd == "mute":
+        ttl = int(obj.get("ttl_ms", 120_000))
+        muted_until_ms = now_ms() + ttl
+        # Clear any in-flight tracking
+        quarantine_until_ms = 0
+        stable_sig = None; stable_count = 0
+        candidate_sig = None; candidate_count = 0; candidate_start_ms = 0
+        return b"ok\n"
+
+    if cmd == "unmute":
+        # IMPORTANT: keep baseline_sig as-is so we can detect change vs. pre-mute snapshot
+        muted_until_ms = 0
+        quarantine_until_ms = 0
+        stable_sig = None; stable_count = 0
+        candidate_sig = None; candidate_count = 0; candidate_start_ms = 0
+        _kick_sampler()
+        return b"ok\n"
+
+    if cmd == "capture_now":
+        capture_now_event.set()
+        _kick_sampler()
+        return b"ok\n"
+
+    if cmd == "clock":
+        # Host clock-offset estimate for frame traces (frame_trace.py)
+        return (json.dumps({"t_ms": frame_trace.stamp()}) + "\n").encode("utf-8")
+
+    # "ping" (bridge health check) and unknown commands
+    return b"ok\n"
+
+def _kick_sampler():
+    # The screen is about to move: sample fast, starting now
+    if sampler is not None:
+        sampler.kick()
+
+def control_connection_thread(conn):
+    """
+    One control client. Connections may stay open (the host bridge pools them) and
+    carry several newline-delimited commands; each gets exactly one reply line.
+    """
+    with conn:
+        buf = b""
+        while True:
+            try:
+                chunk = conn.recv(4096)
+            except OSError:
+                return
+            if not chunk:
+                return
+            buf += chunk
+            while b"\n" in buf:
+                raw, _, buf = buf.partition(b"\n")
+                try:
+                    reply = handle_control_command(raw.decode("utf-8", errors="replace").strip())
+                except Exception:
+                    reply = b"ok\n"
+                try:
+                    conn.sendall(reply)
+                except OSError:
+                    return
+
 def control_listener_thread():
-    global muted_until_ms, quarantine_until_ms, stable_hash, stable_count
-    global candidate_hash, candidate_count, candidate_start_ms
     try:
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -131,48 +254,26 @@ def control_listener_thread():
             print(f"[{datetime.now().isoformat()}] [VM-CTL] Listening on {CONTROL_BIND_IP}:{CONTROL_BIND_PORT}")
             while True:
                 conn, _ = s.accept()
-                with conn:
-                    try:
-                        line = _recv_line(conn)
-                        if not line:
-                            conn.sendall(b"ok\n"); continue
-                        obj = json.loads(line)
-                        cmd = str(obj.get("cmd", "")).lower()
-
-                        if cmd == "mute":
-                            ttl = int(obj.get("ttl_ms", 120_000))
-                            muted_until_ms = now_ms() + ttl
-                            # Clear any in-flight tracking
-                            quarantine_until_ms = 0
-                            stable_hash = None; stable_count = 0
-                            candidate_hash = None; candidate_count = 0; candidate_start_ms = 0
-                            conn.sendall(b"ok\n"); continue
-
-                        if cmd == "unmute":
-                            # IMPORTANT: keep baseline_hash as-is so we can detect change vs. pre-mute snapshot
-                            muted_until_ms = 0
-                            quarantine_until_ms = 0
-                            stable_hash = None; stable_count = 0
-                            candidate_hash = None; candidate_count = 0; candidate_start_ms = 0
-                            conn.sendall(b"ok\n"); continue
-
-                        if cmd == "capture_now":
-                            capture_now_event.set()
-                            conn.sendall(b"ok\n"); continue
-
-                        conn.sendall(b"ok\n")
-                    except Exception:
-                        try: conn.sendall(b"ok\n")
-                        except: pass
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                threading.Thread(target=control_connection_thread, args=(conn,), daemon=True).start()
     except Exception as e:
         print(f"[VM-CTL] FATAL: control listener failed: {e} (continuing without UI control)")
 
 # ---- MAIN LOOP ----
 def main():
+    global capture_backend, sampler
+    try:
+        capture_backend = open_backend(CAPTURE_BACKEND_ORDER)
+    except CaptureError as e:
+        # Last message we print; fatal
+        print(f"FATAL: {e}")
+        exit(1)
+    sampler = AdaptiveSampler(SAMPLE_MIN_SEC, SAMPLE_MAX_SEC, SAMPLE_BACKOFF, CPU_BUDGET)
     threading.Thread(target=control_listener_thread, daemon=True).start()
+    _host_stream()  # open the session now so the first frame doesn't pay for setup
 
-    global baseline_hash, quarantine_until_ms, stable_hash, stable_count
-    global candidate_hash, candidate_count, candidate_start_ms
+    global baseline_sig, quarantine_until_ms, stable_sig, stable_count, stable_start_ms
+    global candidate_sig, candidate_count, candidate_start_ms
     global muted_until_ms
 
     muted_until_ms = now_ms() +31_536_000_000
@@ -182,83 +283,90 @@ def main():
             # Highest priority: manual capture
             if capture_now_event.is_set():
                 capture_now_event.clear()
-                capture_screen(CAPTURE_PATH)
-                img_bytes = CAPTURE_PATH.read_bytes()
-                send_to_host(img_bytes, "manual_capture")
+                cap = capture_screen()
+                sig = frame_state(cap)
+                send_to_host(cap, "manual_capture", dirty_regions(cap, sig, baseline_sig))
                 # Adopt as baseline to prevent churn
-                baseline_hash = dhash(img_bytes)
+                baseline_sig = sig
                 quarantine_until_ms = 0
-                stable_hash = None; stable_count = 0
-                candidate_hash = None; candidate_count = 0; candidate_start_ms = 0
-                time.sleep(SAMPLE_INTERVAL_SEC); continue
+                stable_sig = None; stable_count = 0
+                candidate_sig = None; candidate_count = 0; candidate_start_ms = 0
+                sampler.update(True)
+                sampler.sleep(); continue
 
             now = now_ms()
 
             # Muted: do nothing
             if now < muted_until_ms:
-                time.sleep(0.2); continue
+                sampler.pause(MUTED_POLL_SEC); continue
 
             # Post-send quarantine: silently seek a stable baseline
             if quarantine_until_ms > now:
-                capture_screen(CAPTURE_PATH)
-                h = dhash(CAPTURE_PATH.read_bytes())
-                if stable_hash is None or h != stable_hash:
-                    stable_hash = h; stable_count = 1
+                h = frame_state(capture_screen())
+                moved = tile_grid.changed(h, stable_sig)
+                if moved:
+                    stable_sig = h; stable_count = 1; stable_start_ms = now
                 else:
                     stable_count += 1
-                if stable_count >= STABLE_CONSEC:
-                    baseline_hash = stable_hash
+                # Fast ticks reach STABLE_CONSEC within a fraction of a second; a
+                # transition that pauses that briefly must not become the baseline
+                if stable_count >= STABLE_CONSEC and (now - stable_start_ms) >= QUARANTINE_STABLE_MS:
+                    baseline_sig = stable_sig
                     quarantine_until_ms = 0
-                    stable_hash = None; stable_count = 0
-                time.sleep(SAMPLE_INTERVAL_SEC); continue
+                    stable_sig = None; stable_count = 0
+                sampler.update(moved)
+                sampler.sleep(); continue
 
             # Quarantine timed out: adopt last candidate if any
             if quarantine_until_ms != 0 and quarantine_until_ms <= now:
-                baseline_hash = stable_hash
+                baseline_sig = stable_sig
                 quarantine_until_ms = 0
-                stable_hash = None; stable_count = 0
-                time.sleep(SAMPLE_INTERVAL_SEC); continue
+                stable_sig = None; stable_count = 0
+                continue
 
             # Normal change-detect polling
-            capture_screen(CAPTURE_PATH)
-            img_bytes = CAPTURE_PATH.read_bytes()
-            h = dhash(img_bytes)
+            cap = capture_screen()
+            h = frame_state(cap)
 
             # First boot baseline
-            if baseline_hash is None:
-                baseline_hash = h
-                time.sleep(SAMPLE_INTERVAL_SEC); continue
+            if baseline_sig is None:
+                baseline_sig = h
+                sampler.update(False)
+                sampler.sleep(); continue
 
-            if h == baseline_hash:
+            if not tile_grid.changed(h, baseline_sig):
                 # No change: reset candidate tracking
-                candidate_hash = None; candidate_count = 0; candidate_start_ms = 0
-                time.sleep(SAMPLE_INTERVAL_SEC); continue
-
-            # h != baseline_hash → track candidate until stable
-            if candidate_hash is None or h != candidate_hash:
-                candidate_hash = h
+                candidate_sig = None; candidate_count = 0; candidate_start_ms = 0
+                sampler.update(False)
+                sampler.sleep(); continue
+
+            # h differs from baseline_sig → track candidate until stable (sampling fast:
+            # a settled screen is sent as soon as STABLE_CONSEC/STABLE_MIN_MS allow)
+            sampler.update(True)
+            if tile_grid.changed(h, candidate_sig):
+                candidate_sig = h
                 candidate_count = 1
                 candidate_start_ms = now
-                time.sleep(SAMPLE_INTERVAL_SEC); continue
+                sampler.sleep(); continue
             else:
                 candidate_count += 1
                 # Send only once the new state is stable enough
                 if candidate_count >= STABLE_CONSEC and (now - candidate_start_ms) >= STABLE_MIN_MS:
-                    send_to_host(img_bytes, "change_send")
+                    send_to_host(cap, "change_send", dirty_regions(cap, h, baseline_sig))
                     # Enter quarantine to finalize a new baseline after any ripple
                     quarantine_until_ms = now_ms() + QUARANTINE_MAX_MS
-                    stable_hash = None; stable_count = 0
+                    stable_sig = None; stable_count = 0
                     # Clear candidate tracking
-                    candidate_hash = None; candidate_count = 0; candidate_start_ms = 0
-                    time.sleep(SAMPLE_INTERVAL_SEC); continue
+                    candidate_sig = None; candidate_count = 0; candidate_start_ms = 0
+                    sampler.sleep(); continue
 
-            time.sleep(SAMPLE_INTERVAL_SEC)
+            sampler.sleep()
 
         except KeyboardInterrupt:
             break
         except BaseException:
             # Sleep briefly and keep going on any transient error
-            time.sleep(5)
+            sampler.pause(5)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,114 @@
+# previews.py — preview pyramid for received frames (host side).
+#
+# For every stored frame the server builds, once per unique image:
+#   half     1/2 scale, color
+#   quarter  1/4 scale, color
+#   thumb    1/4 scale, grayscale (what the host UI's "next shot" panel shows)
+# as JPEGs, stored as blobs in the run's segment files and listed in previews.jsonl
+# (see frame_store.py). Decoding a full-size PNG is CPU-bound, so the work runs in a
+# process pool; a single drain thread hands results back in frame order. Previews are
+# a convenience, never on the path to a frame being announced: when more than
+# PREVIEW_QUEUE_MAX frames wait, the oldest waiting jobs are dropped (those frames keep
+# no previews and readers use the full image), so the copies held here stay bounded.
+#
+# Pillow is optional: without it no previews are built and readers fall back to the
+# full image.
+
+import collections
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+PREVIEW_LEVELS = ("half", "quarter", "thumb")
+PREVIEW_WORKERS = 2
+PREVIEW_QUALITY = 80
+PREVIEW_QUEUE_MAX = 16
+
+PREVIEW_SECONDS = metrics.histogram("auroch_preview_seconds", "Time from submit until a frame's previews are stored")
+PREVIEW_SKIPPED = metrics.counter("auroch_preview_skipped_total", "Frames left without previews, by reason")
+
+
+def make_previews(image: bytes) -> dict[str, bytes]:
+    """Decode once, halve twice, encode each level (runs in a worker process)."""
+    import io
+
+    def jpeg(im) -> bytes:
+        out = io.BytesIO()
+        im.save(out, "JPEG", quality=PREVIEW_QUALITY)
+        return out.getvalue()
+
+    im = Image.open(io.BytesIO(image))
+    im = im.convert("RGB") if im.mode not in ("RGB", "L") else im
+    half = im.reduce(2)
+    quarter = half.reduce(2)
+    return {"half": jpeg(half), "quarter": jpeg(quarter), "thumb": jpeg(quarter.convert("L"))}
+
+
+class PreviewBuilder:
+    """
+    submit(store, rec, image, ctx) after rec is durable; on_ready(store, rec, previews, ctx)
+    follows in submission order once the previews are stored. previews maps level ->
+    blob digest ({} if none could be built). Images that already have previews in the
+    run are not decoded again.
+    """
+
+    def __init__(self, on_ready, workers: int = PREVIEW_WORKERS, max_queue: int = PREVIEW_QUEUE_MAX):
+        self.on_ready = on_ready
+        self.max_queue = max_queue
+        self.pool = None
+        if Image is not None:
+            # spawn: the server is threaded, and forking a threaded process is unsafe
+            self.pool = ProcessPoolExecutor(max_workers=workers,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+        threading.Thread(target=self._drain, name="previews", daemon=True).start()
+
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def submit(self, store, rec: dict, image, ctx=None):
+        known = store.previews_for_image(rec["image"])
+        with self._cond:
+            # Behind: the newest frame is the one a viewer wants, drop the stalest
+            while len(self._pending) >= self.max_queue:
+                job = self._pending.popleft()[0]
+                if not isinstance(job, dict):
+                    job.cancel()
+                PREVIEW_SKIPPED.inc(reason="backlog")
+            if known is not None or self.pool is None:
+                job = known or {}
+            else:
+                job = self.pool.submit(make_previews, bytes(image))
+            self._pending.append((job, store, rec, ctx, time.monotonic()))
+            self._cond.notify()
+
+    def _drain(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                job, store, rec, ctx, t_submit = self._pending.popleft()
+            try:
+                if isinstance(job, dict):
+                    previews = store.link_previews(rec, job) if job else {}
+                else:
+                    previews = store.add_previews(rec, job.result())
+            except Exception as e:
+                print(f"[HOST] previews: frame {rec['index']} failed: {e}")
+                PREVIEW_SKIPPED.inc(reason="error")
+                previews = {}
+            PREVIEW_SECONDS.observe(time.monotonic() - t_submit)
+            try:
+                self.on_ready(store, rec, previews, ctx)
+            except Exception as e:
+                print(f"[HOST] previews: on_ready failed: {e}")
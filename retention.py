@@ -0,0 +1,289 @@
+# retention.py — quotas, archiving and eviction for runs/screens.
+#
+# Two tiers:
+#   hot   runs/screens/<run_id>/              written and read in place
+#   cold  runs/screens/archive/<run_id>.zip   same files, one member each; segment
+#                                             files are stored (their PNGs are already
+#                                             compressed, and stored members stay
+#                                             seekable), logs and indexes are deflated.
+#                                             frame_store.open_run() reads it in place.
+#
+# One pass (apply()):
+#   1. hot runs idle for archive_after_days, or bigger than run_max_bytes, are archived
+#   2. archives idle for delete_after_days are deleted
+#   3. while everything under runs/screens is above max_total_bytes, the least recently
+#      used run (hot or archived) is deleted
+# "Used" is the newest of: last write, last open_run() (frame_store.ACCESS_MARKER).
+# Runs from before segment files are converted (frame_store.convert_legacy_run) when
+# they are archived. Deleted runs lose their rows in index.sqlite (frame_index.py) in
+# the same pass; archived runs keep theirs, open_run() reads the archive in place.
+# Current runs (current_run.txt, current/*.txt) are never touched. A run may carry a
+# retention.json that overrides the policy for itself:
+#   {"tags": ["keep"], "archive_after_days": 30, "delete_after_days": 0, "max_bytes": ...}
+# Tags: "keep" = never deleted, "hot" = never archived. 0 disables a limit.
+#
+#   python3 retention.py run [--dry-run]          apply the policy once
+#   python3 retention.py status                   sizes, ages and tags of every run
+#   python3 retention.py tag <run_id> keep [--remove]
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+import zipfile
+from pathlib import Path
+from typing import NamedTuple
+
+from frame_index import INDEX_FILE, FrameIndexWriter
+from frame_store import (ACCESS_MARKER, ARCHIVE_DIR, ArchiveRun, convert_legacy_run, digest_of, fsync_path,
+                         read_records, write_atomic)
+from segment_store import SEGMENT_DIR
+
+ARCHIVE_AFTER_DAYS = 7.0
+DELETE_AFTER_DAYS = 0.0          # archived runs are kept until the global quota needs room
+RUN_MAX_BYTES = 0                # archive oversized runs early
+MAX_TOTAL_BYTES = 0              # global quota for runs/screens
+RETENTION_FILE = "retention.json"
+DAY_SEC = 24 * 3600
+
+
+class Policy(NamedTuple):
+    archive_after_days: float = ARCHIVE_AFTER_DAYS
+    delete_after_days: float = DELETE_AFTER_DAYS
+    run_max_bytes: int = RUN_MAX_BYTES
+    max_total_bytes: int = MAX_TOTAL_BYTES
+
+
+class RunInfo(NamedTuple):
+    run_id: str
+    path: Path               # run directory or archive file
+    archived: bool
+    size: int
+    last_used: float
+    settings: dict           # retention.json contents
+
+
+# ---- discovery ---------------------------------------------------------------
+def _tree_stats(d: Path) -> tuple[int, float]:
+    size, newest = 0, 0.0
+    for dirpath, _dirs, files in os.walk(d):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            size += st.st_size
+            newest = max(newest, st.st_mtime)
+    return size, newest
+
+
+def current_runs(root: Path) -> set[str]:
+    out = set()
+    pointers = [root / "current_run.txt"] + sorted((root / "current").glob("*.txt"))
+    for f in pointers:
+        try:
+            out.add(f.read_text().strip())
+        except OSError:
+            pass
+    return out
+
+
+def list_runs(root: Path) -> list[RunInfo]:
+    runs = []
+    for d in sorted(root.iterdir()) if root.exists() else []:
+        if not d.is_dir() or d.name in (ARCHIVE_DIR, "current") or d.name.startswith("."):
+            continue
+        size, newest = _tree_stats(d)
+        settings = {}
+        try:
+            settings = json.loads((d / RETENTION_FILE).read_text())
+        except (OSError, ValueError):
+            pass
+        runs.append(RunInfo(d.name, d, False, size, newest, settings))
+    for z in sorted((root / ARCHIVE_DIR).glob("*.zip")):
+        settings = {}
+        try:
+            with zipfile.ZipFile(z) as zf:
+                settings = json.loads(zf.read(RETENTION_FILE))
+        except (KeyError, OSError, ValueError, zipfile.BadZipFile):
+            pass
+        st = z.stat()
+        runs.append(RunInfo(z.stem, z, True, st.st_size, st.st_mtime, settings))
+    return runs
+
+
+# ---- archiving ---------------------------------------------------------------
+def archive_run(run_dir: Path) -> Path:
+    """
+    Pack a run into archive/<run_id>.zip, verify every frame against its recorded
+    digest, then remove the directory. A legacy run is converted to segment files
+    first. Returns the archive path.
+    """
+    run_dir = Path(run_dir)
+    last_used = _tree_stats(run_dir)[1]
+    if not (run_dir / SEGMENT_DIR).is_dir():
+        convert_legacy_run(run_dir, delete=True)
+    dest_dir = run_dir.parent / ARCHIVE_DIR
+    dest_dir.mkdir(exist_ok=True)
+    dest = dest_dir / f"{run_dir.name}.zip"
+    tmp = dest_dir / f".{run_dir.name}.zip.tmp"
+
+    with zipfile.ZipFile(tmp, "w") as zf:
+        for path in sorted(run_dir.rglob("*")):
+            if not path.is_file() or path.name == ACCESS_MARKER:
+                continue
+            rel = path.relative_to(run_dir).as_posix()
+            stored = rel.startswith(f"{SEGMENT_DIR}/seg_")
+            zf.write(path, rel, compress_type=zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED)
+    with open(tmp, "rb") as f:
+        os.fsync(f.fileno())
+
+    archived = ArchiveRun(tmp)
+    try:
+        for rec in read_records(run_dir):
+            if digest_of(archived.image_bytes(rec["index"])) != rec["image"]:
+                raise RuntimeError(f"{run_dir.name}: archive verification failed at frame {rec['index']}")
+    except Exception:
+        archived.close()
+        tmp.unlink()
+        raise
+    archived.close()
+
+    os.utime(tmp, (last_used, last_used))   # archiving is not a use; keep the LRU order
+    os.replace(tmp, dest)
+    fsync_path(dest_dir)
+    shutil.rmtree(run_dir)
+    return dest
+
+
+def delete_run(info: RunInfo):
+    if info.archived:
+        info.path.unlink()
+    else:
+        shutil.rmtree(info.path)
+
+
+# ---- policy ------------------------------------------------------------------
+def _limit(info: RunInfo, key: str, default):
+    v = info.settings.get(key)
+    return default if v is None else v
+
+
+def plan(root: Path, policy: Policy = Policy(), now: float | None = None) -> list[tuple[str, RunInfo, str]]:
+    """[(action, run, reason)] with action "archive" or "delete", in the order to apply them."""
+    now = time.time() if now is None else now
+    protected = current_runs(root)
+    all_runs = list_runs(root)
+    runs = [r for r in all_runs if r.run_id not in protected]
+    actions = []
+    gone = set()
+
+    for r in runs:
+        tags = set(r.settings.get("tags", ()))
+        idle_days = (now - r.last_used) / DAY_SEC
+        if not r.archived and "hot" not in tags:
+            after = _limit(r, "archive_after_days", policy.archive_after_days)
+            max_bytes = _limit(r, "max_bytes", policy.run_max_bytes)
+            if after and idle_days >= after:
+                actions.append(("archive", r, f"idle {idle_days:.1f} days"))
+            elif max_bytes and r.size > max_bytes:
+                actions.append(("archive", r, f"{r.size} bytes > {max_bytes}"))
+        elif r.archived and "keep" not in tags:
+            after = _limit(r, "delete_after_days", policy.delete_after_days)
+            if after and idle_days >= after:
+                actions.append(("delete", r, f"archived and idle {idle_days:.1f} days"))
+                gone.add(r.run_id)
+
+    if policy.max_total_bytes:
+        total = sum(r.size for r in all_runs if r.run_id not in gone)
+        for r in sorted(runs, key=lambda r: r.last_used):       # least recently used first
+            if total <= policy.max_total_bytes:
+                break
+            if r.run_id in gone or "keep" in r.settings.get("tags", ()):
+                continue
+            actions = [a for a in actions if a[1].run_id != r.run_id]
+            actions.append(("delete", r, f"over total quota ({total} > {policy.max_total_bytes})"))
+            gone.add(r.run_id)
+            total -= r.size
+    return actions
+
+
+def apply(root: Path, policy: Policy = Policy(), dry_run: bool = False,
+          index: FrameIndexWriter | None = None) -> list[tuple[str, RunInfo, str]]:
+    """Run plan(); index (if given) drops the rows of every run deleted."""
+    done = []
+    for action, r, why in plan(root, policy):
+        print(f"[RETENTION] {'would ' if dry_run else ''}{action} {r.run_id}: {why}")
+        if dry_run:
+            done.append((action, r, why))
+            continue
+        try:
+            if action == "archive":
+                archive_run(r.path)
+            else:
+                delete_run(r)
+                if index is not None:
+                    index.drop_run(r.run_id)
+            done.append((action, r, why))
+        except Exception as e:
+            print(f"[RETENTION] {action} {r.run_id} failed: {e}")
+    return done
+
+
+def set_tag(root: Path, run_id: str, tag: str, remove: bool = False):
+    run_dir = root / run_id
+    if not run_dir.is_dir():
+        raise RuntimeError(f"{run_id}: no hot run by that name (archived runs keep the tags they had)")
+    f = run_dir / RETENTION_FILE
+    settings = json.loads(f.read_text()) if f.exists() else {}
+    tags = set(settings.get("tags", ()))
+    tags.discard(tag) if remove else tags.add(tag)
+    settings["tags"] = sorted(tags)
+    write_atomic(f, json.dumps(settings).encode("utf-8"))
+
+
+def main():
+    default_root = Path(os.environ.get("SKADVAZ_ROOT", str(Path.home() / "skadvaz"))) / "runs" / "screens"
+    ap = argparse.ArgumentParser(description="Retention for runs/screens")
+    ap.add_argument("--root", type=Path, default=default_root)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run", help="apply the retention policy once")
+    r.add_argument("--dry-run", action="store_true")
+    r.add_argument("--archive-after-days", type=float, default=ARCHIVE_AFTER_DAYS)
+    r.add_argument("--delete-after-days", type=float, default=DELETE_AFTER_DAYS)
+    r.add_argument("--run-max-bytes", type=int, default=RUN_MAX_BYTES)
+    r.add_argument("--max-total-bytes", type=int, default=MAX_TOTAL_BYTES)
+    sub.add_parser("status", help="list runs with size, idle time and tags")
+    t = sub.add_parser("tag", help="tag a hot run (keep = never delete, hot = never archive)")
+    t.add_argument("run_id")
+    t.add_argument("tag", choices=("keep", "hot"))
+    t.add_argument("--remove", action="store_true")
+    args = ap.parse_args()
+
+    if args.cmd == "run":
+        index = None
+        if not args.dry_run and (args.root / INDEX_FILE).exists():
+            index = FrameIndexWriter(args.root / INDEX_FILE)
+        apply(args.root, Policy(args.archive_after_days, args.delete_after_days,
+                                args.run_max_bytes, args.max_total_bytes), dry_run=args.dry_run, index=index)
+        if index is not None:
+            index.flush(timeout=None)
+    elif args.cmd == "status":
+        now = time.time()
+        protected = current_runs(args.root)
+        for r in list_runs(args.root):
+            state = "current" if r.run_id in protected else ("archived" if r.archived else "hot")
+            tags = ",".join(r.settings.get("tags", ()))
+            print(f"{r.run_id:40s} {state:8s} {r.size / 1e6:10.1f} MB  idle {(now - r.last_used) / DAY_SEC:6.1f} d  {tags}")
+    else:
+        try:
+            set_tag(args.root, args.run_id, args.tag, remove=args.remove)
+        except Exception as e:
+            print(f"[RETENTION] {e}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
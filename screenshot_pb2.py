@@ -13,13 +13,17 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x10screenshot.proto\"V\n\nScreenshot\x12\x10\n\x08\x66ilename\x18\x01 \x01(\t\x12\x12\n\nimage_data\x18\x02 \x01(\x0c\x12\x11\n\ttimestamp\x18\x03 \x01(\x03\x12\x0f\n\x07ui_json\x18\x04 \x01(\x0c\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x10screenshot.proto\"*\n\x04Tile\x12\t\n\x01x\x18\x01 \x01(\r\x12\t\n\x01y\x18\x02 \x01(\r\x12\x0c\n\x04\x64\x61ta\x18\x03 \x01(\x0c\"\xdb\x01\n\nScreenshot\x12\x10\n\x08\x66ilename\x18\x01 \x01(\t\x12\x12\n\nimage_data\x18\x02 \x01(\x0c\x12\x11\n\ttimestamp\x18\x03 \x01(\x03\x12\x0f\n\x07ui_json\x18\x04 \x01(\x0c\x12\x1e\n\x04kind\x18\x05 \x01(\x0e\x32\x10.Screenshot.Kind\x12\x0b\n\x03seq\x18\x06 \x01(\r\x12\x10\n\x08\x62\x61se_seq\x18\x07 \x01(\r\x12\x14\n\x05tiles\x18\x08 \x03(\x0b\x32\x05.Tile\x12\r\n\x05\x63odec\x18\t \x01(\t\"\x1f\n\x04Kind\x12\x0c\n\x08KEYFRAME\x10\x00\x12\t\n\x05\x44\x45LTA\x10\x01\x62\x06proto3')
 
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'screenshot_pb2', globals())
 if _descriptor._USE_C_DESCRIPTORS == False:
 
   DESCRIPTOR._options = None
-  _SCREENSHOT._serialized_start=20
-  _SCREENSHOT._serialized_end=106
+  _TILE._serialized_start=20
+  _TILE._serialized_end=62
+  _SCREENSHOT._serialized_start=65
+  _SCREENSHOT._serialized_end=284
+  _SCREENSHOT_KIND._serialized_start=253
+  _SCREENSHOT_KIND._serialized_end=284
 # @@protoc_insertion_point(module_scope)
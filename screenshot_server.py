@@ -1,15 +1,55 @@
 # screenshot_server.py  (HOST)
-# Listens on 0.0.0.0:5001, accepts many connections, each sends 1 protobuf Screenshot.
-# Saves into runs/screens/<run_id>/ and updates latest.json + current_run.txt.
-# Also runs a tiny VM control bridge so the Pi can reach the VM via the host.
+# Listens on 0.0.0.0:5001. Senders either open a persistent session (see frame_stream.py)
+# and stream many Screenshots over it, or (legacy) send 1 protobuf Screenshot and close.
+# Connections are served concurrently by an asyncio ingest loop; disk work is handed to
+# a write-behind writer (disk_writer.py) so a slow sender or a slow disk never blocks accept().
+# Saves into runs/screens/<run_id>/ (content-addressed segment files, see frame_store.py
+# and segment_store.py) and updates latest.json.
+# Many VMs can feed one server: each is identified by the vm_id in its session hello
+# and gets its own run, latest.json and control target (see vm_registry.py); frames
+# are handed to the disk writer round-robin across VMs (fair_queue.py).
+# Every durable frame is announced on runs/screens/frames.sock (frame_notify.py) right
+# away, so the host UI learns about it without polling the disk; its preview pyramid
+# (previews.py) is built afterwards and announced by a follow-up event. Frames that
+# arrive without a UI graph get one built on the host (host_perception.py), announced
+# the same way once it is stored.
+# Also runs a tiny VM control bridge so the Pi can reach the VMs via the host.
+# Senders may send tile deltas against their previous frame (frame_delta.py); those
+# are turned back into full frames here, so storage only ever holds complete images.
+# Images may arrive in any codec both ends support (image_codecs.py); codecs not in
+# STORED_CODECS are transcoded to TRANSCODE_TO before they are stored.
+# Memory is bounded by byte budgets (admission.py): over budget, queued frames are
+# dropped oldest-first and senders get a SLOW_DOWN record.
+# Counters and latency histograms are served in Prometheus text format on
+# METRICS_HOST:METRICS_PORT (metrics.py). Per-frame stage timestamps, VM and host,
+# go to runs/screens/<run_id>/trace.jsonl (frame_trace.py).
+# Saved frames and bridge commands are also indexed in runs/screens/index.sqlite
+# (frame_index.py) for queries that would otherwise scan every run directory.
 
 import socket
 import time
 import json
+import asyncio
 from pathlib import Path
-from datetime import datetime
+from typing import NamedTuple
 from screenshot_pb2 import Screenshot
-import threading
+import frame_stream
+import frame_trace
+import image_codecs
+import metrics
+import retention
+from frame_delta import DeltaDecoder, DeltaError
+from frame_index import INDEX_FILE, FrameIndexWriter
+from frame_store import RunStore
+from host_perception import PerceptionPool
+from disk_writer import DiskWriter
+from event_log import event_log_for
+from admission import Admission, ConnBudget
+from fair_queue import FairQueue
+from frame_notify import NOTIFY_SOCKET, FramePublisher
+from previews import PreviewBuilder
+from vm_ctl_bridge import VmCtlBridge
+from vm_registry import DEFAULT_VM_ID, VmRegistry
 import os
 
 HOST = "0.0.0.0"
@@ -20,185 +60,559 @@ BASE = Path(os.environ.get("SKADVAZ_ROOT", str(Path.home() / "skadvaz")))
 ROOT = BASE / "runs" / "screens"
 
 # VM control (where pngsend.py listens)
-VM_IP = "192.168.122.4"     # <-- your VM's IP
+VM_IP = "192.168.122.4"     # <-- default VM's IP until it connects; other VMs use their peer address
 VM_CTRL_PORT = 5002         # <-- pngsend.py control port
 
 # Host bridge endpoint (what the Pi will call)
 BRIDGE_LISTEN_HOST = "0.0.0.0"
 BRIDGE_LISTEN_PORT = 5006   # <-- Pi will send mute/unmute here
 
+# Ingest tuning
+READ_TIMEOUT_SEC = 10.0     # per-read timeout; a stalled sender is dropped after this
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024   # larger length prefixes are rejected, not buffered
+DISK_QUEUE_MAX = 64         # frames allowed to wait for the disk writer before ingest waits
+VM_QUEUE_MAX = 8            # frames one VM may have waiting for the writer before its reads wait
+STATUS_INTERVAL_SEC = 5.0   # how often runs/screens/vms.json is rewritten
+
+# Image codecs kept as sent; the host UI, previews and perception all open these.
+# Anything else (qoi, zstd_rgb, ...) is transcoded on arrival.
+STORED_CODECS = ("png",)    # e.g. ("png", "webp") if GdkPixbuf has a WebP loader
+TRANSCODE_TO = "png"
+
+# Retention (see retention.py): archive idle runs, enforce quotas
+RETENTION_INTERVAL_SEC = 3600.0
+RETENTION_POLICY = retention.Policy()   # e.g. retention.Policy(max_total_bytes=500 * 1024**3)
+
+# Metrics endpoint (local only)
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 5007
+
+FRAMES_RECEIVED = metrics.counter("auroch_frames_received_total", "Frames parsed, per VM")
+BYTES_RECEIVED = metrics.counter("auroch_bytes_received_total", "Frame payload bytes received, per VM")
+FRAMES_SAVED = metrics.counter("auroch_frames_saved_total", "Frames durable on disk, per VM")
+FRAMES_DEDUP = metrics.counter("auroch_frames_dedup_total", "Saved frames whose image was already stored, per VM")
+REJECTED = metrics.counter("auroch_rejected_total", "Messages or connections refused, by reason")
+DROPPED = metrics.counter("auroch_frames_dropped_total", "Queued frames dropped to stay within the byte budget, per VM")
+SLOW_DOWNS = metrics.counter("auroch_slow_down_sent_total", "SLOW_DOWN records sent to senders, per VM")
+PARSE_SECONDS = metrics.histogram("auroch_parse_seconds", "Time to parse one Screenshot")
+SAVE_SECONDS = metrics.histogram("auroch_save_latency_seconds", "Time from a frame's last byte received until it is durable")
+VM_CTL_SECONDS = metrics.histogram("auroch_vm_ctl_rtt_seconds", "Bridge round trip to the VM control port, per VM")
+VM_CTL_FORWARDS = metrics.counter("auroch_vm_ctl_forwards_total", "Commands forwarded by the bridge, per VM and result")
+DELTA_FRAMES = metrics.counter("auroch_delta_frames_total", "Delta frames received, per VM and result")
+DELTA_SECONDS = metrics.histogram("auroch_delta_apply_seconds", "Time to rebuild a full frame from a delta")
+TRANSCODE_SECONDS = metrics.histogram("auroch_transcode_seconds", "Time to transcode a frame for storage, per codec")
+
 
 # ---- host logging helper -----------------------------------------------------
-def host_log(run_dir: Path, message: str):
-    ts = datetime.now().isoformat()
-    line = f"[{ts}] {message}"
-    print(f"[HOST] {line}")
+def host_log(run_dir: Path, kind: str, echo: str | None = None, **fields):
+    """
+    Structured event into runs/screens/<run_id>/events.jsonl (buffered, see event_log.py).
+    `echo` is an optional human-readable line for the console.
+    """
+    if echo:
+        print(f"[HOST] {echo}")
     try:
-        run_dir.mkdir(parents=True, exist_ok=True)
-        with open(run_dir / "events.log", "a", encoding="utf-8") as f:
-            f.write(line + "\n")
+        event_log_for(run_dir).emit(kind, **fields)
     except Exception as e:
-        print(f"[HOST] warn: could not write events.log: {e}")
+        print(f"[HOST] warn: could not log event: {e}")
 
 
 # ---- tiny TCP bridge: Pi -> (host) -> VM pngsend.py --------------------------
 def start_vm_ctl_bridge(
     listen_host: str,
     listen_port: int,
-    vm_ip: str,
+    registry: VmRegistry,
     vm_port: int,
-    run_dir: Path,
+    index: FrameIndexWriter | None = None,
 ):
     """
-    Lightweight TCP bridge: Pi -> (host:listen_port) -> VM:vm_port.
-    Forwards one newline-terminated JSON line and returns the VM's reply (if any).
-    Logs each forwarded command into runs/screens/<run_id>/events.log.
+    Lightweight TCP bridge: Pi -> (host:listen_port) -> VM:vm_port (see vm_ctl_bridge.py).
+    Forwards newline-terminated JSON lines over pooled persistent connections and
+    returns the VM's reply for each. A command's "vm" field picks the VM (default VM
+    if absent); its address is whatever the registry last saw it connect from.
+    Logs each forwarded command into that VM's runs/screens/<run_id>/events.jsonl
+    and, if given, the frame index.
     """
 
-    def handle_client(conn: socket.socket, vm_ip=vm_ip, vm_port=vm_port, run_dir=run_dir):
-        with conn:
-            try:
-                data = b""
-                # Read until newline or 4 KiB
-                while b"\n" not in data and len(data) < 4096:
-                    chunk = conn.recv(4096)
-                    if not chunk:
-                        break
-                    data += chunk
-                if not data:
-                    return
+    def resolve(vm_id):
+        ip = registry.ctl_ip(vm_id or DEFAULT_VM_ID)
+        return (ip, vm_port) if ip else None
 
-                # Log what we got from the Pi
-                try:
-                    obj = json.loads(data.decode("utf-8").strip())
-                    host_log(run_dir, f"vm_ctl forward {obj}")
-                except Exception:
-                    host_log(run_dir, f"vm_ctl forward raw={data[:80]!r}")
-
-                # Forward to VM control port
-                with socket.create_connection((vm_ip, vm_port), timeout=2.0) as upstream:
-                    upstream.sendall(data)
-                    # Try to read a small reply (e.g., "ok\n"); it's fine if there's none
-                    upstream.settimeout(2.0)
-                    try:
-                        reply = upstream.recv(1024)
-                    except socket.timeout:
-                        reply = b""
-                # Send reply back to Pi
-                conn.sendall(reply)
-            except Exception as e:
-                try:
-                    conn.sendall(f"error: {e}\n".encode())
-                except Exception:
-                    pass
+    def on_forward(vm_id, cmd, reply, rtt_ms):
+        vm_label = vm_id or DEFAULT_VM_ID
+        VM_CTL_SECONDS.observe(rtt_ms / 1000.0, vm=vm_label)
+        VM_CTL_FORWARDS.inc(vm=vm_label, result="error" if reply.startswith("error") else "ok")
+        vm = registry.find(vm_label)
+        if vm is None:
+            print(f"[HOST] vm_ctl {cmd} for vm={vm_label} (no run yet) -> {reply!r}")
+            return
+        host_log(vm.run_dir, "vm_ctl_forward",
+                 echo=f"vm_ctl forward vm={vm.vm_id} {cmd} -> {reply!r} ({rtt_ms:.1f} ms)",
+                 cmd=cmd, reply=reply, latency_ms=round(rtt_ms, 3))
+        if index is not None:
+            index.add_event(vm.run_id, vm.vm_id, "vm_ctl_forward",
+                            cmd=cmd.get("cmd") if isinstance(cmd, dict) else str(cmd),
+                            detail={"reply": reply, "latency_ms": round(rtt_ms, 3)})
 
-    def server(run_dir=run_dir):
-        addr = (listen_host, listen_port)
-        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        srv.bind(addr)
-        srv.listen(5)
-        print(f"[HOST] VM_CTL bridge listening on {listen_host}:{listen_port} -> {vm_ip}:{vm_port}")
-        while True:
-            conn, _peer = srv.accept()
-            threading.Thread(target=handle_client, args=(conn,), daemon=True).start()
-
-    threading.Thread(target=server, daemon=True).start()
+    bridge = VmCtlBridge(listen_host, listen_port, resolve, on_forward=on_forward)
+    bridge.start()
+    return bridge
 
 
 # ---- screenshot server helpers ----------------------------------------------
-def recv_all(conn, n):
-    buf = b""
-    while len(buf) < n:
-        chunk = conn.recv(n - len(buf))
-        if not chunk:
+async def recv_all(loop, conn, n, timeout=READ_TIMEOUT_SEC) -> bytearray:
+    """Read exactly n bytes into one preallocated buffer via recv_into (no re-copying)."""
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        k = await asyncio.wait_for(loop.sock_recv_into(conn, view[got:]), timeout)
+        if k == 0:
             raise ConnectionError("client disconnected while reading")
-        buf += chunk
+        got += k
     return buf
 
-def ensure_run_folder():
-    ROOT.mkdir(parents=True, exist_ok=True)
-    cur = ROOT / "current_run.txt"
-    if cur.exists():
-        run_id = cur.read_text().strip()
-        d = ROOT / run_id
-        if d.exists():
-            return run_id, d
-    # else create a new one
-    run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
-    d = ROOT / run_id
-    d.mkdir(parents=True, exist_ok=True)
-    cur.write_text(run_id)
-    return run_id, d
-
-def save_and_update(run_dir: Path, msg: Screenshot, meta: dict | None = None):
-    ts_str = datetime.now().strftime("%Y%m%d_%H%M%S")
+async def discard(loop, conn, n, timeout=READ_TIMEOUT_SEC):
+    """Read and throw away n bytes (keeps a session framed without buffering a rejected frame)."""
+    scratch = bytearray(min(n, 64 * 1024))
+    view = memoryview(scratch)
+    while n > 0:
+        k = await asyncio.wait_for(loop.sock_recv_into(conn, view[:min(n, len(scratch))]), timeout)
+        if k == 0:
+            raise ConnectionError("client disconnected while reading")
+        n -= k
+
+def parse_meta(msg: Screenshot) -> tuple[dict, bool]:
+    """
+    Safely parse ui_json -> (meta, has_graph); meta is an empty dict if absent or
+    malformed, has_graph tells whether the sender attached a non-empty UI graph.
+    """
+    try:
+        if getattr(msg, "ui_json", None) and len(msg.ui_json) > 0:
+            payload = json.loads(msg.ui_json.decode("utf-8"))
+            # Accept either the new envelope {"meta":{...}, "graph":{...}} or legacy flat
+            if "meta" in payload or "graph" in payload:
+                return payload.get("meta") or {}, bool(payload.get("graph"))
+            if "vm_event" in payload:
+                return payload, False
+            return {}, bool(payload)   # bare graph (vm_send_screenshot.py)
+    except Exception:
+        pass
+    return {}, False
+
+def save_and_update(store: RunStore, frame: tuple, meta: dict | None = None) -> dict:
+    """
+    Writer-stage half of saving a frame: blobs + frame record, no fsync.
+    frame is (Screenshot, image) where image may be a memoryview into the receive
+    buffer. The DiskWriter syncs the batch and then publishes latest.json atomically.
+    """
+    msg, image = frame
     ms_timestamp = msg.timestamp if msg.timestamp else int(time.time() * 1000)
+    ui_json = msg.ui_json if getattr(msg, "ui_json", None) and len(msg.ui_json) > 0 else None
+
+    # Blobs are content-addressed: a repeated screen only adds a frame record
+    return store.add_frame(image, ui_json, ms_timestamp, meta)
+
+class FrameCtx(NamedTuple):
+    """What travels with a frame from ingest to durable (and on to previews)."""
+    vm: object               # vm_registry.VmState
+    addr: tuple
+    nbytes: int              # bytes reserved against the admission budgets
+    t_recv: float
+    image: object            # image bytes or a memoryview into the receive buffer
+    budget: ConnBudget
+    has_graph: bool          # the sender attached a UI graph
+    trace: dict              # {"vm": {stage: ms}, "host": {stage: ms}} (frame_trace.py)
 
-    fname_img = f"shot_{ts_str}_{ms_timestamp % 1000:03d}.png"
-    out_img = run_dir / fname_img
-    out_img.write_bytes(msg.image_data)
-
-    ui_rel = None
-    if getattr(msg, "ui_json", None) and len(msg.ui_json) > 0:
-        fname_ui = f"shot_{ts_str}_{ms_timestamp % 1000:03d}.json"
-        out_ui = run_dir / fname_ui
-        out_ui.write_bytes(msg.ui_json)
-        ui_rel = fname_ui
-
-    latest = {
-        "latest_index": fname_img,
-        "image_path": fname_img,
-        "path": fname_img,
-        "ui_json_path": ui_rel
-    }
-    (run_dir / "latest.json").write_text(json.dumps(latest))
-
-    # Log exactly what we created, plus meta if any
+def log_saved(store: RunStore, rec: dict, meta: dict | None, ctx: FrameCtx):
+    """Called by the DiskWriter once rec is durable and latest.json points at it."""
     ev = meta or {}
+    vm, addr, nbytes, t_recv = ctx.vm, ctx.addr, ctx.nbytes, ctx.t_recv
+    vm.count_saved(nbytes, rec["dedup"])
+    latency_ms = (time.monotonic() - t_recv) * 1000.0
+    SAVE_SECONDS.observe(latency_ms / 1000.0)
+    FRAMES_SAVED.inc(vm=vm.vm_id)
+    if rec["dedup"]:
+        FRAMES_DEDUP.inc(vm=vm.vm_id)
     host_log(
-        run_dir,
-        f"created image={fname_img}"
-        + (f" ui_json={ui_rel}" if ui_rel else "")
-        + (f" vm_event={ev.get('vm_event')} hash={ev.get('hash')}" if ev else "")
+        store.run_dir,
+        "frame_saved",
+        echo=f"saved vm={vm.vm_id} frame={rec['index']} {nbytes} bytes from {addr}"
+             + (" (dedup)" if rec["dedup"] else "") + f" in {latency_ms:.1f} ms",
+        frame=rec["index"],
+        image=rec["image"],
+        image_bytes=rec["image_bytes"],
+        dedup=rec["dedup"],
+        ui_json=rec["ui_json"],
+        vm_event=ev.get("vm_event"),
+        hash=ev.get("hash"),
+        latency_ms=round(latency_ms, 3),
+        vm_id=vm.vm_id,
+        peer=f"{addr[0]}:{addr[1]}",
     )
 
 
-# ---- main --------------------------------------------------------------------
-def main():
-    run_id, run_dir = ensure_run_folder()
-    start_vm_ctl_bridge(BRIDGE_LISTEN_HOST, BRIDGE_LISTEN_PORT, VM_IP, VM_CTRL_PORT, run_dir)
-    print(f"[HOST] Screenshot server listening on {HOST}:{PORT}")
-    print(f"[HOST] Current run: {run_id}  -> {run_dir}")
+# ---- async ingest ------------------------------------------------------------
+class IngestServer:
+    """
+    Accepts screenshot connections on an asyncio loop and reads them concurrently.
+    Parsed frames wait in a per-VM FairQueue (VM_QUEUE_MAX each); one dispatcher
+    moves them round-robin onto the write-behind DiskWriter, so a VM that floods
+    the server only ever waits on its own backlog (the accept loop never waits).
+    Before a frame's payload is read, its size is reserved against the per-connection
+    and global byte budgets; the reservation is returned once the frame is durable.
+    """
+
+    def __init__(self, registry: VmRegistry, host: str, port: int, index: FrameIndexWriter | None = None,
+                 bridge: VmCtlBridge | None = None):
+        self.registry = registry
+        self.bridge = bridge
+        self.host = host
+        self.port = port
+        self.notifier = FramePublisher(registry.root / NOTIFY_SOCKET)
+        self.previews = PreviewBuilder(self.on_previews)
+        self.perception = PerceptionPool(self.on_graph)
+        self.writer = DiskWriter(save_and_update, self.on_durable, max_queue=DISK_QUEUE_MAX,
+                                 on_failed=self.on_failed)
+        self.fair = FairQueue(VM_QUEUE_MAX)
+        self.admission = Admission()
+        self.index = index
+        self.tasks = set()
+        metrics.gauge("auroch_writer_queue_depth", "Frames waiting for the disk writer", fn=self.writer.qsize)
+        metrics.gauge("auroch_fair_queue_depth", "Frames waiting in the per-VM queues", fn=self.fair.depth)
+        metrics.gauge("auroch_inflight_bytes", "Frame bytes reserved between read and durable",
+                      fn=lambda: self.admission.inflight)
+        metrics.gauge("auroch_sessions_open", "Open sender sessions",
+                      fn=lambda: sum(vm.sessions for vm in registry.all()))
+        metrics.gauge("auroch_notify_subscribers", "Connected new-frame subscribers", fn=self.notifier.subscribers)
+        metrics.gauge("auroch_preview_queue_depth", "Frames waiting for previews", fn=self.previews.depth)
+        metrics.gauge("auroch_perception_queue_depth", "Frames waiting for a host-built UI graph",
+                      fn=self.perception.depth)
+
+    def spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def on_durable(self, store: RunStore, rec: dict, meta: dict | None, ctx: FrameCtx):
+        """Writer thread: rec is on disk and latest.json points at it."""
+        ctx.trace["host"]["saved"] = frame_trace.stamp()
+        self.admission.release_threadsafe(ctx.budget, ctx.nbytes)
+        log_saved(store, rec, meta, ctx)
+        if self.index is not None:
+            ev = meta or {}
+            self.index.add_frame(run_id=ctx.vm.run_id, idx=rec["index"], vm_id=ctx.vm.vm_id,
+                                 ts_ms=rec["ts_ms"], received_ms=int(ctx.trace["host"]["recv"]),
+                                 image=rec["image"], image_bytes=rec["image_bytes"], dedup=rec["dedup"],
+                                 ui_json=rec["ui_json"], has_graph=ctx.has_graph,
+                                 vm_event=ev.get("vm_event"), dhash=ev.get("hash"))
+        # Announce the frame now; previews and a host-built graph follow as their own events
+        vm = ctx.vm
+        self.notifier.publish(vm.vm_id, run_id=vm.run_id, index=rec["index"], image=rec["image"],
+                              ui_json=rec["ui_json"], ts_ms=rec["ts_ms"])
+        ctx.trace["host"]["notify"] = frame_trace.stamp()
+        event_log_for(store.run_dir, frame_trace.TRACE_FILE).emit(
+            "trace", index=rec["index"], vm_id=vm.vm_id, clock_offset_ms=vm.clock_offset_ms, **ctx.trace)
+        self.previews.submit(store, rec, ctx.image, ctx)
+        if not ctx.has_graph:
+            self.perception.submit(store, rec, ctx.image, ctx)
+
+    def on_failed(self, store: RunStore, meta: dict | None, ctx: FrameCtx):
+        self.admission.release_threadsafe(ctx.budget, ctx.nbytes)
 
-    with socket.socket() as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((HOST, PORT))
-        s.listen(5)
+    def on_previews(self, store: RunStore, rec: dict, previews: dict, ctx: FrameCtx):
+        """Preview thread: rec's previews are stored; tell subscribers."""
+        if previews:
+            vm = ctx.vm
+            self.notifier.publish(vm.vm_id, kind="previews", run_id=vm.run_id, index=rec["index"],
+                                  image=rec["image"], previews=previews)
 
+    def on_graph(self, store: RunStore, rec: dict, digest: str, ctx: FrameCtx):
+        """Perception callback: the host built rec's UI graph; index it and tell subscribers."""
+        vm = ctx.vm
+        if self.index is not None:
+            self.index.update_frame(vm.run_id, rec["index"], has_graph=True)
+        self.notifier.publish(vm.vm_id, kind="graph", run_id=vm.run_id, index=rec["index"],
+                              image=rec["image"], graph=digest)
+        event_log_for(store.run_dir, frame_trace.TRACE_FILE).emit(
+            "trace", index=rec["index"], host={"graph": frame_trace.stamp()})
+
+    async def serve_forever(self):
+        loop = asyncio.get_running_loop()
+        self.spawn(self.dispatch())
+        self.spawn(self.publish_status())
+        self.spawn(self.apply_retention())
+        self.spawn(self.sync_clocks())
+        srv = socket.socket()
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        srv.bind((self.host, self.port))
+        srv.listen(128)
+        srv.setblocking(False)
+        with srv:
+            while True:
+                conn, addr = await loop.sock_accept(srv)
+                self.spawn(self.handle_client(conn, addr))
+
+    async def handle_client(self, conn: socket.socket, addr):
+        loop = asyncio.get_running_loop()
+        with conn:
+            conn.setblocking(False)
+            try:
+                head = await recv_all(loop, conn, 4)
+                if head == frame_stream.MAGIC:
+                    await self.handle_session(conn, addr)
+                    return
+                # Legacy sender: one length-prefixed Screenshot, then close
+                length = int.from_bytes(head, "big")
+                if length > MAX_MESSAGE_BYTES:
+                    print(f"[HOST] rejecting {length}-byte message from {addr} (max {MAX_MESSAGE_BYTES})")
+                    REJECTED.inc(reason="oversize")
+                    return
+                budget = ConnBudget()
+                admitted, _ = await self.admission.acquire(budget, length, self.make_room)
+                if not admitted:
+                    print(f"[HOST] over budget; rejecting {length}-byte message from {addr}")
+                    REJECTED.inc(reason="over_budget")
+                    return
+                try:
+                    data = await recv_all(loop, conn, length)
+                except BaseException:
+                    self.admission.release(budget, length)
+                    raise
+            except asyncio.TimeoutError:
+                print(f"[HOST] read timeout from {addr}; dropping connection")
+                REJECTED.inc(reason="timeout")
+                return
+            except Exception as e:
+                print(f"[HOST] error handling client {addr}: {e}")
+                return
+        # A VM's first frame opens its RunStore (directory scan, maybe a legacy conversion)
+        vm = await loop.run_in_executor(None, self.registry.get, DEFAULT_VM_ID, addr[0])
+        await self.ingest(vm, data, addr, budget)
+
+    async def handle_session(self, conn: socket.socket, addr):
+        """Persistent session: handshake, then FRAME/HEARTBEAT records until BYE or EOF."""
+        loop = asyncio.get_running_loop()
+        n = int.from_bytes(await recv_all(loop, conn, 4), "big")
+        if n > frame_stream.HELLO_MAX:
+            raise ConnectionError(f"oversized hello ({n} bytes)")
+        hello = json.loads((await recv_all(loop, conn, n)).decode("utf-8"))
+        vm = await loop.run_in_executor(
+            None, self.registry.get, self.registry.session_vm_id(hello.get("vm_id"), addr[0]), addr[0])
+        vm_id = vm.vm_id
+        vm.sessions += 1
+        await loop.sock_sendall(conn, frame_stream.encode_hello(
+            {"v": frame_stream.PROTOCOL_VERSION, "ok": True, "heartbeat_sec": frame_stream.HEARTBEAT_SEC,
+             "codecs": image_codecs.available()}
+        ))
+        print(f"[HOST] session open vm={vm_id} from {addr}")
+
+        header = frame_stream.RECORD_HEADER
+        frame_kinds = (frame_stream.KIND_FRAME, frame_stream.KIND_FRAME_SPLIT)
+        budget = ConnBudget()
+        decoder = DeltaDecoder()
+        last_slow_down = 0.0
+        try:
+            while True:
+                kind, length = header.unpack(
+                    await recv_all(loop, conn, header.size, timeout=frame_stream.IDLE_TIMEOUT_SEC)
+                )
+                limit = MAX_MESSAGE_BYTES if kind in frame_kinds else frame_stream.HELLO_MAX
+                if length > limit:
+                    print(f"[HOST] {length}-byte record from vm={vm_id} exceeds {limit}; closing session")
+                    REJECTED.inc(reason="oversize")
+                    break
+                if kind in frame_kinds:
+                    admitted, pressure = await self.admission.acquire(budget, length, self.make_room)
+                    now = time.monotonic()
+                    if pressure and now - last_slow_down >= frame_stream.SLOW_DOWN_MS / 1000.0:
+                        last_slow_down = now
+                        try:
+                            await loop.sock_sendall(conn, frame_stream.encode_record(
+                                frame_stream.KIND_SLOW_DOWN, json.dumps({"delay_ms": frame_stream.SLOW_DOWN_MS}).encode()
+                            ))
+                            SLOW_DOWNS.inc(vm=vm_id)
+                        except OSError:
+                            pass   # sender already closed its side; keep reading what it sent
+                    if not admitted:
+                        print(f"[HOST] over budget; discarding {length}-byte frame from vm={vm_id}")
+                        REJECTED.inc(reason="over_budget")
+                        await discard(loop, conn, length)
+                        decoder.lost()
+                    else:
+                        try:
+                            payload = await recv_all(loop, conn, length)
+                        except BaseException:
+                            self.admission.release(budget, length)
+                            raise
+                        await self.ingest(vm, payload, addr, budget, split=kind == frame_stream.KIND_FRAME_SPLIT,
+                                          decoder=decoder)
+                    if decoder.want_keyframe:
+                        decoder.want_keyframe = False
+                        try:
+                            await loop.sock_sendall(conn, frame_stream.encode_record(frame_stream.KIND_KEYFRAME_REQUEST))
+                        except OSError:
+                            pass
+                    continue
+                if length:
+                    await recv_all(loop, conn, length)   # no payload is defined for the rest
+                if kind == frame_stream.KIND_HEARTBEAT:
+                    continue
+                elif kind == frame_stream.KIND_BYE:
+                    break
+                else:
+                    print(f"[HOST] unknown record kind {kind} from vm={vm_id}; closing session")
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            vm.sessions -= 1
+        print(f"[HOST] session closed vm={vm_id} from {addr}")
+
+    async def ingest(self, vm, data: bytearray, addr, budget: ConnBudget, split: bool = False,
+                     decoder: DeltaDecoder | None = None):
+        """
+        Parse a frame whose len(data) bytes are reserved on budget, and queue it.
+        Delta frames are rebuilt with the session's decoder first; images in a codec
+        outside STORED_CODECS are transcoded.
+        """
+        t0 = time.monotonic()
+        recv_ms = frame_trace.stamp()
+        try:
+            msg = Screenshot()
+            if split:
+                # Only the small header is parsed; the image stays a view into `data`
+                header, image = frame_stream.split_frame(data)
+                msg.ParseFromString(header)
+            else:
+                msg.ParseFromString(data)
+                image = msg.image_data
+        except Exception as e:
+            print(f"[HOST] bad Screenshot from {addr}: {e}")
+            REJECTED.inc(reason="malformed")
+            self.admission.release(budget, len(data))
+            return
+        PARSE_SECONDS.observe(time.monotonic() - t0)
+        FRAMES_RECEIVED.inc(vm=vm.vm_id)
+        BYTES_RECEIVED.inc(len(data), vm=vm.vm_id)
+        loop = asyncio.get_running_loop()
+        codec = image_codecs.normalize(msg.codec)
+        if msg.kind == Screenshot.DELTA:
+            if decoder is None:
+                print(f"[HOST] delta frame from {addr} outside a session; dropping it")
+                REJECTED.inc(reason="malformed")
+                self.admission.release(budget, len(data))
+                return
+            t0 = time.monotonic()
+            try:
+                image = await loop.run_in_executor(None, decoder.apply, msg)
+            except DeltaError as e:
+                print(f"[HOST] vm={vm.vm_id}: {e}; asking for a keyframe")
+                DELTA_FRAMES.inc(vm=vm.vm_id, result="rejected")
+                REJECTED.inc(reason="delta_base")
+                self.admission.release(budget, len(data))
+                return
+            DELTA_SECONDS.observe(time.monotonic() - t0)
+            DELTA_FRAMES.inc(vm=vm.vm_id, result="applied")
+            codec = image_codecs.PNG
+        elif decoder is not None and msg.seq:
+            decoder.keyframe(msg.seq, image, codec)
+        if codec not in STORED_CODECS:
+            t0 = time.monotonic()
+            try:
+                image = await loop.run_in_executor(None, image_codecs.transcode, codec, image, TRANSCODE_TO)
+            except Exception as e:
+                print(f"[HOST] cannot transcode {codec} frame from vm={vm.vm_id}: {e}")
+                REJECTED.inc(reason="codec")
+                self.admission.release(budget, len(data))
+                return
+            TRANSCODE_SECONDS.observe(time.monotonic() - t0, codec=codec)
+            codec = TRANSCODE_TO
+        meta, has_graph = parse_meta(msg)
+        meta["codec"] = codec
+        trace = {"vm": meta.pop("trace", None) or {}, "host": {"recv": recv_ms}}
+        ctx = FrameCtx(vm, addr, len(data), time.monotonic(), image, budget, has_graph, trace)
+        await self.fair.put(vm.vm_id, (vm.store, (msg, image), meta, ctx))
+
+    async def make_room(self, need: int):
+        """Drop the oldest queued frames (longest VM backlog first) until need bytes are freed."""
+        freed = 0
+        while freed < need:
+            dropped = await self.fair.drop_oldest()
+            if dropped is None:
+                return           # everything left is already with the disk writer
+            vm_id, (_store, _frame, meta, ctx) = dropped
+            self.admission.release(ctx.budget, ctx.nbytes)
+            freed += ctx.nbytes
+            DROPPED.inc(vm=vm_id)
+            host_log(ctx.vm.run_dir, "frame_dropped", echo=f"over budget; dropped queued frame from vm={vm_id}",
+                     vm_id=vm_id, bytes=ctx.nbytes, vm_event=(meta or {}).get("vm_event"), reason="over_budget")
+
+    async def dispatch(self):
+        """Move frames from the per-VM queues to the DiskWriter, one VM at a time."""
+        loop = asyncio.get_running_loop()
         while True:
-            conn, addr = s.accept()
-            with conn:
+            _vm_id, (store, frame, meta, ctx) = await self.fair.get()
+            if self.writer.try_submit(store, frame, meta, ctx):
+                continue
+            # Writer is behind: wait for room off-loop so reads keep flowing
+            await loop.run_in_executor(None, self.writer.submit, store, frame, meta, ctx)
+
+    async def publish_status(self):
+        """Rewrite runs/screens/vms.json every STATUS_INTERVAL_SEC."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(STATUS_INTERVAL_SEC)
+            try:
+                await loop.run_in_executor(None, self.registry.write_status)
+            except Exception as e:
+                print(f"[HOST] warn: could not write vm status: {e}")
+
+
+    async def sync_clocks(self):
+        """Estimate every VM's clock offset over its control port (for frame traces)."""
+        loop = asyncio.get_running_loop()
+        line = json.dumps({"cmd": "clock"}).encode() + b"\n"
+        while True:
+            for vm in self.registry.all():
+                ip = self.registry.ctl_ip(vm.vm_id)
+                if self.bridge is None or not ip:
+                    continue
+                pool = self.bridge.pool_for((ip, VM_CTRL_PORT))
                 try:
-                    length = int.from_bytes(recv_all(conn, 4), "big")
-                    data = recv_all(conn, length)
-                    msg = Screenshot()
-                    msg.ParseFromString(data)
-
-                    # Safely parse ui_json -> meta (if provided)
-                    meta = {}
-                    try:
-                        if getattr(msg, "ui_json", None) and len(msg.ui_json) > 0:
-                            payload = json.loads(msg.ui_json.decode("utf-8"))
-                            # Accept either the new envelope {"meta":{...}} or legacy flat
-                            meta = payload.get("meta", payload if "vm_event" in payload else {})
-                    except Exception:
-                        meta = {}
-
-                    save_and_update(run_dir, msg, meta)
-                    print(f"[HOST] saved {len(data)} bytes from {addr}")
-                except Exception as e:
-                    print(f"[HOST] error handling client {addr}: {e}")
+                    est = await loop.run_in_executor(
+                        None, frame_trace.estimate_offset, lambda pool=pool: pool.request([line])[0])
+                except Exception:
+                    continue     # VM not reachable right now
+                if est is not None:
+                    vm.clock_offset_ms, vm.clock_rtt_ms = est
+            await asyncio.sleep(frame_trace.CLOCK_SYNC_INTERVAL_SEC)
+
+    async def apply_retention(self):
+        """Apply RETENTION_POLICY every RETENTION_INTERVAL_SEC (current runs are never touched)."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, lambda: retention.apply(self.registry.root, RETENTION_POLICY,
+                                                                         index=self.index))
+            except Exception as e:
+                print(f"[HOST] warn: retention pass failed: {e}")
+            await asyncio.sleep(RETENTION_INTERVAL_SEC)
+
+
+# ---- main --------------------------------------------------------------------
+def main():
+    registry = VmRegistry(ROOT, default_ip=VM_IP)
+    index = FrameIndexWriter(ROOT / INDEX_FILE)
+    metrics.serve(METRICS_HOST, METRICS_PORT)
+    bridge = start_vm_ctl_bridge(BRIDGE_LISTEN_HOST, BRIDGE_LISTEN_PORT, registry, VM_CTRL_PORT, index=index)
+    print(f"[HOST] Screenshot server listening on {HOST}:{PORT}")
+    print(f"[HOST] Runs are created per VM under {ROOT}")
+
+    try:
+        asyncio.run(IngestServer(registry, HOST, PORT, index=index, bridge=bridge).serve_forever())
+    except KeyboardInterrupt:
+        pass
 
 if __name__ == "__main__":
     main()
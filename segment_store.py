@@ -0,0 +1,230 @@
+# segment_store.py — append-only segment files for run frame storage.
+#
+# Layout of runs/screens/<run_id>/segments/:
+#   seg_00000.dat ...  blob records appended back to back (rolls over at SEGMENT_MAX_BYTES)
+#   blobs.idx          fixed-size entries: digest -> (segment, offset, length)
+#   frames.idx         fixed-size entries: frame N -> (ts_ms, image ref, ui_json ref)
+#
+# Blobs are content-addressed (SHA-256), so a repeated screen is stored once and
+# several frames.idx entries point at the same bytes. Nothing is ever rewritten in
+# place; a crash can only leave torn tails. On open the writer keeps the longest prefix
+# of blobs.idx whose data is on disk and of frames.idx whose blobs are, and truncates
+# every segment to the end of its last kept blob, so new appends never land after a
+# partial record.
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from pathlib import Path
+from typing import NamedTuple
+
+SEGMENT_DIR = "segments"
+SEGMENT_MAX_BYTES = 256 * 1024 * 1024
+SEG_MAGIC = b"AUSEG001"                       # 8-byte segment file header
+
+BLOB_HEADER = struct.Struct("<32sI")          # digest, length (precedes data in a segment)
+BLOB_ENTRY = struct.Struct("<32sIQI")         # digest, segment, data offset, length
+FRAME_ENTRY = struct.Struct("<qIQIIQI")       # ts_ms, img seg/off/len, ui seg/off/len
+
+BLOBS_IDX = "blobs.idx"
+FRAMES_IDX = "frames.idx"
+
+
+class BlobRef(NamedTuple):
+    segment: int
+    offset: int
+    length: int
+
+
+NO_BLOB = BlobRef(0, 0, 0)
+
+
+def seg_name(n: int) -> str:
+    return f"seg_{n:05d}.dat"
+
+
+def parse_entries(data: bytes, entry: struct.Struct) -> list[tuple]:
+    usable = len(data) - len(data) % entry.size   # ignore a torn trailing entry
+    return [entry.unpack_from(data, off) for off in range(0, usable, entry.size)]
+
+
+def _read_entries(path: Path, entry: struct.Struct) -> list[tuple]:
+    if not path.exists():
+        return []
+    return parse_entries(path.read_bytes(), entry)
+
+
+class SegmentWriter:
+    """Appends blobs and frame entries for one run. Not shared across processes."""
+
+    def __init__(self, seg_dir: Path, max_bytes: int = SEGMENT_MAX_BYTES):
+        self.dir = Path(seg_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._dirty = set()
+
+        self.refs = {}
+        self._frames = self._recover()
+
+        segs = sorted(int(p.stem.split("_")[1]) for p in self.dir.glob("seg_*.dat"))
+        self._seg_no = segs[-1] if segs else 0
+        self._seg = None
+        self._open_segment(self._seg_no)
+        self._blobs_idx = open(self.dir / BLOBS_IDX, "ab")
+        self._frames_idx = open(self.dir / FRAMES_IDX, "ab")
+
+    def _recover(self) -> int:
+        """Drop torn tails of the indexes and segments (see the module header); returns frames kept."""
+        seg_sizes = {int(p.stem.split("_")[1]): p.stat().st_size for p in self.dir.glob("seg_*.dat")}
+        ends = {}                # segment -> end of its last blob kept
+        kept = 0
+        for digest, seg, off, length in _read_entries(self.dir / BLOBS_IDX, BLOB_ENTRY):
+            if off + length > seg_sizes.get(seg, 0):
+                break            # data never landed; nothing after it can be trusted
+            self.refs[digest] = BlobRef(seg, off, length)
+            ends[seg] = max(ends.get(seg, 0), off + length)
+            kept += 1
+        self._truncate(self.dir / BLOBS_IDX, kept * BLOB_ENTRY.size)
+
+        def landed(seg, off, length):
+            return not length or off + length <= ends.get(seg, 0)
+
+        frames = 0
+        for ts_ms, iseg, ioff, ilen, useg, uoff, ulen in _read_entries(self.dir / FRAMES_IDX, FRAME_ENTRY):
+            if not (landed(iseg, ioff, ilen) and landed(useg, uoff, ulen)):
+                break
+            frames += 1
+        self._truncate(self.dir / FRAMES_IDX, frames * FRAME_ENTRY.size)
+
+        for seg, size in seg_sizes.items():
+            end = ends.get(seg, len(SEG_MAGIC) if size >= len(SEG_MAGIC) else 0)
+            self._truncate(self.dir / seg_name(seg), end)
+        return frames
+
+    @staticmethod
+    def _truncate(path: Path, size: int):
+        if path.exists() and path.stat().st_size > size:
+            os.truncate(path, size)
+
+    def _open_segment(self, n: int):
+        if self._seg is not None:
+            self._seg.close()
+        path = self.dir / seg_name(n)
+        self._seg = open(path, "ab")
+        if self._seg.tell() == 0:
+            self._seg.write(SEG_MAGIC)
+        self._seg_no = n
+
+    def frame_count(self) -> int:
+        return self._frames
+
+    def put(self, data) -> tuple[bytes, BlobRef, bool]:
+        """Append data unless its digest is already stored. Returns (digest, ref, is_new)."""
+        digest = hashlib.sha256(data).digest()
+        with self._lock:
+            ref = self.refs.get(digest)
+            if ref is not None:
+                return digest, ref, False
+            if self._seg.tell() + BLOB_HEADER.size + len(data) > self.max_bytes and self._seg.tell() > len(SEG_MAGIC):
+                self._seg.flush()
+                self._dirty.add(self._seg.name)
+                self._open_segment(self._seg_no + 1)
+            self._seg.write(BLOB_HEADER.pack(digest, len(data)))
+            ref = BlobRef(self._seg_no, self._seg.tell(), len(data))
+            self._seg.write(data)
+            self._blobs_idx.write(BLOB_ENTRY.pack(digest, *ref))
+            self.refs[digest] = ref
+            self._dirty.add(self._seg.name)
+            return digest, ref, True
+
+    def append_frame(self, ts_ms: int, image: BlobRef, ui_json: BlobRef = NO_BLOB) -> int:
+        with self._lock:
+            self._frames_idx.write(FRAME_ENTRY.pack(ts_ms, *image, *ui_json))
+            index = self._frames
+            self._frames += 1
+            return index
+
+    def flush(self):
+        """Make appended data visible to readers (no fsync; the next sync() covers it)."""
+        with self._lock:
+            for f in (self._seg, self._blobs_idx, self._frames_idx):
+                f.flush()
+
+    def sync(self):
+        """Flush and fsync segments before the indexes that point into them."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            self._seg.flush()
+            for name in dirty:
+                fd = os.open(name, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            for f in (self._blobs_idx, self._frames_idx):
+                f.flush()
+                os.fsync(f.fileno())
+
+    def close(self):
+        with self._lock:
+            for f in (self._seg, self._blobs_idx, self._frames_idx):
+                f.close()
+
+
+class SegmentReader:
+    """Random access to frames by index via mmap; picks up entries appended later."""
+
+    def __init__(self, seg_dir: Path):
+        self.dir = Path(seg_dir)
+        self._maps = {}       # segment -> (file, mmap)
+        self._frames = []
+        self._refs = None
+
+    def _refresh_frames(self):
+        self._frames = _read_entries(self.dir / FRAMES_IDX, FRAME_ENTRY)
+
+    def frame_count(self) -> int:
+        self._refresh_frames()
+        return len(self._frames)
+
+    def frame_entry(self, n: int) -> tuple[int, BlobRef, BlobRef | None]:
+        if n >= len(self._frames):
+            self._refresh_frames()
+        ts_ms, iseg, ioff, ilen, useg, uoff, ulen = self._frames[n]
+        ui = BlobRef(useg, uoff, ulen) if ulen else None
+        return ts_ms, BlobRef(iseg, ioff, ilen), ui
+
+    def _map(self, seg: int, need: int) -> mmap.mmap:
+        cur = self._maps.get(seg)
+        if cur is None or len(cur[1]) < need:     # segment grew since we mapped it
+            if cur is not None:
+                cur[1].close(); cur[0].close()
+            f = open(self.dir / seg_name(seg), "rb")
+            cur = (f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            self._maps[seg] = cur
+        return cur[1]
+
+    def read(self, ref: BlobRef) -> bytes:
+        m = self._map(ref.segment, ref.offset + ref.length)
+        return m[ref.offset:ref.offset + ref.length]
+
+    def image(self, n: int) -> bytes:
+        return self.read(self.frame_entry(n)[1])
+
+    def ui_json(self, n: int) -> bytes | None:
+        ui = self.frame_entry(n)[2]
+        return self.read(ui) if ui else None
+
+    def ref_for(self, hex_digest: str) -> BlobRef | None:
+        digest = bytes.fromhex(hex_digest)
+        if self._refs is None or digest not in self._refs:
+            self._refs = {d: BlobRef(s, o, l) for d, s, o, l in _read_entries(self.dir / BLOBS_IDX, BLOB_ENTRY)}
+        return self._refs.get(digest)
+
+    def close(self):
+        for f, m in self._maps.values():
+            m.close(); f.close()
+        self._maps = {}
@@ -0,0 +1,114 @@
+# tile_grid.py — per-tile change detection for the VM senders, with ignore masks.
+#
+# One global hash cannot tell a blinking caret or the top-bar clock from a real page
+# change. Here the screen is split into a cols x rows grid and each tile keeps a tiny
+# signature (TILE_CELLS x TILE_CELLS gray cell means, from one small gray thumbnail of
+# the frame, see Capture.gray()). A tile is dirty against a reference frame when any
+# cell moved by more than TILE_DIFF_LEVEL gray levels, except:
+#
+#   - cells under an ignore region (fractions (x0, y0, x1, y1) of the screen, so they
+#     hold at any resolution), e.g. the clock; the rest of their tile still counts
+#   - blinking tiles: ones that changed on BLINK_FLIPS of the last BLINK_WINDOW ticks
+#     (carets, spinners, a field being typed into) only count once more than half
+#     their cells differ, so a blink never does but a new page under it still does
+#
+# dirty() gives the dirty tiles, regions() merges them into pixel rectangles that the
+# sender puts in the frame meta ({"dirty": [[x, y, w, h], ...]}) for the host.
+
+from collections import deque
+
+import numpy as np
+from PIL import Image
+
+TILE_GRID = (16, 9)          # cols, rows; 120x120 px tiles at 1920x1080
+TILE_CELLS = 4
+TILE_DIFF_LEVEL = 6
+BLINK_WINDOW = 8             # ticks
+BLINK_FLIPS = 3
+
+
+class TileGrid:
+    def __init__(self, cols: int = TILE_GRID[0], rows: int = TILE_GRID[1], ignore=(),
+                 cells: int = TILE_CELLS, diff_level: int = TILE_DIFF_LEVEL,
+                 blink_window: int = BLINK_WINDOW, blink_flips: int = BLINK_FLIPS):
+        self.cols, self.rows, self.cells = cols, rows, cells
+        self.diff_level = diff_level
+        self.blink_flips = blink_flips
+        self.ignored_cells = self._mask(ignore)
+        self.ignored = self.ignored_cells.all(axis=(2, 3))   # tiles that can never be dirty
+        self._prev = None
+        self._flips = deque(maxlen=blink_window)   # per tick: tiles that changed since the tick before
+
+    def _mask(self, regions) -> np.ndarray:
+        """(rows, cols, cells, cells) cells overlapping any (x0, y0, x1, y1) fractional region."""
+        ny, nx = self.rows * self.cells, self.cols * self.cells
+        mask = np.zeros((ny, nx), dtype=bool)
+        xs = np.arange(nx + 1) / nx
+        ys = np.arange(ny + 1) / ny
+        for x0, y0, x1, y1 in regions:
+            mask |= (((ys[:-1] < y1) & (ys[1:] > y0))[:, None]) & (((xs[:-1] < x1) & (xs[1:] > x0))[None, :])
+        return mask.reshape(self.rows, self.cells, self.cols, self.cells).swapaxes(1, 2)
+
+    def signature(self, src) -> np.ndarray:
+        """(rows, cols, cells, cells) gray cell means of a Capture or PIL image."""
+        size = (self.cols * self.cells, self.rows * self.cells)
+        if hasattr(src, "gray"):
+            im = src.gray(size)
+        else:
+            im = src.convert("L").resize(size, Image.Resampling.BOX, reducing_gap=2.0)
+        a = np.asarray(im, dtype=np.int16)
+        return a.reshape(self.rows, self.cells, self.cols, self.cells).swapaxes(1, 2)
+
+    def _cells_changed(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """(rows, cols) count of cells that differ between two signatures (ignored cells never do)."""
+        return ((np.abs(a - b) > self.diff_level) & ~self.ignored_cells).sum(axis=(2, 3))
+
+    def observe(self, sig: np.ndarray):
+        """Feed every sampled frame, in order; drives blink detection."""
+        if self._prev is not None and self._prev.shape == sig.shape:
+            self._flips.append(self._cells_changed(sig, self._prev) > 0)
+        self._prev = sig
+
+    def blinking(self) -> np.ndarray:
+        if not self._flips:
+            return np.zeros((self.rows, self.cols), dtype=bool)
+        return np.sum(self._flips, axis=0) >= self.blink_flips
+
+    def dirty(self, sig: np.ndarray, ref: np.ndarray | None) -> np.ndarray:
+        """(rows, cols) tiles of sig that differ from ref; all of them without a ref."""
+        if ref is None or ref.shape != sig.shape:
+            return ~self.ignored
+        n = self._cells_changed(sig, ref)
+        major = n > (self.cells * self.cells) // 2
+        return ((n > 0) & ~self.blinking() | major) & ~self.ignored
+
+    def changed(self, sig: np.ndarray, ref: np.ndarray | None) -> bool:
+        return bool(self.dirty(sig, ref).any())
+
+    def regions(self, dirty: np.ndarray, size: tuple[int, int]) -> list[list[int]]:
+        """Dirty tiles as [x, y, w, h] pixel rectangles: runs per row, stacked where they line up."""
+        w, h = size
+        xs = [c * w // self.cols for c in range(self.cols + 1)]
+        ys = [r * h // self.rows for r in range(self.rows + 1)]
+        open_runs = {}               # (c0, c1) -> rect still growing downwards
+        out = []
+        for r in range(self.rows):
+            runs, c = [], 0
+            while c < self.cols:
+                if dirty[r, c]:
+                    c0 = c
+                    while c < self.cols and dirty[r, c]:
+                        c += 1
+                    runs.append((c0, c))
+                c += 1
+            grown = {}
+            for run in runs:
+                rect = open_runs.pop(run, None)
+                if rect is None:
+                    rect = [xs[run[0]], ys[r], xs[run[1]] - xs[run[0]], 0]
+                rect[3] = ys[r + 1] - rect[1]
+                grown[run] = rect
+            out += open_runs.values()    # runs that stopped at this row
+            open_runs = grown
+        out += open_runs.values()
+        return sorted(out, key=lambda rect: (rect[1], rect[0]))
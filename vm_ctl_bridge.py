@@ -0,0 +1,244 @@
+# vm_ctl_bridge.py — Pi -> (host) -> VM control bridge with pooled upstream connections.
+#
+# The Pi sends newline-terminated JSON commands ({"cmd": "mute"}, {"cmd": "unmute"}, ...)
+# to the host; the host forwards them to the VM's pngsend.py control port and relays
+# the VM's one-line reply ("ok\n"). Mute/unmute sit on the critical path of every act,
+# so instead of a fresh TCP connection per command we keep a few persistent,
+# health-checked connections per VM, serve clients from a bounded worker pool, and
+# pipeline all complete lines a client sends in one go over one upstream connection.
+#
+# With several VMs behind one host, a command may name its target: {"cmd": "mute",
+# "vm": "clone3"}. Commands without "vm" go to the default VM. The bridge asks a
+# resolver for the VM's current address and keeps one pool per address.
+
+import json
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+POOL_SIZE = 2                  # idle upstream connections kept per VM
+CONNECT_TIMEOUT_SEC = 2.0
+REPLY_TIMEOUT_SEC = 2.0
+HEALTH_CHECK_SEC = 10.0        # idle connections are pinged this often
+BRIDGE_WORKERS = 8             # concurrent Pi/client connections served
+CLIENT_IDLE_SEC = 30.0         # close client connections silent for this long
+MAX_LINE_BYTES = 4096
+
+PING = b'{"cmd": "ping"}\n'
+
+
+class LineConn:
+    """A socket plus a read buffer, for newline-delimited request/reply."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.buf = b""
+        self.last_used = time.monotonic()
+
+    def read_line(self) -> bytes:
+        while b"\n" not in self.buf:
+            if len(self.buf) > MAX_LINE_BYTES:
+                raise ConnectionError("line too long")
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("peer closed")
+            self.buf += chunk
+        line, _, self.buf = self.buf.partition(b"\n")
+        return line + b"\n"
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class UpstreamPool:
+    """Persistent connections to one VM control port."""
+
+    def __init__(self, vm_ip: str, vm_port: int, size: int = POOL_SIZE):
+        self.vm_ip = vm_ip
+        self.vm_port = vm_port
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+        threading.Thread(target=self._health_loop, daemon=True).start()
+
+    def _open(self) -> LineConn:
+        s = socket.create_connection((self.vm_ip, self.vm_port), timeout=CONNECT_TIMEOUT_SEC)
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        s.settimeout(REPLY_TIMEOUT_SEC)
+        return LineConn(s)
+
+    @staticmethod
+    def _alive(conn: LineConn) -> bool:
+        """False if an idle connection was closed by the VM (or holds stray bytes)."""
+        try:
+            conn.sock.setblocking(False)
+            try:
+                conn.sock.recv(1, socket.MSG_PEEK)   # b"" = closed; data = out of step
+                return False
+            except BlockingIOError:
+                return True
+            finally:
+                conn.sock.settimeout(REPLY_TIMEOUT_SEC)
+        except OSError:
+            return False
+
+    def _acquire(self) -> tuple[LineConn, bool]:
+        """(connection, reused?); idle connections the VM has closed are dropped here."""
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._open(), False
+            if self._alive(conn):
+                return conn, True
+            conn.close()
+
+    def _release(self, conn: LineConn):
+        conn.last_used = time.monotonic()
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, lines: list[bytes]) -> list[bytes]:
+        """
+        Send all lines in one write and read one reply line per command. Only a failed
+        write on a reused connection is retried on a fresh one: once the write went out
+        the VM may have run the commands, and running capture_now twice is worse than
+        reporting the error.
+        """
+        for attempt in range(2):
+            conn, reused = self._acquire()
+            try:
+                conn.sock.sendall(b"".join(lines))
+            except OSError:
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            try:
+                replies = [conn.read_line() for _ in lines]
+            except (OSError, ConnectionError):
+                conn.close()
+                raise
+            self._release(conn)
+            return replies
+        raise ConnectionError("unreachable")
+
+    def _health_loop(self):
+        while True:
+            time.sleep(HEALTH_CHECK_SEC / 2)
+            now = time.monotonic()
+            with self._lock:
+                stale = [c for c in self._idle if now - c.last_used >= HEALTH_CHECK_SEC]
+                self._idle = [c for c in self._idle if c not in stale]
+            for c in stale:
+                try:
+                    c.sock.sendall(PING)
+                    c.read_line()
+                    self._release(c)
+                except (OSError, ConnectionError):
+                    c.close()
+            # Keep at least one warm connection so the next mute doesn't pay for setup
+            with self._lock:
+                need = not self._idle
+            if need:
+                try:
+                    self._release(self._open())
+                except OSError:
+                    pass   # VM not up yet; try again next round
+
+
+class VmCtlBridge:
+    """
+    Listens for Pi clients and forwards their commands through per-VM UpstreamPools.
+    resolve(vm_id or None) -> (ip, port) or None picks the target of each command.
+    on_forward(vm_id, cmd_obj_or_raw, reply, rtt_ms) is called once per forwarded command.
+    """
+
+    def __init__(self, listen_host: str, listen_port: int, resolve,
+                 on_forward=None, workers: int = BRIDGE_WORKERS):
+        self.listen_host = listen_host
+        self.listen_port = listen_port
+        self.resolve = resolve
+        self.on_forward = on_forward
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vm-ctl")
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def pool_for(self, addr: tuple[str, int]) -> UpstreamPool:
+        with self._pools_lock:
+            pool = self._pools.get(addr)
+            if pool is None:
+                pool = self._pools[addr] = UpstreamPool(*addr)
+            return pool
+
+    def _serve(self):
+        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        srv.bind((self.listen_host, self.listen_port))
+        srv.listen(16)
+        print(f"[HOST] VM_CTL bridge listening on {self.listen_host}:{self.listen_port}")
+        while True:
+            conn, _peer = srv.accept()
+            self.executor.submit(self._handle_client, conn)
+
+    @staticmethod
+    def _parse(line: bytes):
+        try:
+            cmd = json.loads(line.decode("utf-8").strip())
+            return cmd, (cmd.get("vm") if isinstance(cmd, dict) else None)
+        except Exception:
+            return line[:80].decode("utf-8", errors="replace"), None
+
+    def _forward(self, vm_id, lines: list[bytes]) -> list[bytes]:
+        addr = self.resolve(vm_id)
+        if addr is None:
+            return [f"error: unknown vm {vm_id}\n".encode()] * len(lines)
+        try:
+            return self.pool_for(addr).request(lines)
+        except Exception as e:
+            return [f"error: {e}\n".encode()] * len(lines)
+
+    def _handle_client(self, sock: socket.socket):
+        sock.settimeout(CLIENT_IDLE_SEC)
+        client = LineConn(sock)
+        with sock:
+            while True:
+                try:
+                    lines = [client.read_line()]
+                    # Pipelining: take every complete line already buffered
+                    while b"\n" in client.buf:
+                        lines.append(client.read_line())
+                except (OSError, ConnectionError):
+                    return
+
+                # Consecutive commands for the same VM go upstream as one batch
+                parsed = [self._parse(line) for line in lines]
+                replies = []
+                i = 0
+                while i < len(lines):
+                    vm_id = parsed[i][1]
+                    j = i
+                    while j < len(lines) and parsed[j][1] == vm_id:
+                        j += 1
+                    t0 = time.monotonic()
+                    group = self._forward(vm_id, lines[i:j])
+                    rtt_ms = (time.monotonic() - t0) * 1000.0
+                    if self.on_forward:
+                        for (cmd, _vm), reply in zip(parsed[i:j], group):
+                            self.on_forward(vm_id, cmd, reply.decode("utf-8", errors="replace").strip(), rtt_ms)
+                    replies.extend(group)
+                    i = j
+                try:
+                    sock.sendall(b"".join(replies))
+                except OSError:
+                    return
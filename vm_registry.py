@@ -0,0 +1,144 @@
+# vm_registry.py — per-VM runs, control addresses and statistics for the host.
+#
+# One host process serves many VM clones. Each sender is identified by the vm_id in
+# its session hello, or by its address when it names none (clones of one golden image
+# share a hostname, not an IP); the configured default VM and legacy one-shot senders
+# map to DEFAULT_VM_ID. Each VM gets its own run directory, latest.json, control-bridge
+# target and counters:
+#
+#   runs/screens/current_run.txt        current run of DEFAULT_VM_ID (what the host UI reads)
+#   runs/screens/current/<vm_id>.txt    current run of every other VM
+#   runs/screens/<run_id>/              run_id = <timestamp> or <vm_id>_<timestamp>
+#   runs/screens/vms.json               periodic status snapshot of all known VMs
+
+import json
+import re
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from frame_store import RunStore, write_atomic
+
+DEFAULT_VM_ID = "default"
+STATUS_FILE = "vms.json"
+
+
+def safe_vm_id(raw) -> str:
+    """vm_id as a safe path component (hostnames mostly pass through unchanged)."""
+    vm_id = re.sub(r"[^A-Za-z0-9_.-]", "_", str(raw or "")).strip("._")
+    return vm_id[:64] or DEFAULT_VM_ID
+
+
+def current_run_file(root: Path, vm_id: str = DEFAULT_VM_ID) -> Path:
+    """The file naming vm_id's current run."""
+    if vm_id == DEFAULT_VM_ID:
+        return root / "current_run.txt"
+    return root / "current" / f"{vm_id}.txt"
+
+
+def ensure_run_folder(root: Path, vm_id: str = DEFAULT_VM_ID) -> tuple[str, Path]:
+    """Current (run_id, run_dir) for vm_id, creating a new run if there is none."""
+    root.mkdir(parents=True, exist_ok=True)
+    cur = current_run_file(root, vm_id)
+    cur.parent.mkdir(exist_ok=True)
+    if cur.exists():
+        run_id = cur.read_text().strip()
+        d = root / run_id
+        if run_id and d.exists():
+            return run_id, d
+    # else create a new one
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    run_id = stamp if vm_id == DEFAULT_VM_ID else f"{vm_id}_{stamp}"
+    d = root / run_id
+    d.mkdir(parents=True, exist_ok=True)
+    cur.write_text(run_id)
+    return run_id, d
+
+
+class VmState:
+    """Everything the host tracks for one VM."""
+
+    def __init__(self, vm_id: str, run_id: str, run_dir: Path, ip: str | None):
+        self.vm_id = vm_id
+        self.run_id = run_id
+        self.run_dir = run_dir
+        self.store = RunStore(run_dir)
+        self.ip = ip
+        self.sessions = 0
+        self.frames = 0
+        self.bytes = 0
+        self.dedup = 0
+        self.last_seen = 0.0
+        self.clock_offset_ms = None   # VM clock minus host clock (frame_trace.py)
+        self.clock_rtt_ms = None
+        self._lock = threading.Lock()
+
+    def count_saved(self, nbytes: int, dedup: bool):
+        with self._lock:
+            self.frames += 1
+            self.bytes += nbytes
+            self.dedup += int(dedup)
+            self.last_seen = time.time()
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "vm_id": self.vm_id,
+                "ip": self.ip,
+                "run_id": self.run_id,
+                "sessions": self.sessions,
+                "frames": self.frames,
+                "bytes": self.bytes,
+                "dedup": self.dedup,
+                "last_seen": self.last_seen,
+                "clock_offset_ms": self.clock_offset_ms,
+                "clock_rtt_ms": self.clock_rtt_ms,
+            }
+
+
+class VmRegistry:
+    def __init__(self, root: Path, default_ip: str | None = None):
+        self.root = root
+        self.default_ip = default_ip
+        self._vms = {}
+        self._lock = threading.Lock()
+
+    def get(self, vm_id: str, peer_ip: str | None = None) -> VmState:
+        """State for vm_id, opening its run on first contact; remembers its latest IP."""
+        vm_id = safe_vm_id(vm_id)
+        with self._lock:
+            vm = self._vms.get(vm_id)
+            if vm is None:
+                run_id, run_dir = ensure_run_folder(self.root, vm_id)
+                ip = peer_ip or (self.default_ip if vm_id == DEFAULT_VM_ID else None)
+                vm = self._vms[vm_id] = VmState(vm_id, run_id, run_dir, ip)
+                print(f"[HOST] vm={vm_id} run: {run_id}  -> {run_dir}")
+            elif peer_ip:
+                vm.ip = peer_ip
+            return vm
+
+    def session_vm_id(self, vm_id: str | None, peer_ip: str) -> str:
+        """Key for a session: the vm_id the sender named, else DEFAULT_VM_ID or its address."""
+        if vm_id:
+            return vm_id
+        return DEFAULT_VM_ID if peer_ip == self.default_ip else peer_ip
+
+    def find(self, vm_id: str) -> VmState | None:
+        with self._lock:
+            return self._vms.get(safe_vm_id(vm_id))
+
+    def all(self) -> list[VmState]:
+        with self._lock:
+            return list(self._vms.values())
+
+    def ctl_ip(self, vm_id: str) -> str | None:
+        """Where the bridge should send vm_id's control commands."""
+        vm = self.find(vm_id)
+        if vm is not None and vm.ip:
+            return vm.ip
+        return self.default_ip if safe_vm_id(vm_id) == DEFAULT_VM_ID else None
+
+    def write_status(self):
+        body = {"ts": time.time(), "vms": [vm.status() for vm in self.all()]}
+        write_atomic(self.root / STATUS_FILE, json.dumps(body, indent=2).encode("utf-8"))
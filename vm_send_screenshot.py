@@ -1,9 +1,8 @@
 # vm_send_screenshot.py — Simplified, Robust Sender
 # This version prioritizes stability and clear logging.
-# It uses a direct "if hash changed, send" logic.
+# It uses a direct "if the fingerprint changed, send" logic (fingerprint.py).
 
 import os
-import io
 import json
 import time
 import socket
@@ -13,12 +12,13 @@ from pathlib import Path
 from datetime import datetime
 
 # --- DEPENDENCIES ---
-# Make sure these are installed: pip install pillow protobuf
+# Make sure these are installed: pip install pillow protobuf numpy
 try:
-    from PIL import Image
     from screenshot_pb2 import Screenshot
+    from frame_stream import FrameStreamSender
+    import fingerprint
 except ImportError as e:
-    print(f"FATAL: Missing critical dependency. Please run 'pip install pillow protobuf'. Error: {e}")
+    print(f"FATAL: Missing critical dependency. Please run 'pip install pillow protobuf numpy'. Error: {e}")
     exit(1)
 
 # Optional import, the script will work without it.
@@ -33,10 +33,12 @@ HOST_PORT = 5001
 CONTROL_BIND_IP = "0.0.0.0" # Listen on all network interfaces
 CONTROL_BIND_PORT = 5002
 CAPTURE_PATH = Path("/tmp/screen.png")
+VM_ID = os.environ.get("AUROCH_VM_ID")  # unset: the host keys this clone on its address (vm_registry.py)
 SAMPLE_INTERVAL_SEC = 0.5  # Check the screen twice per second
 # ---------------------------------------
 
 # ---- SHARED STATE (for communication between threads) ----
+host_stream = None  # FrameStreamSender, created on first use and reused for every frame
 muted_until_ms = 0
 capture_now_event = threading.Event()
 
@@ -60,20 +62,6 @@ def capture_screen(out_path):
         log(f"ERROR: Screenshot command failed: {e.stderr.decode()}")
         raise  # Let the main loop's error handler catch this
 
-def dhash(image_bytes):
-    """Calculates a simple perceptual hash of an image."""
-    with Image.open(io.BytesIO(image_bytes)) as im:
-        im = im.convert("L").resize((9, 8), Image.Resampling.LANCZOS)
-        pixels = list(im.getdata())
-    hash_bits = 0
-    for row in range(8):
-        for col in range(8):
-            idx = row * 9 + col
-            hash_bits <<= 1
-            if pixels[idx] > pixels[idx + 1]:
-                hash_bits |= 1
-    return hash_bits
-
 def send_to_host(image_bytes):
     """Sends the screenshot to the host UI server."""
     ui_graph = {}
@@ -85,19 +73,65 @@ def send_to_host(image_bytes):
         except Exception as e:
             log(f"Error running perception module: {e}")
             
-    msg = Screenshot(
-        image_data=image_bytes,
+    header = Screenshot(
         timestamp=now_ms(),
         ui_json=json.dumps(ui_graph).encode("utf-8")
-    )
-    data = msg.SerializeToString()
-    log(f"Connecting to host {HOST_IP}:{HOST_PORT}...")
-    with socket.create_connection((HOST_IP, HOST_PORT), timeout=5) as s:
-        s.sendall(len(data).to_bytes(4, "big"))
-        s.sendall(data)
+    ).SerializeToString()
+    global host_stream
+    if host_stream is None:
+        log(f"Opening session to host {HOST_IP}:{HOST_PORT}...")
+        host_stream = FrameStreamSender(HOST_IP, HOST_PORT, vm_id=VM_ID)
+    host_stream.send_frame_split(header, image_bytes)  # image sent raw, after the header
     log("Screenshot sent successfully.")
 
 # ---- CONTROL LISTENER (for UI commands) ----
+def handle_control_command(line, log_prefix):
+    """Runs one command line; every line gets exactly one reply line."""
+    global muted_until_ms
+    if not line:
+        return b"ok\n"
+    obj = json.loads(line)
+    cmd = str(obj.get("cmd", "")).lower()
+
+    if cmd == "mute":
+        muted_until_ms = now_ms() + int(obj.get("ttl_ms", 120000))
+        print(f"{log_prefix} Mute command received.")
+    elif cmd == "unmute":
+        muted_until_ms = 0
+        print(f"{log_prefix} Unmute command received.")
+    elif cmd == "capture_now":
+        capture_now_event.set()
+        print(f"{log_prefix} Capture Now command received.")
+    # "ping" (bridge health check) and unknown commands just get "ok"
+    return b"ok\n"
+
+def control_connection_thread(conn, log_prefix):
+    """
+    One control client. The host bridge keeps connections open and sends several
+    newline-delimited commands over each, so every client gets its own thread.
+    """
+    with conn:
+        buf = b""
+        while True:
+            try:
+                chunk = conn.recv(4096)
+            except OSError:
+                return
+            if not chunk:
+                return
+            buf += chunk
+            while b"\n" in buf:
+                raw, _, buf = buf.partition(b"\n")
+                try:
+                    reply = handle_control_command(raw.decode("utf-8", errors="replace").strip(), log_prefix)
+                except Exception as e:
+                    print(f"{log_prefix} Error processing command: {e}")
+                    reply = b"ok\n"
+                try:
+                    conn.sendall(reply)
+                except OSError:
+                    return
+
 def control_listener_thread():
     log_prefix = f"[{datetime.now().isoformat()}] [VM-CTL]"
     try:
@@ -108,25 +142,7 @@ def control_listener_thread():
             print(f"{log_prefix} Listening for UI commands on {CONTROL_BIND_IP}:{CONTROL_BIND_PORT}")
             while True:
                 conn, _ = s.accept()
-                with conn:
-                    global muted_until_ms
-                    try:
-                        data = conn.recv(1024)
-                        if not data: continue
-                        obj = json.loads(data.decode().strip())
-                        cmd = obj.get("cmd", "").lower()
-
-                        if cmd == "mute":
-                            muted_until_ms = now_ms() + int(obj.get("ttl_ms", 120000))
-                            print(f"{log_prefix} Mute command received.")
-                        elif cmd == "unmute":
-                            muted_until_ms = 0
-                            print(f"{log_prefix} Unmute command received.")
-                        elif cmd == "capture_now":
-                            capture_now_event.set()
-                            print(f"{log_prefix} Capture Now command received.")
-                    except Exception as e:
-                        print(f"{log_prefix} Error processing command: {e}")
+                threading.Thread(target=control_connection_thread, args=(conn, log_prefix), daemon=True).start()
     except Exception as e:
         print(f"{log_prefix} FATAL ERROR: Control listener failed: {e}. The script will continue without UI control.")
 
@@ -138,15 +154,15 @@ def main():
     # Start the control listener in a background thread
     threading.Thread(target=control_listener_thread, daemon=True).start()
 
-    last_sent_hash = None
+    last_sent_fp = None
     
     while True:
         try:
             # --- 1. CAPTURE AND HASH ---
             capture_screen(CAPTURE_PATH)
             img_bytes = CAPTURE_PATH.read_bytes()
-            current_hash = dhash(img_bytes)
-            log(f"Screen captured. Hash: {current_hash:016x}")
+            current_fp = fingerprint.fingerprint(img_bytes)
+            log(f"Screen captured. Hash: {current_fp.dhash:016x}")
             
             # --- 2. DECIDE TO PUBLISH ---
             should_publish = False
@@ -158,7 +174,7 @@ def main():
                 capture_now_event.clear()
             elif now_ms() < muted_until_ms:
                 reason = "Muted by UI"
-            elif current_hash != last_sent_hash:
+            elif fingerprint.changed(current_fp, last_sent_fp):
                 should_publish = True
                 reason = "New screen content detected"
             else:
@@ -168,7 +184,7 @@ def main():
             log(f"Decision: {reason}. Should publish: {should_publish}")
             if should_publish:
                 send_to_host(img_bytes)
-                last_sent_hash = current_hash # CRITICAL: Update state only after a successful send
+                last_sent_fp = current_fp # CRITICAL: Update state only after a successful send
 
         except KeyboardInterrupt:
             log("Keyboard interrupt received. Exiting.")
@@ -1,6 +1,8 @@
 # vm_ui_perception.py
 # Minimal, fast perception on the VM: OCR (Tesseract) + simple CV heuristics.
 # Public API: process_screenshot(image_path: str) -> dict (UI graph)
+#             process_screenshot_bytes(data: bytes) -> dict (same, from encoded image bytes;
+#             used by the host-side pool in host_perception.py)
 
 import cv2
 import numpy as np
@@ -259,7 +261,15 @@ def process_screenshot(image_path: str) -> Dict:
       }
     }
     """
-    img_bgr = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    return _process(cv2.imread(image_path, cv2.IMREAD_COLOR))
+
+
+def process_screenshot_bytes(data: bytes) -> Dict:
+    """process_screenshot() for an encoded image already in memory (no temp file)."""
+    return _process(cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR))
+
+
+def _process(img_bgr) -> Dict:
     if img_bgr is None:
         return {}
 